@@ -1,8 +1,12 @@
 import os
 import time
+import queue
 import threading
 from pymodbus.client import ModbusTcpClient
 
+from scheduler import FixedRateScheduler
+from connection import SyncLink, ModbusExceptionResponse
+
 def _clean(raw: str) -> str:
     if raw is None:
         return ""
@@ -21,11 +25,40 @@ def _env_float(name: str, default: float) -> float:
 MODBUS_IP = _env_str("PLC_IP", "192.168.1.15")
 MODBUS_PORT = _env_int("PLC_PORT", 502)
 DEVICE_ID = _env_int("PLC_DEVICE_ID", 1)
+TIMEOUT_SEC = _env_float("PLC_TIMEOUT_SEC", 3)
 
-MW_BALE_NUMBER = 28000  # %MW28000
-MW_EVENT_WORD  = 70     # %MW70
+MW_BALE_NUMBER = _env_int("PLC_MW_BALE_NUMBER", 28000)  # %MW28000
+MW_EVENT_WORD  = _env_int("PLC_MW_EVENT_WORD", 70)       # %MW70
 POLL_SEC = _env_float("PLC_POLL_SEC", 0.1)
 
+# ---- Register map ----
+# Tag name -> %MW address. Tags are read together: the planner below merges
+# nearby addresses into as few block reads as possible, so adding a tag next
+# to an existing one costs no extra round-trip.
+PLC_TAGS = {
+    "BaleNumber": MW_BALE_NUMBER,
+    "EventWord": MW_EVENT_WORD,
+}
+
+MAX_BLOCK_WORDS = 125                      # Modbus limit for one read_holding_registers
+MAX_GAP_WORDS = _env_int("PLC_MAX_GAP", 32)  # unused words we'd rather read than pay a round-trip
+
+# ---- Machine events ----
+class MachineEvent:
+    """A change seen by the PLC poller: kind is the MachineState field that changed."""
+    __slots__ = ("t", "kind", "old", "new")
+
+    def __init__(self, t: float, kind: str, old, new):
+        self.t = t          # time.monotonic() of the PLC read that saw the change
+        self.kind = kind    # "BaleNumber" | "RamGoesForward" | "RamGoesReturn"
+        self.old = old
+        self.new = new
+
+    def __repr__(self):
+        return f"MachineEvent({self.kind}: {self.old} -> {self.new} @ {self.t:.3f})"
+
+EVENT_QUEUE_SIZE = 1000
+
 # ---- Machine State Class ----
 class MachineState:
     def __init__(self):
@@ -34,8 +67,46 @@ class MachineState:
         self.RamGoesForward = False
         self.RamGoesReturn = False
         self.ActiveEvents = []
+        self.Tags = {}
+        self.CycleMs = 0.0      # duration of the last PLC read cycle
+        self.CycleReads = 0     # Modbus requests in that cycle
+
+        self._subscribers = []
+        self._sub_lock = threading.Lock()
+
+    def subscribe(self, maxsize: int = EVENT_QUEUE_SIZE) -> queue.Queue:
+        """Queue receiving every MachineEvent from now on (oldest dropped if the reader stalls)."""
+        q = queue.Queue(maxsize)
+        with self._sub_lock:
+            self._subscribers.append(q)
+        return q
+
+    def unsubscribe(self, q: queue.Queue):
+        with self._sub_lock:
+            if q in self._subscribers:
+                self._subscribers.remove(q)
+
+    def _publish(self, events: list[MachineEvent]):
+        with self._sub_lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            for ev in events:
+                try:
+                    q.put_nowait(ev)
+                except queue.Full:
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        pass
+                    q.put_nowait(ev)
+
+    def update_from_tags(self, values: dict[str, int]):
+        self.Tags = values
+        self.update_from_modbus(values["BaleNumber"], values["EventWord"])
+
+    def update_from_modbus(self, bale_number: int, event_word: int, t: float | None = None):
+        old = (self.RamGoesForward, self.RamGoesReturn, self.BaleNumber)
 
-    def update_from_modbus(self, bale_number: int, event_word: int):
         self.BaleNumber = bale_number
         self.EventWord = event_word
 
@@ -50,67 +121,195 @@ class MachineState:
             names.append("RamGoesReturn")
         self.ActiveEvents = names
 
+        # Ram edges first, bale number last: a stroke ending in the same PLC
+        # cycle as the bale change still belongs to the finished bale.
+        t = time.monotonic() if t is None else t
+        events = []
+        if self.RamGoesForward != old[0]:
+            events.append(MachineEvent(t, "RamGoesForward", old[0], self.RamGoesForward))
+        if self.RamGoesReturn != old[1]:
+            events.append(MachineEvent(t, "RamGoesReturn", old[1], self.RamGoesReturn))
+        if self.BaleNumber != old[2]:
+            events.append(MachineEvent(t, "BaleNumber", old[2], self.BaleNumber))
+        if events:
+            self._publish(events)
 
-# ---- Persistent state object (importable) ----
-state = MachineState()
 
-# ---- Internal worker thread ----
-_stop_event = threading.Event()
-_thread = None
+# ---- Read planner ----
+class ReadBlock:
+    """One contiguous read_holding_registers request and the tags it covers."""
+    __slots__ = ("start", "count", "tags")
+
+    def __init__(self, start: int, count: int, tags: list[tuple[str, int]]):
+        self.start = start
+        self.count = count
+        self.tags = tags  # (name, offset into block)
 
-def _read_word(client: ModbusTcpClient, address: int) -> int:
-    resp = client.read_holding_registers(address, count=1, device_id=DEVICE_ID)
-    if resp.isError():
-        raise RuntimeError(f"Modbus error reading %MW{address}: {resp}")
-    return int(resp.registers[0])
+    def decode(self, registers: list[int], values: dict[str, int]):
+        for name, offset in self.tags:
+            values[name] = int(registers[offset])
 
-def _poll_loop():
-    client = ModbusTcpClient(MODBUS_IP, port=MODBUS_PORT, timeout=3)
+    def __repr__(self):
+        return f"ReadBlock(%MW{self.start}..%MW{self.start + self.count - 1}, {[n for n, _ in self.tags]})"
 
-    while not _stop_event.is_set():
-        try:
-            if not client.connect():
+def plan_reads(
+    tags: dict[str, int],
+    max_gap: int = MAX_GAP_WORDS,
+    max_words: int = MAX_BLOCK_WORDS,
+) -> list[ReadBlock]:
+    """Coalesce tag addresses into the fewest contiguous blocks within max_words."""
+    blocks = []
+    for name, address in sorted(tags.items(), key=lambda kv: kv[1]):
+        last = blocks[-1] if blocks else None
+        if (
+            last is not None
+            and address - (last.start + last.count) <= max_gap
+            and address - last.start + 1 <= max_words
+        ):
+            last.count = max(last.count, address - last.start + 1)
+            last.tags.append((name, address - last.start))
+        else:
+            blocks.append(ReadBlock(address, 1, [(name, 0)]))
+    return blocks
+
+READ_PLAN = plan_reads(PLC_TAGS)
+
+def read_tags(client: ModbusTcpClient, plan: list[ReadBlock] = READ_PLAN, device_id: int = DEVICE_ID) -> dict[str, int]:
+    values = {}
+    for block in plan:
+        resp = client.read_holding_registers(block.start, count=block.count, device_id=device_id)
+        if resp.isError():
+            raise ModbusExceptionResponse(f"Modbus error reading {block}: {resp}")
+        block.decode(resp.registers, values)
+    return values
+
+async def read_tags_async(client, plan: list[ReadBlock] = READ_PLAN, device_id: int = DEVICE_ID) -> dict[str, int]:
+    """read_tags for a pymodbus AsyncModbusTcpClient."""
+    values = {}
+    for block in plan:
+        resp = await client.read_holding_registers(block.start, count=block.count, device_id=device_id)
+        if resp.isError():
+            raise ModbusExceptionResponse(f"Modbus error reading {block}: {resp}")
+        block.decode(resp.registers, values)
+    return values
+
+# ---- PLC poller ----
+class PlcPoller:
+    """
+    One PLC: its connection settings, read plan and MachineState. start()
+    polls it on a background thread (ACQ_MODE=threads); the asyncio engine
+    only uses the state / plan and does the reads itself.
+    """
+
+    def __init__(
+        self,
+        ip: str = MODBUS_IP,
+        port: int = MODBUS_PORT,
+        device_id: int = DEVICE_ID,
+        timeout: float = TIMEOUT_SEC,
+        poll_sec: float = POLL_SEC,
+        tags: dict[str, int] = PLC_TAGS,
+        state: MachineState | None = None,
+        line_id: int = 1,
+        name: str = "plc",
+    ):
+        self.ip = ip
+        self.port = port
+        self.device_id = device_id
+        self.timeout = timeout
+        self.poll_sec = poll_sec
+        self.plan = plan_reads(tags)
+        self.state = state or MachineState()
+        self.line_id = line_id
+        self.name = name
+        self.link = None            # SyncLink of the polling thread
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def apply(self, values: dict[str, int], elapsed: float):
+        """Record one successful read cycle (elapsed seconds) and publish its events."""
+        self.state.CycleMs = round(elapsed * 1000.0, 2)
+        self.state.CycleReads = len(self.plan)
+        self.state.update_from_tags(values)
+
+    def _poll_loop(self):
+        # The link keeps the session open and backs off after failures; a tick
+        # while it is backing off costs nothing
+        self.link = link = SyncLink("plc", self.ip, self.port, self.timeout, self.line_id)
+        scheduler = FixedRateScheduler(self.name, self.poll_sec)
+
+        while not self._stop_event.is_set():
+            scheduler.wait()
+            try:
+                values = link.call(read_tags, self.plan, self.device_id)
+                if values is not None:
+                    self.apply(values, link.last_rtt)
+            except Exception:
+                # don’t crash thread; retry
                 time.sleep(1.0)
-                continue
+                scheduler.reset()
 
-            bale_number = _read_word(client, MW_BALE_NUMBER)
-            event_word  = _read_word(client, MW_EVENT_WORD)
+        link.close()
 
-            state.update_from_modbus(bale_number, event_word)
-            time.sleep(POLL_SEC)
+    def start(self):
+        """Start background Modbus polling (non-blocking)."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._poll_loop, name=self.name, daemon=True)
+        self._thread.start()
 
-        except Exception:
-            # don’t crash thread; retry
-            time.sleep(1.0)
+    def stop(self):
+        """Stop background Modbus polling."""
+        self._stop_event.set()
 
-    try:
-        client.close()
-    except Exception:
-        pass
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def stats(self) -> dict:
+        st = self.state
+        return {
+            "line_id": self.line_id,
+            "running": self.is_running(),
+            "bale_number": st.BaleNumber,
+            "event_word": st.EventWord,
+            "active_events": st.ActiveEvents,
+            "tags": st.Tags,
+            "cycle_ms": st.CycleMs,
+            "cycle_reads": st.CycleReads,
+            "read_plan": [repr(b) for b in self.plan],
+        }
+
+
+# line_id -> PlcPoller of the lines running in this process, for /api/plc
+POLLERS = {}
+
+# ---- Persistent state / poller objects (importable, single-line defaults) ----
+state = MachineState()
+poller = PlcPoller(state=state)
 
 def start():
-    """Start background Modbus polling (non-blocking)."""
-    global _thread
-    if _thread and _thread.is_alive():
-        return
-    _stop_event.clear()
-    _thread = threading.Thread(target=_poll_loop, daemon=True)
-    _thread.start()
+    """Start background Modbus polling of the default PLC (non-blocking)."""
+    POLLERS.setdefault(poller.line_id, poller)
+    poller.start()
 
 def stop():
-    """Stop background Modbus polling."""
-    _stop_event.set()
+    """Stop background Modbus polling of the default PLC."""
+    poller.stop()
 
-# Imported -> non-blocking background loop
-start()
+def is_running() -> bool:
+    return poller.is_running()
 
 if __name__ == "__main__":
+    start()
     print("Modbus polling started (Ctrl+C to stop).")
+    print("Read plan:", READ_PLAN)
     try:
         while True:
             print(
                 f"BaleNumber: {state.BaleNumber} | EventWord: {state.EventWord} | "
-                f"RamF: {state.RamGoesForward} | RamR: {state.RamGoesReturn}"
+                f"RamF: {state.RamGoesForward} | RamR: {state.RamGoesReturn} | "
+                f"Cycle: {state.CycleMs} ms / {state.CycleReads} reads"
             )
             time.sleep(0.5)
     except KeyboardInterrupt:
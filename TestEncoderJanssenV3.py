@@ -1,212 +1,120 @@
-from pymodbus.client import ModbusTcpClient
-from datetime import datetime
 import time
-import math
-import os
-
-from Modbus_TCPV3 import state
-from db import init_db, insert_sample
-
-# --- Config via environment (so it works on Edge/IEM too) ---
-MASTER_IP = os.getenv("ENCODER_IP", "192.168.1.250")
-MODBUS_PORT = int(os.getenv("ENCODER_PORT", "502"))
-POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", "0.1"))
-
-PDIN_BASE_ADDR = 0
-WORD_COUNT = 16
-
-HEARTBEAT_FILE = os.getenv("HEARTBEAT_FILE", "/tmp/collector_heartbeat.txt")
-ENCODER_TIMEOUT = float(os.getenv("ENCODER_TIMEOUT", "3"))
-
-# Baler variables from PLC
-iBaleNumber = 0
-iRamGoesForward = False
-
-# Initialize variables
-sBaleNumber = 0
-sReading = True
-sBaleReady = False
-sPreviousRamGoesForward = False
-
-sRounds = 0.0
-sRoundCounter = 0.0
-sEncoderPrevious = None
-sOneRoundRaw = 35999.0
-sDistance = 0.0
-
-sBaleLength_Stroke = [0.0] * 10  # RAM to store bale lengths
-sBale_length_Encoder = 0.0
-sRounds_Encoder = 0.0
-sRamdistance = 0.0
-
-qBaleNumber = None
-qBale_length_Encoder = 0.0
-qBaleLength_Stroke = [0.0] * 10
-
-def heartbeat():
-    # Update heartbeat every loop. If this stops updating, watchdog will restart container.
-    try:
-        with open(HEARTBEAT_FILE, "w") as f:
-            f.write(str(time.time()))
-    except Exception:
-        pass
+import threading
 
-def make_encoder_client():
-    return ModbusTcpClient(MASTER_IP, port=MODBUS_PORT, timeout=ENCODER_TIMEOUT)
+import Modbus_TCPV3
+from connection import SyncLink, ModbusExceptionResponse
+from checkpoint import Checkpointer, CHECKPOINT_SEC
+from collector import Collector, heartbeat, PDIN_BASE_ADDR, WORD_COUNT
+from db import init_db, start_v1_migration, BackgroundWriter
+from lines import LineConfig, configured
+from scheduler import FixedRateScheduler
+from maintenance import maintenance
+from metrics import log
 
-client = None
+# Blocking (thread) collector: per line a PLC poller thread + an encoder loop thread.
+# See acquisition.py for the asyncio engine (ACQ_MODE=async).
 
-init_db()
+_stop_event = threading.Event()
 
-while True:
-    heartbeat()
+def stop():
+    """Ask the collector loops to exit (buffered samples are flushed on the way out)."""
+    _stop_event.set()
 
-    # Always keep loop alive (never crash out)
-    try:
-        # PLC variables from Modbus_TCPV3 background thread
-        iBaleNumber = int(state.BaleNumber)
-        iRamGoesForward = bool(state.RamGoesForward)
-
-        # Initialize sBaleNumber once from PLC if still 0
-        if sBaleNumber == 0:
-            sBaleNumber = iBaleNumber
-
-        # Bale becomes "ready" when PLC bale number changes (and we already had a previous bale)
-        if (iBaleNumber != sBaleNumber) and (sBaleNumber != 0):
-            sBaleReady = True
-        else:
-            sBaleReady = False
-
-        # When bale finished -> snapshot + reset
-        if sBaleReady and iBaleNumber > 0:
-            print("Bale is ready")
-            print(f"sBaleReady: {sBaleReady}")
-
-            sBale_length_Encoder = sDistance
-            qBale_length_Encoder = sDistance
-            sRounds_Encoder = round(sRounds, 2)
-
-            # Copy stroke list into q list
-            qBaleLength_Stroke = sBaleLength_Stroke[:]
-
-            # Clear RAM for next bale
-            sBaleLength_Stroke = [0.0] * 10
-
-            qBaleNumber = sBaleNumber
-            sBaleNumber = iBaleNumber
-
-            sReading = False
-            sRoundCounter = 0.0
-            sDistance = 0.0
-            sRamdistance = 0.0
-            sRounds = 0.0
-
-        elif not sBaleReady:
-            sReading = True
-
-        # --- Ensure encoder client connected (self-healing) ---
-        if client is None:
-            client = make_encoder_client()
-
-        if not client.connect():
-            # encoder unreachable right now
-            time.sleep(1.0)
-            continue
-
-        if sReading:
-            # Read encoder registers
+
+def read_encoder(client) -> list[int]:
+    result = client.read_input_registers(address=PDIN_BASE_ADDR, count=WORD_COUNT)
+    if result.isError():
+        raise ModbusExceptionResponse(f"Failed to read registers: {result}")
+    return result.registers
+
+
+class EncoderLoop:
+    """Encoder polling loop of one line; the line's PLC is polled by its PlcPoller thread."""
+
+    def __init__(self, line: LineConfig, writer):
+        self.line = line
+        self.plc_poller = line.plc_poller()
+        checkpoint = Checkpointer(line.id) if CHECKPOINT_SEC > 0 else None
+        self.collector = Collector(self.plc_poller.state, writer, line_id=line.id, checkpoint=checkpoint)
+        self.scheduler = FixedRateScheduler(f"encoder-{line.id}", line.poll_interval)
+        self.encoder = SyncLink("encoder", line.encoder_ip, line.encoder_port, line.encoder_timeout, line.id)
+        self._thread = None
+
+    def _pause(self):
+        time.sleep(1.0)
+        self.scheduler.reset()
+
+    def run(self):
+        line_id = self.line.id
+        while not _stop_event.is_set():
+            self.scheduler.wait()
+            heartbeat()
+
+            # Always keep loop alive (never crash out)
             try:
-                result = client.read_input_registers(address=PDIN_BASE_ADDR, count=WORD_COUNT)
-                if (not result) or (not hasattr(result, "registers")):
-                    raise RuntimeError("Failed to read registers")
+                self.collector.poll_events()
+
+                # Read encoder registers (None: read failed or the link is backing off)
+                registers = self.encoder.call(read_encoder)
+                if registers is None:
+                    continue
+
+                # Process register data
+                self.collector.process(registers)
+
             except Exception as e:
-                print("Encoder read error:", e)
-                try:
-                    client.close()
-                except Exception:
-                    pass
-                client = None
-                time.sleep(1.0)
+                # Never stop working: log error and continue.
+                log.exception("line %d main loop error: %s", line_id, e)
+                self._pause()
                 continue
-
-            # Rising/falling edge detection of ram forward signal
-            if (iRamGoesForward is True) and (sPreviousRamGoesForward is False):  # Rising edge
-                sPreviousRamGoesForward = True
-
-            elif (iRamGoesForward is False) and (sPreviousRamGoesForward is True):  # Falling edge
-                sPreviousRamGoesForward = False
-
-                # Store ram stroke length when falling edge happens
-                if sBaleNumber == iBaleNumber:
-                    print("Set ram distance")
-                    time.sleep(1)  # small settle time 
-
-                    # distance since last strokes
-                    sRamdistance = sDistance - sum(sBaleLength_Stroke)
-                    sRamdistance = round(sRamdistance, 2)
-
-                    for i in range(10):
-                        if sBaleLength_Stroke[i] == 0:
-                            sBaleLength_Stroke[i] = sRamdistance
-                            break
-
-            # Process register data
-            words = result.registers
-            timestamp = datetime.now()
-
-            data_valid = "YES" if words[1] != 0 else "NO"
-
-            encoder_raw = int(words[2])
-            if sEncoderPrevious is None:
-                sEncoderPrevious = encoder_raw
-
-            # Track difference with turn-over adjustment
-            if (sEncoderPrevious - encoder_raw) > 30000:
-                sRoundCounter += (sOneRoundRaw - sEncoderPrevious)
-                sEncoderPrevious = 0
-            elif (encoder_raw - sEncoderPrevious) > 30000:
-                sRoundCounter -= (sOneRoundRaw - encoder_raw)
-                sEncoderPrevious = sOneRoundRaw
-
-            diff = encoder_raw - sEncoderPrevious
-            sRoundCounter += diff
-            sEncoderPrevious = encoder_raw
-
-            sRounds = sRoundCounter / sOneRoundRaw
-            sDistance = round((sRounds * math.pi * 23), 2)
-            rounds = round(sRounds, 2)
-
-            # Print results
-            print(
-                f"{timestamp} | data_valid: {data_valid} | BaleNumber i/s: {(sBaleNumber, iBaleNumber)} | "
-                f"sBaleReady: {sBaleReady} | iRamGoesForward: {iRamGoesForward} | EncoderDisRaw: {words[2]:04d} | "
-                f"Rounds: {rounds} | Distance: {sDistance} | sRamdistance: {sRamdistance} | "
-                f"StrokeLength: {sBaleLength_Stroke[:]} | qBaleNumber {state.BaleNumber} | "
-                f"qBale_Length: {qBale_length_Encoder} | qStrokeLength {qBaleLength_Stroke[:]}"
-            )
-
-            # Store into SQLite
-            insert_sample(
-                ts=timestamp,
-                data_valid=(data_valid == "YES"),
-                bale_s=int(sBaleNumber) if sBaleNumber is not None else None,
-                bale_i=int(iBaleNumber) if iBaleNumber is not None else None,
-                bale_ready=bool(sBaleReady),
-                ram_forward=bool(iRamGoesForward),
-                encoder_raw=int(words[2]) if words and len(words) > 2 else None,
-                rounds=float(rounds) if rounds is not None else None,
-                distance=float(sDistance) if sDistance is not None else None,
-                ram_distance=float(sRamdistance) if sRamdistance is not None else None,
-                stroke_list=[float(x) for x in sBaleLength_Stroke],
-                q_bale_number=int(qBaleNumber) if qBaleNumber is not None else None,
-                q_bale_length=float(qBale_length_Encoder) if qBale_length_Encoder is not None else None,
-                q_stroke_list=[float(x) for x in qBaleLength_Stroke],
-            )
-
-        time.sleep(POLL_INTERVAL)
-
-    except Exception as e:
-        # Never stop working: print error and continue.
-        print("Main loop error:", e)
-        time.sleep(1.0)
-        continue
+        self.encoder.close()
+
+    def start(self):
+        self.plc_poller.start()
+        self._thread = threading.Thread(target=self.run, name=f"encoder-{self.line.id}", daemon=True)
+        self._thread.start()
+
+    def is_alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and self.plc_poller.is_running()
+
+
+def main() -> bool:
+    """
+    Collect from every configured line until stop(); returns early if a
+    line's thread dies. True when it was stopped, False after a death.
+    """
+    init_db()
+    start_v1_migration()
+    maintenance.start()
+    writer = BackgroundWriter()
+    loops = [EncoderLoop(line, writer) for line in configured()]
+    dead = []
+    try:
+        for loop in loops:
+            Modbus_TCPV3.POLLERS[loop.line.id] = loop.plc_poller
+            loop.start()
+        # run_all's watchdog restarts the container (supervised: only this process) once this returns
+        while not _stop_event.wait(1.0):
+            dead = [loop.line.id for loop in loops if not loop.is_alive()]
+            if dead:
+                log.error("collector thread of line(s) %s died", dead)
+                break
+    finally:
+        # Flush whatever is still buffered on shutdown
+        _stop_event.set()
+        for loop in loops:
+            loop.plc_poller.stop()
+        for loop in loops:
+            if loop._thread is not None:
+                loop._thread.join(timeout=5)
+            loop.collector.save_checkpoint()
+        maintenance.stop()
+        writer.close()
+    return not dead
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        stop()
@@ -0,0 +1,146 @@
+import os
+import time
+import asyncio
+
+import Modbus_TCPV3
+from connection import AsyncLink, ModbusExceptionResponse
+from checkpoint import Checkpointer, CHECKPOINT_SEC
+from collector import Collector, heartbeat, PDIN_BASE_ADDR, WORD_COUNT
+from db import init_db, start_v1_migration, BackgroundWriter
+from lines import LineConfig, configured
+from scheduler import FixedRateScheduler
+from maintenance import maintenance
+from metrics import log
+
+# threads: TestEncoderJanssenV3 loops + Modbus_TCPV3 threads (run_all starts them)
+# async:   AcquisitionEngine below, running inside the webapp's event loop
+ACQ_MODE = os.getenv("ACQ_MODE", "threads").strip().lower()
+
+
+async def read_encoder(client) -> list[int]:
+    result = await client.read_input_registers(PDIN_BASE_ADDR, count=WORD_COUNT)
+    if result.isError():
+        raise ModbusExceptionResponse(f"Failed to read registers: {result}")
+    return result.registers
+
+
+class LineAcquisition:
+    """
+    Polls one line's encoder and PLC as two tasks, each on its own fixed-rate
+    scheduler (no sleep-after-work drift). PLC reads feed MachineState events
+    that the encoder task picks up on its next tick, as the PLC thread does in
+    threads mode. A slow or failing device (timeout, backoff) only delays its
+    own task; the other keeps polling.
+    """
+
+    def __init__(self, line: LineConfig, writer):
+        self.line = line
+        self.plc_poller = line.plc_poller()
+        self.checkpoint = Checkpointer(line.id) if CHECKPOINT_SEC > 0 else None
+        self.collector = Collector(self.plc_poller.state, writer, line_id=line.id, checkpoint=self.checkpoint)
+        self.encoder = AsyncLink("encoder", line.encoder_ip, line.encoder_port, line.encoder_timeout, line.id)
+        self.plc = AsyncLink("plc", line.plc_ip, line.plc_port, line.plc_timeout, line.id)
+        self.scheduler = FixedRateScheduler(f"acquisition-{line.id}", line.poll_interval)
+        self.plc_scheduler = FixedRateScheduler(self.plc_poller.name, self.plc_poller.poll_sec)  # as in threads mode
+        self.cycle_ms = 0.0
+
+    # ---- main loops ----
+    async def _encoder_loop(self):
+        while True:
+            await self.scheduler.wait_async()
+            heartbeat()
+            t0 = time.perf_counter()
+            words = await self.encoder.call(read_encoder)
+
+            # Always keep loop alive (never crash out)
+            try:
+                self.collector.poll_events()
+                if words is not None:
+                    self.collector.process(words)
+            except Exception as e:
+                log.exception("line %d main loop error: %s", self.line.id, e)
+
+            self.cycle_ms = round((time.perf_counter() - t0) * 1000.0, 2)
+
+    async def _plc_loop(self):
+        while True:
+            await self.plc_scheduler.wait_async()
+            plc = await self.plc.call(Modbus_TCPV3.read_tags_async, self.plc_poller.plan, self.plc_poller.device_id)
+            try:
+                if plc is not None:
+                    self.plc_poller.apply(plc, self.plc.last_rtt)
+            except Exception as e:
+                log.exception("line %d PLC loop error: %s", self.line.id, e)
+
+    async def run(self):
+        try:
+            await asyncio.gather(self._encoder_loop(), self._plc_loop())
+        finally:
+            self.collector.save_checkpoint()
+            self.encoder.close()
+            self.plc.close()
+
+    def stats(self) -> dict:
+        return {
+            "line_id": self.line.id,
+            "name": self.line.name,
+            "encoder_ms": self.encoder.last_rtt_ms,
+            "plc_ms": self.plc.last_rtt_ms,
+            "cycle_ms": self.cycle_ms,
+            "timing": self.scheduler.stats(),
+            "plc_timing": self.plc_scheduler.stats(),
+            "checkpoint": self.checkpoint.stats() if self.checkpoint is not None else None,
+        }
+
+
+class AcquisitionEngine:
+    """
+    Runs every configured line (lines.configured()) as its own task on one
+    asyncio loop; all of them hand samples to one shared BackgroundWriter.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.writer = None
+        self._task = None
+
+    async def run(self):
+        init_db()
+        start_v1_migration()
+        maintenance.start()
+        self.writer = BackgroundWriter()
+        self.lines = [LineAcquisition(line, self.writer) for line in configured()]
+        for acq in self.lines:
+            Modbus_TCPV3.POLLERS[acq.line.id] = acq.plc_poller
+        try:
+            await asyncio.gather(*(acq.run() for acq in self.lines))
+        finally:
+            maintenance.stop()
+            await asyncio.to_thread(self.writer.close)
+
+    def start(self):
+        """Schedule the engine on the running event loop (e.g. FastAPI lifespan)."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run(), name="acquisition")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def stats(self) -> dict:
+        return {
+            "running": self.is_running(),
+            "lines": [acq.stats() for acq in self.lines],
+        }
+
+
+# ---- Persistent engine object (importable, started by webapp in async mode) ----
+engine = AcquisitionEngine()
@@ -0,0 +1,393 @@
+import os
+import json
+import time
+from datetime import datetime
+
+import numpy as np
+
+import db
+
+# ---- Analytics configuration ----
+ANALYTICS_BATCH = int(os.getenv("ANALYTICS_BATCH", "50"))            # bales computed per sample load
+OUTLIER_Z = float(os.getenv("ANALYTICS_OUTLIER_Z", "3.5"))           # robust z-score (median / MAD)
+
+# Sample columns needed for the per-bale metrics (NULLs mapped so they fit typed arrays)
+_SAMPLE_DTYPE = np.dtype([
+    ("ts_ms", np.int64), ("bale_s", np.int64), ("distance", np.float64), ("ram_forward", np.int8),
+    ("line_id", np.int64),
+])
+_SAMPLE_SQL = """
+SELECT ts_ms, IFNULL(bale_s, -1), IFNULL(distance, 0.0), ram_forward, line_id
+FROM samples
+WHERE id >= ? AND id <= ? AND +ts_ms >= ? AND +ts_ms < ?
+ORDER BY id
+"""
+
+STAT_KEYS = (
+    "samples", "duration_s", "ram_time_s", "ram_distance", "ram_speed_mean", "ram_speed_max",
+    "stroke_count", "stroke_mean", "stroke_std",
+)
+
+_UPSERT_SQL = f"""
+INSERT OR REPLACE INTO bale_stats (bale_id, {", ".join(STAT_KEYS)})
+VALUES (?, {", ".join("?" for _ in STAT_KEYS)})
+"""
+
+
+def load_samples(con, lo_ms: int, hi_ms: int) -> np.ndarray:
+    """Samples with lo_ms <= ts_ms < hi_ms as one structured array (straight from the cursor)."""
+    span = db.id_range(con, lo_ms, hi_ms)
+    if span is None:
+        return np.empty(0, dtype=_SAMPLE_DTYPE)
+    cur = con.cursor()
+    cur.row_factory = None  # plain tuples, as fromiter expects
+    cur.execute(_SAMPLE_SQL, (span[0], span[1], lo_ms, hi_ms))
+    return np.fromiter(cur, dtype=_SAMPLE_DTYPE)
+
+
+def stroke_matrix(stroke_jsons) -> np.ndarray:
+    """(bales x slots) stroke lengths, NaN where a slot is empty."""
+    rows = [db.parse_strokes(s) for s in stroke_jsons]
+    width = max((len(r) for r in rows), default=0)
+    m = np.full((len(rows), width), np.nan)
+    for i, r in enumerate(rows):
+        m[i, :len(r)] = r
+    m[m <= 0] = np.nan
+    return m
+
+
+def stroke_stats(m: np.ndarray):
+    """Per-bale stroke count, mean and (population) stdev from a stroke_matrix."""
+    count = np.sum(~np.isnan(m), axis=1)
+    total = np.nansum(m, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(count > 0, total / np.maximum(count, 1), np.nan)
+        var = np.where(count > 0, np.nansum((m - mean[:, None]) ** 2, axis=1) / np.maximum(count, 1), np.nan)
+    return count, mean, np.sqrt(var)
+
+
+def ram_stats(s: np.ndarray, numbers: np.ndarray):
+    """
+    Per bale number: sample count, duration, ram-forward time and distance,
+    mean and peak ram speed. Speed is distance over time between consecutive
+    samples of the same bale while the ram goes forward (distance units / s).
+    """
+    n = len(numbers)
+    out = {k: np.zeros(n) for k in ("samples", "duration_s", "ram_time_s", "ram_distance")}
+    out["ram_speed_max"] = np.full(n, np.nan)
+    if len(s) == 0 or n == 0:
+        out["ram_speed_mean"] = np.full(n, np.nan)
+        return out
+
+    # Map each sample to its bale's position in `numbers` (-1: not one of them)
+    order = np.argsort(numbers)
+    pos = np.searchsorted(numbers[order], s["bale_s"])
+    pos = np.clip(pos, 0, n - 1)
+    idx = np.where(numbers[order][pos] == s["bale_s"], order[pos], -1)
+    hit = idx >= 0
+
+    out["samples"] = np.bincount(idx[hit], minlength=n).astype(float)
+    ts = s["ts_ms"]
+    first = np.full(n, np.iinfo(np.int64).max)
+    last = np.full(n, np.iinfo(np.int64).min)
+    np.minimum.at(first, idx[hit], ts[hit])
+    np.maximum.at(last, idx[hit], ts[hit])
+    out["duration_s"] = np.where(out["samples"] > 0, (last - first) / 1000.0, 0.0)
+
+    # Consecutive pairs inside one bale with the ram going forward
+    dt = np.diff(ts) / 1000.0  # from integer ms (epoch seconds as float lose precision)
+    dd = np.diff(s["distance"])
+    pair = hit[1:] & (idx[1:] == idx[:-1]) & (s["ram_forward"][:-1] == 1) & (dt > 0) & (dd >= 0)
+    b = idx[1:][pair]
+    out["ram_time_s"] = np.bincount(b, weights=dt[pair], minlength=n)
+    out["ram_distance"] = np.bincount(b, weights=dd[pair], minlength=n)
+    np.fmax.at(out["ram_speed_max"], b, dd[pair] / dt[pair])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out["ram_speed_mean"] = np.where(out["ram_time_s"] > 0, out["ram_distance"] / out["ram_time_s"], np.nan)
+    return out
+
+
+def _ms(iso: str | None) -> int | None:
+    return int(datetime.fromisoformat(iso).timestamp() * 1000) if iso else None
+
+
+def compute(con, bales: list) -> list[tuple]:
+    """
+    bale_stats rows for bales rows (id, bale_number, start_ts, end_ts,
+    stroke_json, line_id), one sample load. Bale numbers are per line, so
+    the ram metrics are worked out line by line.
+    """
+    count, mean, std = stroke_stats(stroke_matrix([b["stroke_json"] for b in bales]))
+
+    spans = [(_ms(b["start_ts"]), _ms(b["end_ts"])) for b in bales]
+    starts = [lo for lo, _ in spans if lo is not None]
+    ends = [hi for _, hi in spans if hi is not None]
+    samples = load_samples(con, min(starts), max(ends) + 1000) if starts and ends else None
+    ram = {k: np.full(len(bales), np.nan) for k in STAT_KEYS[:6]}
+    ram["samples"] = np.zeros(len(bales))
+
+    lines = np.array([b["line_id"] for b in bales], dtype=np.int64)
+    for line in np.unique(lines):
+        sel = np.flatnonzero(lines == line)
+        numbers = np.array([bales[i]["bale_number"] for i in sel], dtype=np.int64)
+        if samples is not None and len(np.unique(numbers)) == len(numbers):
+            one = ram_stats(samples[samples["line_id"] == line], numbers)
+            for k in one:
+                ram[k][sel] = one[k]
+            continue
+        # Bale number seen twice in one batch (PLC counter reset): one bale at a time
+        for i in sel:
+            lo, hi = spans[i]
+            if lo is None or hi is None:
+                continue
+            s = load_samples(con, lo, hi + 1000)
+            one = ram_stats(s[s["line_id"] == line], numbers[sel == i])
+            for k in one:
+                ram[k][i] = one[k][0]
+
+    def val(x):
+        x = float(x)
+        return None if np.isnan(x) else round(x, 4)
+
+    return [
+        (b["id"], int(ram["samples"][i]), val(ram["duration_s"][i]), val(ram["ram_time_s"][i]),
+         val(ram["ram_distance"][i]), val(ram["ram_speed_mean"][i]), val(ram["ram_speed_max"][i]),
+         int(count[i]), val(mean[i]), val(std[i]))
+        for i, b in enumerate(bales)
+    ]
+
+
+def refresh(con, bale_ids: list[int] | None = None) -> int:
+    """
+    Compute bale_stats for finished bales that have none yet (all of them, or
+    only bale_ids). Bales never change once written, so rows are computed
+    once and served from the table afterwards. con may be read-only (the web
+    app's pooled readers): the results are written on a connection of their own.
+    """
+    sql = """
+        SELECT b.id, b.bale_number, b.start_ts, b.end_ts, b.stroke_json, b.line_id
+        FROM bales b LEFT JOIN bale_stats st ON st.bale_id = b.id
+        WHERE st.bale_id IS NULL
+    """
+    params = ()
+    if bale_ids is not None:
+        if not bale_ids:
+            return 0
+        sql += f" AND b.id IN ({', '.join('?' for _ in bale_ids)})"
+        params = tuple(bale_ids)
+    missing = con.execute(sql + " ORDER BY b.id", params).fetchall()
+
+    if not missing:
+        return 0
+
+    done = 0
+    with db.connect() as out:
+        for i in range(0, len(missing), ANALYTICS_BATCH):
+            rows = compute(con, missing[i:i + ANALYTICS_BATCH])
+            with out:
+                out.executemany(_UPSERT_SQL, rows)
+            done += len(rows)
+    return done
+
+
+BALE_STATS_SELECT = f"""
+SELECT b.id, b.line_id, b.bale_number, b.start_ts, b.end_ts, b.length, b.rounds,
+       {", ".join("st." + k for k in STAT_KEYS)}
+FROM bales b JOIN bale_stats st ON st.bale_id = b.id
+"""
+
+
+def bale_stats(con, limit: int = 100, before: int | None = None, bale_number: int | None = None,
+               line: int | None = None) -> list[dict]:
+    """Per-bale metrics, newest first (computed on first request, then cached in bale_stats)."""
+    where, params = [], []
+    if line is not None:
+        where.append("b.line_id = ?")
+        params.append(line)
+    if before is not None:
+        where.append("b.id < ?")
+        params.append(before)
+    if bale_number is not None:
+        where.append("b.bale_number = ?")
+        params.append(bale_number)
+    cond = (" WHERE " + " AND ".join(where)) if where else ""
+
+    ids = [r[0] for r in con.execute(f"SELECT b.id FROM bales b{cond} ORDER BY b.id DESC LIMIT ?", (*params, limit))]
+    refresh(con, ids)
+    if not ids:
+        return []
+    rows = con.execute(
+        BALE_STATS_SELECT + f" WHERE b.id IN ({', '.join('?' for _ in ids)}) ORDER BY b.id DESC", ids
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def _robust_z(x: np.ndarray) -> np.ndarray:
+    """Modified z-score (Iglewicz & Hoaglin); mean absolute deviation when the MAD is 0."""
+    med = np.nanmedian(x)
+    mad = np.nanmedian(np.abs(x - med))
+    if mad > 0:
+        return 0.6745 * (x - med) / mad
+    mean_ad = np.nanmean(np.abs(x - med))
+    if mean_ad > 0:
+        return (x - med) / (1.253314 * mean_ad)
+    return np.zeros_like(x)
+
+
+def _describe(x: np.ndarray) -> dict:
+    x = x[~np.isnan(x)]
+    if not len(x):
+        return {"n": 0}
+    p5, p50, p95 = np.percentile(x, [5, 50, 95])
+    return {
+        "n": int(len(x)),
+        "mean": round(float(x.mean()), 4),
+        "std": round(float(x.std()), 4),
+        "min": round(float(x.min()), 4),
+        "p5": round(float(p5), 4),
+        "p50": round(float(p50), 4),
+        "p95": round(float(p95), 4),
+        "max": round(float(x.max()), 4),
+    }
+
+
+def summary(con, limit: int = 500, lo: int | None = None, hi: int | None = None, bins: int = 20,
+            line: int | None = None) -> dict:
+    """
+    Cross-bale view of the last `limit` bales (optionally those starting in
+    [lo, hi) epoch ms and/or of one line): distributions, bale length
+    histogram and outliers (robust z-score of length, stroke mean or ram
+    speed above OUTLIER_Z).
+    """
+    where, params = [], []
+    if line is not None:
+        where.append("b.line_id = ?")
+        params.append(line)
+    if lo is not None:
+        where.append("b.start_ts >= ?")
+        params.append(db.ts_iso(lo))
+    if hi is not None:
+        where.append("b.start_ts < ?")
+        params.append(db.ts_iso(hi))
+    cond = (" WHERE " + " AND ".join(where)) if where else ""
+    ids = [r[0] for r in con.execute(f"SELECT b.id FROM bales b{cond} ORDER BY b.id DESC LIMIT ?", (*params, limit))]
+    refresh(con, ids)
+    if not ids:
+        return {"bales": 0}
+
+    rows = con.execute(
+        BALE_STATS_SELECT + f" WHERE b.id IN ({', '.join('?' for _ in ids)}) ORDER BY b.id", ids
+    ).fetchall()
+    strokes = stroke_matrix(
+        r[0] for r in con.execute(
+            f"SELECT stroke_json FROM bales WHERE id IN ({', '.join('?' for _ in ids)}) ORDER BY id", ids
+        )
+    )
+
+    def col(name):
+        return np.array([np.nan if r[name] is None else r[name] for r in rows], dtype=np.float64)
+
+    length = col("length")
+    metrics = {
+        "length": length,
+        "stroke_count": col("stroke_count"),
+        "stroke_mean": col("stroke_mean"),
+        "ram_speed_mean": col("ram_speed_mean"),
+        "duration_s": col("duration_s"),
+    }
+
+    outliers = []
+    for name in ("length", "stroke_mean", "ram_speed_mean"):
+        z = _robust_z(metrics[name])
+        for i in np.flatnonzero(np.abs(z) > OUTLIER_Z):
+            outliers.append({
+                "bale_id": rows[i]["id"], "line_id": rows[i]["line_id"], "bale_number": rows[i]["bale_number"],
+                "start_ts": rows[i]["start_ts"],
+                "metric": name, "value": float(metrics[name][i]), "z": round(float(z[i]), 2),
+            })
+
+    valid = length[~np.isnan(length)]
+    hist, edges = np.histogram(valid, bins=bins) if len(valid) else (np.array([]), np.array([]))
+    return {
+        "bales": len(rows),
+        "first_start_ts": rows[0]["start_ts"],
+        "last_end_ts": rows[-1]["end_ts"],
+        **{name: _describe(x) for name, x in metrics.items()},
+        "strokes": _describe(strokes.ravel()),
+        "length_histogram": {"edges": [round(float(e), 4) for e in edges], "counts": hist.astype(int).tolist()},
+        "outlier_z": OUTLIER_Z,
+        "outliers": outliers,
+    }
+
+
+# ---- Benchmark ----
+def _python_ram_stats(con, lo_ms: int, hi_ms: int) -> dict:
+    # Reference: the same ram metrics with a plain Python row loop
+    out = {}
+    prev = None
+    for ts_ms, bale, distance, ram in con.execute(
+        "SELECT ts_ms, bale_s, distance, ram_forward FROM samples WHERE ts_ms >= ? AND ts_ms < ? ORDER BY id",
+        (lo_ms, hi_ms),
+    ):
+        st = out.setdefault(bale, [0, 0.0, 0.0, 0.0])
+        st[0] += 1
+        if prev is not None and prev[1] == bale and prev[3] == 1:
+            dt = (ts_ms - prev[0]) / 1000.0
+            dd = distance - prev[2]
+            if dt > 0 and dd >= 0:
+                st[1] += dt
+                st[2] += dd
+                st[3] = max(st[3], dd / dt)
+        prev = (ts_ms, bale, distance, ram)
+    return out
+
+
+def benchmark() -> dict:
+    """Throughput of the vectorized path vs a Python row loop over the whole samples table."""
+    with db.connect() as con:
+        lo, hi = con.execute("SELECT MIN(ts_ms), MAX(ts_ms) FROM samples").fetchone()
+        if lo is None:
+            return {"samples": 0}
+        hi += 1
+        numbers = np.array([r[0] for r in con.execute("SELECT DISTINCT bale_s FROM samples WHERE bale_s IS NOT NULL")])
+
+        t0 = time.perf_counter()
+        s = load_samples(con, lo, hi)
+        t1 = time.perf_counter()
+        ram_stats(s, numbers)
+        t2 = time.perf_counter()
+        _python_ram_stats(con, lo, hi)
+        t3 = time.perf_counter()
+
+    n = len(s)
+    return {
+        "samples": n,
+        "bales": len(numbers),
+        "load_sec": round(t1 - t0, 3),
+        "compute_sec": round(t2 - t1, 3),
+        "numpy_samples_per_sec": round(n / max(t2 - t0, 1e-9)),
+        "numpy_compute_samples_per_sec": round(n / max(t2 - t1, 1e-9)),
+        "python_loop_sec": round(t3 - t2, 3),
+        "python_samples_per_sec": round(n / max(t3 - t2, 1e-9)),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Bale analytics")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("refresh", help="compute bale_stats for every finished bale that has none")
+    sub.add_parser("summary", help="print the cross-bale summary of the last 500 bales")
+    sub.add_parser("bench", help="samples/s of the NumPy path vs a Python loop over all samples")
+    args = parser.parse_args()
+
+    db.init_db()
+    if args.cmd == "bench":
+        print(json.dumps(benchmark(), indent=2))
+    else:
+        with db.connect() as con:
+            if args.cmd == "refresh":
+                print(f"bales computed: {refresh(con)}")
+            else:
+                print(json.dumps(summary(con), indent=2))
@@ -0,0 +1,161 @@
+import os
+import queue
+from datetime import datetime
+
+from Modbus_TCPV3 import MachineEvent
+
+# Time after the ram stops before the stroke length is taken (lets the encoder settle)
+STROKE_SETTLE_SEC = float(os.getenv("STROKE_SETTLE_SEC", "1.0"))
+STROKE_SLOTS = 10
+
+
+class BaleRecord:
+    """Snapshot of a finished bale."""
+    __slots__ = ("number", "length", "strokes", "start_ts", "end_ts", "samples")
+
+    def __init__(
+        self,
+        number: int,
+        length: float,
+        strokes: list[float],
+        start_ts: datetime | None = None,
+        end_ts: datetime | None = None,
+        samples: int = 0,
+    ):
+        self.number = number
+        self.length = length
+        self.strokes = strokes
+        self.start_ts = start_ts    # first / last encoder sample of the bale
+        self.end_ts = end_ts
+        self.samples = samples      # rows stored for the bale (bales.sample_count)
+
+    def __repr__(self):
+        return f"BaleRecord(#{self.number}, length={self.length}, strokes={self.strokes})"
+
+
+class BaleTracker:
+    """
+    Bale / stroke state machine driven by MachineState events plus encoder samples.
+
+    - poll() consumes queued PLC events (nothing is missed between loops) and
+      returns the bales that finished since the last call.
+    - on_sample() feeds the current bale distance; strokes whose settle time
+      has passed are recorded against it. Settling never blocks the caller.
+    - on_stored() counts the rows actually stored for the bale (all polls, or
+      fewer in deadband mode), like backfill_bales counts them.
+    """
+
+    def __init__(self, events: queue.Queue, settle_sec: float = STROKE_SETTLE_SEC, slots: int = STROKE_SLOTS):
+        self.events = events
+        self.settle_sec = settle_sec
+        self.slots = slots
+
+        self.bale_number = 0          # bale being built (sBaleNumber)
+        self.plc_bale_number = 0      # last bale number from PLC (iBaleNumber)
+        self.ram_forward = False
+        self.strokes = [0.0] * slots  # stroke lengths of the current bale
+        self.ram_distance = 0.0       # last recorded stroke length
+        self.distance = 0.0           # current bale distance (from the encoder)
+        self.last_bale = None         # BaleRecord of the previous bale
+        self.start_ts = None          # first sample of the current bale
+        self.end_ts = None            # latest sample of the current bale
+        self.samples = 0              # rows stored for the current bale
+
+        self._pending = []            # monotonic deadlines of strokes waiting to settle
+
+    def prime(self, bale_number: int, ram_forward: bool):
+        """Start from the PLC's current values (events only describe changes)."""
+        self.plc_bale_number = bale_number
+        self.ram_forward = ram_forward
+        if self.bale_number == 0:
+            self.bale_number = bale_number
+
+    @property
+    def settling(self) -> int:
+        """Strokes that ended but whose length is not taken yet."""
+        return len(self._pending)
+
+    def resume(self, strokes: list[float], ram_distance: float, start_ts: datetime | None, samples: int,
+               settling: int, t: float):
+        """
+        Continue a bale after a restart (collector checkpoint): its strokes so
+        far, first sample and sample count. Strokes that were still settling
+        are measured settle_sec after t.
+        """
+        self.strokes = list(strokes)
+        self.ram_distance = ram_distance
+        if start_ts is not None:
+            self.start_ts = start_ts
+        self.samples += samples
+        self._pending = sorted(self._pending + [t + self.settle_sec] * settling)
+
+    def poll(self) -> list[BaleRecord]:
+        finished = []
+        while True:
+            try:
+                ev = self.events.get_nowait()
+            except queue.Empty:
+                break
+            record = self.handle(ev)
+            if record is not None:
+                finished.append(record)
+        return finished
+
+    def handle(self, ev: MachineEvent) -> BaleRecord | None:
+        if ev.kind == "RamGoesForward":
+            self.ram_forward = ev.new
+            # Falling edge -> stroke ends; take its length once settled
+            if not ev.new and self.bale_number == self.plc_bale_number:
+                self._pending.append(ev.t + self.settle_sec)
+
+        elif ev.kind == "BaleNumber":
+            self.plc_bale_number = ev.new
+            if self.bale_number == 0:
+                self.bale_number = ev.new
+            elif ev.new != self.bale_number and ev.new > 0:
+                return self._finish_bale(ev.new)
+        return None
+
+    def on_sample(self, t: float, distance: float, ts: datetime | None = None):
+        """t is time.monotonic() of the encoder read, distance the bale distance."""
+        self.distance = distance
+        if ts is not None:
+            if self.start_ts is None:
+                self.start_ts = ts
+            self.end_ts = ts
+        while self._pending and t >= self._pending[0]:
+            self._pending.pop(0)
+            self._record_stroke()
+
+    def on_stored(self, count: int):
+        self.samples += count
+
+    def _record_stroke(self):
+        # distance since last strokes
+        self.ram_distance = round(self.distance - sum(self.strokes), 2)
+        for i in range(self.slots):
+            if self.strokes[i] == 0:
+                self.strokes[i] = self.ram_distance
+                break
+
+    def _finish_bale(self, new_bale_number: int) -> BaleRecord:
+        # Strokes still settling belong to the bale that just finished
+        while self._pending:
+            self._pending.pop(0)
+            self._record_stroke()
+
+        record = BaleRecord(
+            self.bale_number, self.distance, self.strokes[:],
+            start_ts=self.start_ts, end_ts=self.end_ts, samples=self.samples,
+        )
+        self.last_bale = record
+
+        # Clear for next bale
+        self.bale_number = new_bale_number
+        self.strokes = [0.0] * self.slots
+        self.ram_distance = 0.0
+        self.distance = 0.0
+        self.start_ts = None
+        self.end_ts = None
+        self.samples = 0
+        return record
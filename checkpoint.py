@@ -0,0 +1,173 @@
+import os
+import time
+import zlib
+import struct
+from datetime import datetime
+
+from db import DB_PATH
+from bale_tracker import STROKE_SLOTS
+from metrics import log, CHECKPOINT_SECONDS
+
+# ---- Config ----
+CHECKPOINT_SEC = float(os.getenv("CHECKPOINT_SEC", "1.0"))               # write interval (0 = off)
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", DB_PATH + ".line{line}.ckpt")  # {line} = line id
+CHECKPOINT_MAX_AGE_SEC = float(os.getenv("CHECKPOINT_MAX_AGE_SEC", "60"))   # older: start the bale from scratch
+CHECKPOINT_ENCODER_GAP_SEC = float(os.getenv("CHECKPOINT_ENCODER_GAP_SEC", "2"))  # older: encoder counts on from the first read
+CHECKPOINT_FSYNC = os.getenv("CHECKPOINT_FSYNC", "0") == "1"              # survive power loss too (costs an fsync)
+
+# Fixed-size little-endian record followed by its CRC32. Bump the version
+# when the layout changes; a record of another version is ignored.
+MAGIC = b"EBCK"
+VERSION = 1
+_RECORD = struct.Struct(
+    "<4sHHq"                        # magic, version, line_id, written (epoch ms)
+    "qqB"                           # bale_number, plc_bale_number, ram_forward
+    "qd"                            # encoder previous raw (-1 = none), encoder counter
+    f"dd{STROKE_SLOTS}d"            # bale distance, ram_distance, strokes
+    "qqqH"                          # start / end (epoch ms, 0 = none), samples, strokes still settling
+    f"qd{STROKE_SLOTS}d"            # previous bale: number (-1 = none), length, strokes
+)
+_CRC = struct.Struct("<I")
+SIZE = _RECORD.size + _CRC.size
+
+
+def _ms(ts: datetime | None) -> int:
+    return int(ts.timestamp() * 1000) if ts is not None else 0
+
+
+def _ts(ms: int) -> datetime | None:
+    return datetime.fromtimestamp(ms / 1000.0) if ms else None
+
+
+class Checkpoint:
+    """The collector's in-flight bale state: everything that is lost on a restart."""
+    __slots__ = (
+        "line_id", "written_ms",
+        "bale_number", "plc_bale_number", "ram_forward",
+        "encoder_previous", "encoder_counter",
+        "distance", "ram_distance", "strokes",
+        "start_ts", "end_ts", "samples", "pending",
+        "q_bale_number", "q_bale_length", "q_strokes",
+    )
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    def pack(self) -> bytes:
+        body = _RECORD.pack(
+            MAGIC, VERSION, self.line_id, self.written_ms,
+            self.bale_number, self.plc_bale_number, int(bool(self.ram_forward)),
+            -1 if self.encoder_previous is None else int(self.encoder_previous), self.encoder_counter,
+            self.distance, self.ram_distance, *self.strokes,
+            _ms(self.start_ts), _ms(self.end_ts), self.samples, self.pending,
+            -1 if self.q_bale_number is None else self.q_bale_number, self.q_bale_length, *self.q_strokes,
+        )
+        return body + _CRC.pack(zlib.crc32(body))
+
+    @classmethod
+    def unpack(cls, data: bytes) -> "Checkpoint":
+        """ValueError if the record is truncated, corrupt or of another version."""
+        if len(data) != SIZE:
+            raise ValueError(f"checkpoint is {len(data)} bytes, expected {SIZE}")
+        body = data[:_RECORD.size]
+        if _CRC.unpack(data[_RECORD.size:])[0] != zlib.crc32(body):
+            raise ValueError("checkpoint CRC mismatch")
+        v = _RECORD.unpack(body)
+        if v[0] != MAGIC or v[1] != VERSION:
+            raise ValueError(f"not a version {VERSION} checkpoint")
+        s = STROKE_SLOTS
+        strokes_end = 11 + s
+        return cls(
+            line_id=v[2], written_ms=v[3],
+            bale_number=v[4], plc_bale_number=v[5], ram_forward=bool(v[6]),
+            encoder_previous=None if v[7] < 0 else v[7], encoder_counter=v[8],
+            distance=v[9], ram_distance=v[10], strokes=list(v[11:strokes_end]),
+            start_ts=_ts(v[strokes_end]), end_ts=_ts(v[strokes_end + 1]),
+            samples=v[strokes_end + 2], pending=v[strokes_end + 3],
+            q_bale_number=None if v[strokes_end + 4] < 0 else v[strokes_end + 4],
+            q_bale_length=v[strokes_end + 5], q_strokes=list(v[strokes_end + 6:]),
+        )
+
+    def age_sec(self) -> float:
+        return time.time() - self.written_ms / 1000.0
+
+    def __repr__(self):
+        return (f"Checkpoint(line {self.line_id}, bale {self.bale_number}, distance={self.distance}, "
+                f"strokes={[x for x in self.strokes if x]})")
+
+
+class Checkpointer:
+    """
+    Keeps one line's Checkpoint on disk: written to a temp file and renamed
+    over the previous one (os.replace is atomic), so a crash leaves either
+    the old or the new record, never half of one. No fsync by default: a
+    killed process or restarted container keeps the page cache; the CRC
+    catches what a power cut might leave behind.
+    """
+
+    def __init__(self, line_id: int = 1, path: str | None = None, interval_sec: float = CHECKPOINT_SEC,
+                 max_age_sec: float = CHECKPOINT_MAX_AGE_SEC, fsync: bool = CHECKPOINT_FSYNC):
+        self.line_id = line_id
+        self.path = path or CHECKPOINT_PATH.format(line=line_id)
+        self.interval_sec = interval_sec
+        self.max_age_sec = max_age_sec
+        self.fsync = fsync
+        self._due = 0.0
+        self.saves = 0
+        self.errors = 0
+        self.restored = None        # what happened at startup (see stats())
+
+    def due(self, t: float) -> bool:
+        return t >= self._due
+
+    def save(self, cp: Checkpoint, t: float | None = None):
+        """Write cp (never raises: a failed checkpoint must not stop collection)."""
+        t = time.monotonic() if t is None else t
+        self._due = t + self.interval_sec
+        cp.line_id = self.line_id
+        cp.written_ms = int(time.time() * 1000)
+        tmp = self.path + ".tmp"
+        try:
+            with CHECKPOINT_SECONDS.time(line=self.line_id):
+                with open(tmp, "wb") as f:
+                    f.write(cp.pack())
+                    if self.fsync:
+                        f.flush()
+                        os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+            self.saves += 1
+        except (OSError, struct.error) as e:
+            self.errors += 1
+            if self.errors == 1 or self.errors % 100 == 0:
+                log.warning("line %d checkpoint write failed (%d so far): %s", self.line_id, self.errors, e)
+
+    def load(self) -> Checkpoint | None:
+        """The last checkpoint of this line, or None (missing, unreadable, other line, too old)."""
+        try:
+            with open(self.path, "rb") as f:
+                cp = Checkpoint.unpack(f.read(SIZE + 1))
+        except FileNotFoundError:
+            self.restored = "none"
+            return None
+        except (OSError, ValueError) as e:
+            log.warning("line %d checkpoint %s ignored: %s", self.line_id, self.path, e)
+            self.restored = "invalid"
+            return None
+        if cp.line_id != self.line_id:
+            log.warning("line %d checkpoint %s belongs to line %d, ignored", self.line_id, self.path, cp.line_id)
+            self.restored = "invalid"
+            return None
+        if cp.age_sec() > self.max_age_sec:
+            log.info("line %d checkpoint is %.0f s old, starting the bale from scratch", self.line_id, cp.age_sec())
+            self.restored = "stale"
+            return None
+        return cp
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "saves": self.saves,
+            "errors": self.errors,
+            "restored": self.restored,   # none | invalid | stale | resumed | encoder_gap | bale_changed
+        }
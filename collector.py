@@ -0,0 +1,378 @@
+from datetime import datetime
+import time
+import os
+import threading
+
+from Modbus_TCPV3 import MachineState
+from bale_tracker import BaleTracker
+from live import hub, sample_payload, bale_payload
+from ringbuffer import ring
+import sharedstate
+from db import next_sample_id
+from checkpoint import Checkpoint, Checkpointer, CHECKPOINT_ENCODER_GAP_SEC
+from kinematics import EncoderTracker, ENCODER_COUNTS_PER_ROUND, WRAP_FORWARD, WRAP_BACKWARD
+from metrics import log, setup_logging, RateLimitedLog, ENCODER_WRAPS, BALES_COMPLETED
+
+# --- Config via environment (so it works on Edge/IEM too) ---
+MASTER_IP = os.getenv("ENCODER_IP", "192.168.1.250")
+MODBUS_PORT = int(os.getenv("ENCODER_PORT", "502"))
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", "0.1"))
+
+PDIN_BASE_ADDR = 0
+WORD_COUNT = 16
+
+HEARTBEAT_FILE = os.getenv("HEARTBEAT_FILE", "/tmp/collector_heartbeat.txt")
+ENCODER_TIMEOUT = float(os.getenv("ENCODER_TIMEOUT", "3"))
+
+# --- Recording policy ---
+RECORD_MODE = os.getenv("RECORD_MODE", "all").strip().lower()       # all | deadband
+RECORD_DEADBAND = int(os.getenv("RECORD_DEADBAND", "20"))            # encoder counts
+RECORD_KEEPALIVE_SEC = float(os.getenv("RECORD_KEEPALIVE_SEC", "10"))
+
+# Why a row was stored (samples.rec). Between two stored rows every skipped
+# poll had the values of the earlier row (encoder within the deadband, no
+# flag/stroke/bale change), so the full trace is a step-hold of the stored
+# rows; a REC_HOLD_END row marks the last poll of a held span.
+REC_MOVED = 1       # encoder moved more than the deadband
+REC_EVENT = 2       # PLC flag, bale number or stroke list changed
+REC_KEEPALIVE = 4   # nothing changed for RECORD_KEEPALIVE_SEC
+REC_HOLD_END = 8    # last skipped poll, stored just before the change that ends the hold
+
+# Fields whose change always gets a row
+EVENT_FIELDS = (
+    "data_valid", "bale_s", "bale_i", "bale_ready", "ram_forward",
+    "ram_distance", "stroke_list", "q_bale_number", "q_bale_length", "q_stroke_list",
+)
+
+setup_logging()
+
+def heartbeat():
+    # Update heartbeat every loop. If this stops updating, watchdog will restart container.
+    try:
+        with open(HEARTBEAT_FILE, "w") as f:
+            f.write(str(time.time()))
+    except Exception:
+        pass
+
+
+class RecordPolicy:
+    """
+    Decides which polled samples are persisted. Mode "all" stores every poll
+    (rec NULL); "deadband" stores only changes plus a keepalive, tagging each
+    row with REC_* bits.
+    """
+
+    def __init__(
+        self,
+        mode: str = RECORD_MODE,
+        deadband: int = RECORD_DEADBAND,
+        keepalive_sec: float = RECORD_KEEPALIVE_SEC,
+        one_round_raw: float = ENCODER_COUNTS_PER_ROUND,
+    ):
+        if mode not in ("all", "deadband"):
+            raise ValueError(f"RECORD_MODE must be 'all' or 'deadband', got {mode!r}")
+        self.mode = mode
+        self.deadband = deadband
+        self.keepalive_sec = keepalive_sec
+        self.one_round_raw = one_round_raw
+
+        self._last = None       # last stored sample
+        self._last_t = 0.0
+        self._held = None       # last skipped sample since then
+        self.polled = 0
+        self.stored = 0
+
+    @property
+    def held(self) -> dict | None:
+        """The skipped sample stored (as REC_HOLD_END) once something changes."""
+        return self._held
+
+    def _moved(self, raw: int | None) -> bool:
+        prev = self._last["encoder_raw"]
+        if raw is None or prev is None:
+            return raw != prev
+        d = abs(raw - prev)
+        d = min(d, self.one_round_raw + 1 - d)  # wrap-aware
+        return d > self.deadband
+
+    def filter(self, sample: dict, t: float) -> list[dict]:
+        """Samples to store for this poll (0, 1, or 2 when a held span ends)."""
+        self.polled += 1
+        if self.mode == "all":
+            self.stored += 1
+            return [sample]
+
+        rec = 0
+        if self._last is None:
+            rec |= REC_EVENT
+        else:
+            if self._moved(sample["encoder_raw"]):
+                rec |= REC_MOVED
+            if any(sample[k] != self._last[k] for k in EVENT_FIELDS):
+                rec |= REC_EVENT
+            if t - self._last_t >= self.keepalive_sec:
+                rec |= REC_KEEPALIVE
+
+        if not rec:
+            self._held = sample
+            return []
+
+        out = []
+        if self._held is not None and rec & (REC_MOVED | REC_EVENT):
+            out.append({**self._held, "rec": REC_HOLD_END})
+        self._held = None
+        out.append({**sample, "rec": rec})
+
+        self._last = sample
+        self._last_t = t
+        self.stored += len(out)
+        return out
+
+
+# Lines share the sample id sequence, the writer queue and the ring: a row's id
+# is taken and the row queued and appended under one lock, so all three stay in
+# id order with one EncoderLoop thread per line (the ring's select relies on it)
+_store_lock = threading.Lock()
+
+
+class Collector:
+    """
+    Turns encoder register frames + PLC events into stored samples.
+
+    Transport-agnostic: the blocking loop in TestEncoderJanssenV3 and the
+    asyncio engine in acquisition both read the devices themselves and hand
+    the results to poll_events() / process().
+    """
+
+    def __init__(
+        self,
+        state: MachineState,
+        writer,
+        policy: RecordPolicy | None = None,
+        line_id: int = 1,
+        encoder: EncoderTracker | None = None,
+        next_id=next_sample_id,
+        live: bool = True,
+        checkpoint: Checkpointer | None = None,
+    ):
+        self.state = state
+        self.writer = writer
+        self.policy = policy or RecordPolicy()
+        self.line_id = line_id
+        self.encoder = encoder or EncoderTracker()
+        self.next_id = next_id      # sample id source (replay: a plain counter)
+        self.live = live            # also feed the in-memory ring, the live push hub and the live state block
+        self.shared = sharedstate.state() if live else None
+        self._sample_log = RateLimitedLog(log)  # one sample line per LOG_SAMPLE_SEC
+        self.tracker = BaleTracker(state.subscribe())
+        self.tracker.prime(int(state.BaleNumber), bool(state.RamGoesForward))
+
+        # Baler variables from PLC
+        self.iBaleNumber = 0
+        self.iRamGoesForward = False
+
+        # Initialize variables
+        self.sBaleNumber = 0
+        self.sBaleReady = False
+
+        self.sRounds = 0.0
+        self.sDistance = 0.0
+
+        self.sBaleLength_Stroke = [0.0] * 10  # RAM to store bale lengths
+        self.sBale_length_Encoder = 0.0
+        self.sRounds_Encoder = 0.0
+        self.sRamdistance = 0.0
+
+        self.qBaleNumber = None
+        self.qBale_length_Encoder = 0.0
+        self.qBaleLength_Stroke = [0.0] * 10
+
+        # Restart: continue the bale in progress from the last checkpoint. The
+        # encoder position does not depend on the PLC, so counting resumes at
+        # once (the first read adds the movement made while we were down); the
+        # bale itself is resumed once the PLC's bale number is known. After a
+        # longer gap that movement may exceed ENCODER_WRAP_THRESHOLD and be
+        # taken for a turn-over: counting then starts again at the first read
+        # and the bale is flagged (restored = "encoder_gap").
+        self.checkpoint = checkpoint
+        self._resume = checkpoint.load() if checkpoint is not None else None
+        self._encoder_gap = False
+        if self._resume is not None:
+            self._encoder_gap = self._resume.age_sec() > CHECKPOINT_ENCODER_GAP_SEC
+            self.encoder.previous = None if self._encoder_gap else self._resume.encoder_previous
+            self.encoder.counter = self._resume.encoder_counter
+            self.sRounds = self.encoder.rounds
+            self.sDistance = self.encoder.distance
+            self._reconcile(time.monotonic())
+
+    # ---- checkpoints ----
+    def _reconcile(self, t: float):
+        cp = self._resume
+        if cp is None or self.tracker.bale_number == 0:
+            return
+        self._resume = None
+        if self.tracker.bale_number != cp.bale_number:
+            # Finished while we were down: its end is unknown, start the new bale from 0
+            log.warning("line %d: bale %d ended while the collector was down (PLC is on bale %d), not resumed",
+                        self.line_id, cp.bale_number, self.tracker.bale_number)
+            self.checkpoint.restored = "bale_changed"
+            self.encoder.reset()
+            self.sRounds = 0.0
+            self.sDistance = 0.0
+            return
+        self.tracker.resume(cp.strokes, cp.ram_distance, cp.start_ts, cp.samples, cp.pending, t)
+        self.sBaleLength_Stroke = self.tracker.strokes
+        self.sRamdistance = self.tracker.ram_distance
+        self.qBaleNumber = cp.q_bale_number
+        self.qBale_length_Encoder = cp.q_bale_length
+        self.qBaleLength_Stroke = cp.q_strokes
+        self.checkpoint.restored = "resumed"
+        log.info("line %d resumed bale %d from a %.1f s old checkpoint: distance=%s strokes=%s",
+                 self.line_id, cp.bale_number, cp.age_sec(), cp.distance, [x for x in cp.strokes if x])
+        if self._encoder_gap:
+            self.checkpoint.restored = "encoder_gap"
+            log.warning("line %d: checkpoint older than %.0f s, bale %d length misses the encoder movement "
+                        "while the collector was down", self.line_id, CHECKPOINT_ENCODER_GAP_SEC, cp.bale_number)
+
+    def snapshot(self) -> Checkpoint:
+        tr = self.tracker
+        return Checkpoint(
+            bale_number=tr.bale_number, plc_bale_number=tr.plc_bale_number, ram_forward=tr.ram_forward,
+            encoder_previous=self.encoder.previous, encoder_counter=self.encoder.counter,
+            distance=tr.distance, ram_distance=tr.ram_distance, strokes=tr.strokes,
+            start_ts=tr.start_ts, end_ts=tr.end_ts, samples=tr.samples, pending=tr.settling,
+            q_bale_number=self.qBaleNumber, q_bale_length=self.qBale_length_Encoder, q_strokes=self.qBaleLength_Stroke,
+        )
+
+    def save_checkpoint(self, t: float | None = None):
+        """Persist the bale in progress (not before the PLC bale number is known and a checkpoint reconciled)."""
+        if self.checkpoint is None or self._resume is not None or self.tracker.bale_number == 0:
+            return
+        self.checkpoint.save(self.snapshot(), t)
+
+    # ---- per poll ----
+
+    def poll_events(self):
+        # PLC changes arrive as events from the PLC poller (no edge is lost)
+        finished = self.tracker.poll()
+        self.iBaleNumber = self.tracker.plc_bale_number
+        self.iRamGoesForward = self.tracker.ram_forward
+
+        # Bale becomes "ready" when PLC bale number changes (and we already had a previous bale);
+        # the flag is stored on the first sample of the new bale
+        self.sBaleReady = self.sBaleReady or bool(finished)
+
+        # When bale finished -> snapshot + reset
+        for bale in finished:
+            BALES_COMPLETED.inc(line=self.line_id)
+            # A held sample of this bale is stored with the next one (the bale change ends the hold)
+            held = self.policy.held
+            if held is not None and held["bale_s"] == bale.number:
+                bale.samples += 1
+            log.info("bale finished line=%d %s", self.line_id, bale)
+
+            self.sBale_length_Encoder = bale.length
+            self.qBale_length_Encoder = bale.length
+            self.sRounds_Encoder = round(self.sRounds, 2)
+            self.qBaleLength_Stroke = bale.strokes
+            self.qBaleNumber = bale.number
+
+            # One summary row per bale; written together with the bale's remaining samples
+            summary = dict(
+                line_id=self.line_id,
+                bale_number=bale.number,
+                start_ts=bale.start_ts,
+                end_ts=bale.end_ts,
+                length=bale.length,
+                rounds=self.sRounds_Encoder,
+                stroke_list=bale.strokes,
+                sample_count=bale.samples,
+            )
+            self.writer.add_bale(**summary)
+            self.writer.flush()
+            if self.live:
+                hub.publish("bale", bale_payload(summary))
+                self.shared.publish_bale(self.line_id, summary)
+
+            self.encoder.reset()
+            self.sDistance = 0.0
+            self.sRounds = 0.0
+
+        if self._resume is not None:
+            self._reconcile(time.monotonic())
+        self.sBaleNumber = self.tracker.bale_number
+        if finished:
+            # A restart from an older checkpoint would finish (and store) this bale again
+            self.save_checkpoint()
+        return finished
+
+    def process(self, words: list[int], timestamp: datetime | None = None, t: float | None = None):
+        """
+        Handle one frame of encoder input registers (PDIN_BASE_ADDR .. +WORD_COUNT).
+        t is the monotonic time of the read (default: now; replay passes its own clock).
+        """
+        timestamp = timestamp or datetime.now()
+
+        data_valid = "YES" if words[1] != 0 else "NO"
+
+        # Track distance with turn-over adjustment
+        wrap = self.encoder.update(int(words[2]))
+        if wrap == WRAP_FORWARD:
+            ENCODER_WRAPS.inc(line=self.line_id, direction="forward")
+        elif wrap == WRAP_BACKWARD:
+            ENCODER_WRAPS.inc(line=self.line_id, direction="backward")
+
+        self.sRounds = self.encoder.rounds
+        self.sDistance = self.encoder.distance
+        rounds = round(self.sRounds, 2)
+
+        # Strokes whose settle time has passed are measured against this sample
+        t = time.monotonic() if t is None else t
+        self.tracker.on_sample(t, self.sDistance, timestamp)
+        self.sRamdistance = self.tracker.ram_distance
+        self.sBaleLength_Stroke = self.tracker.strokes
+
+        # Log results (rate limited: formatting a line per poll costs real CPU at 10 Hz)
+        if self._sample_log.ready():
+            self._sample_log.emit(
+                "sample line=%d ts=%s data_valid=%s bale_s=%s bale_i=%s bale_ready=%s ram_forward=%s encoder_raw=%04d "
+                "rounds=%s distance=%s ram_distance=%s strokes=%s q_bale_number=%s q_bale_length=%s q_strokes=%s",
+                self.line_id, timestamp.isoformat(timespec="milliseconds"), data_valid, self.sBaleNumber, self.iBaleNumber,
+                self.sBaleReady, self.iRamGoesForward, words[2], rounds, self.sDistance, self.sRamdistance,
+                self.sBaleLength_Stroke, self.state.BaleNumber, self.qBale_length_Encoder, self.qBaleLength_Stroke,
+            )
+
+        # Store into SQLite + the in-memory ring (all polls, or only changes in deadband mode)
+        sample = dict(
+            ts=timestamp,
+            data_valid=(data_valid == "YES"),
+            bale_s=int(self.sBaleNumber) if self.sBaleNumber is not None else None,
+            bale_i=int(self.iBaleNumber) if self.iBaleNumber is not None else None,
+            bale_ready=bool(self.sBaleReady),
+            ram_forward=bool(self.iRamGoesForward),
+            encoder_raw=int(words[2]) if words and len(words) > 2 else None,
+            rounds=float(rounds) if rounds is not None else None,
+            distance=float(self.sDistance) if self.sDistance is not None else None,
+            ram_distance=float(self.sRamdistance) if self.sRamdistance is not None else None,
+            stroke_list=[float(x) for x in self.sBaleLength_Stroke],
+            q_bale_number=int(self.qBaleNumber) if self.qBaleNumber is not None else None,
+            q_bale_length=float(self.qBale_length_Encoder) if self.qBale_length_Encoder is not None else None,
+            q_stroke_list=[float(x) for x in self.qBaleLength_Stroke],
+            line_id=self.line_id,
+        )
+        stored = self.policy.filter(sample, t)
+        # sample_count of the bale is its stored rows, as backfill_bales counts them
+        self.tracker.on_stored(sum(1 for row in stored if row["bale_s"] == self.tracker.bale_number))
+        with _store_lock:
+            for row in stored:
+                row["id"] = self.next_id()
+                self.writer.add(**row)
+                if self.live:
+                    ring.append(row)
+                    hub.publish("sample", sample_payload(row))
+        if self.live:
+            self.shared.publish(self, stored)
+        self.sBaleReady = False
+
+        if self.checkpoint is not None and self.checkpoint.due(t):
+            self.save_checkpoint(t)
@@ -0,0 +1,264 @@
+import os
+import time
+import random
+import socket
+import threading
+
+from pymodbus.client import ModbusTcpClient, AsyncModbusTcpClient
+
+from scheduler import LatencyWindow
+from metrics import log, registry, MODBUS_READ_SECONDS, MODBUS_READ_ERRORS, MODBUS_RECONNECTS, MODBUS_CONNECTED
+
+# ---- Reconnect / keepalive configuration ----
+MODBUS_RETRY_FIRST_SEC = float(os.getenv("MODBUS_RETRY_FIRST_SEC", "0.05"))  # 2nd attempt after a failure (the 1st is immediate)
+MODBUS_RETRY_MAX_SEC = float(os.getenv("MODBUS_RETRY_MAX_SEC", "10"))        # backoff ceiling
+MODBUS_RETRY_JITTER = float(os.getenv("MODBUS_RETRY_JITTER", "0.5"))         # each delay is shortened by up to this fraction
+MODBUS_KEEPALIVE_SEC = int(os.getenv("MODBUS_KEEPALIVE_SEC", "5"))           # TCP keepalive idle / probe interval (0 = off)
+MODBUS_KEEPALIVE_PROBES = int(os.getenv("MODBUS_KEEPALIVE_PROBES", "3"))
+
+# (line_id, device) -> link, for /api/devices
+LINKS = {}
+_links_lock = threading.Lock()
+
+
+class ModbusExceptionResponse(RuntimeError):
+    """The device answered with a Modbus exception: the session is fine, the request was not."""
+
+
+class Backoff:
+    """
+    Reconnect delays after consecutive failures: immediately, then first,
+    2*first, 4*first ... capped, each randomly shortened by up to jitter so
+    devices (and processes) that failed together do not retry in lockstep.
+    """
+    __slots__ = ("first", "cap", "jitter", "attempt", "rng")
+
+    def __init__(self, first: float = MODBUS_RETRY_FIRST_SEC, cap: float = MODBUS_RETRY_MAX_SEC,
+                 jitter: float = MODBUS_RETRY_JITTER, seed: int | None = None):
+        self.first = first
+        self.cap = cap
+        self.jitter = jitter
+        self.attempt = 0
+        self.rng = random.Random(seed)
+
+    def next(self) -> float:
+        n = self.attempt
+        self.attempt += 1
+        if n == 0:
+            return 0.0
+        delay = min(self.cap, self.first * 2 ** (n - 1))
+        return delay * (1.0 - self.rng.random() * self.jitter)
+
+    def reset(self):
+        self.attempt = 0
+
+
+def _tune_socket(sock):
+    # Small request/response frames: no Nagle delay; keepalive notices a dead
+    # peer on an idle session before the next read has to time out on it
+    if sock is None:
+        return
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if MODBUS_KEEPALIVE_SEC > 0:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            for opt, value in (("TCP_KEEPIDLE", MODBUS_KEEPALIVE_SEC), ("TCP_KEEPINTVL", MODBUS_KEEPALIVE_SEC),
+                               ("TCP_KEEPCNT", MODBUS_KEEPALIVE_PROBES)):
+                if hasattr(socket, opt):
+                    sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, opt), value)
+    except OSError as e:
+        log.debug("socket options not applied: %s", e)
+
+
+class DeviceLink:
+    """
+    Supervises one long-lived Modbus TCP session to a device (encoder or PLC).
+
+    call() runs a read on the open session, connecting first if needed.
+    The client never retries by itself (retries=0): a timeout fails the call
+    at once and the session is dropped. Reconnects follow Backoff, so a
+    short hiccup costs one poll and an unreachable device is not hammered.
+    While backing off, call() returns None without touching the network.
+    A Modbus exception response only fails that call; the session is kept.
+    """
+
+    def __init__(self, device: str, host: str, port: int, timeout: float, line_id: int = 1,
+                 backoff: Backoff | None = None):
+        self.device = device
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.line_id = line_id
+        self.backoff = backoff or Backoff()
+        self.client = None
+
+        self.connected = False
+        self.last_rtt = None          # seconds, last successful call
+        self.rtt = LatencyWindow()
+        self.reconnects = 0
+        self.errors = 0
+        self.failures = 0             # consecutive failed attempts
+        self.last_error = None
+        self._was_up = False          # a session existed before: the next connect is a reconnect
+        self._down_since = None
+        self._retry_at = 0.0
+
+        with _links_lock:
+            LINKS[(line_id, device)] = self
+
+    @property
+    def last_rtt_ms(self) -> float | None:
+        return round(self.last_rtt * 1000.0, 2) if self.last_rtt is not None else None
+
+    def _labels(self) -> dict:
+        return {"line": self.line_id, "device": self.device}
+
+    def _up(self, sock):
+        _tune_socket(sock)
+        self.connected = True
+        if self._was_up:
+            self.reconnects += 1
+            MODBUS_RECONNECTS.inc(**self._labels())
+            log.info("line %d %s reconnected to %s:%d after %.0f ms", self.line_id, self.device,
+                     self.host, self.port, (time.monotonic() - (self._down_since or time.monotonic())) * 1000.0)
+        self._was_up = True
+
+    def _succeeded(self, rtt: float):
+        self.last_rtt = rtt
+        self.rtt.add(rtt)
+        MODBUS_READ_SECONDS.observe(rtt, **self._labels())
+        self.failures = 0
+        self._down_since = None
+        self.backoff.reset()
+
+    def _rejected(self, exc: Exception):
+        self.errors += 1
+        self.last_error = str(exc)
+        MODBUS_READ_ERRORS.inc(**self._labels())
+        log.warning("line %d %s: %s", self.line_id, self.device, exc)
+
+    def _failed(self, exc: Exception, now: float):
+        self.errors += 1
+        self.failures += 1
+        self.last_error = f"{type(exc).__name__}: {exc}"
+        MODBUS_READ_ERRORS.inc(**self._labels())
+        self.connected = False
+        if self._down_since is None:
+            self._down_since = now
+        try:
+            if self.client is not None:
+                self.client.close()
+        except Exception:
+            pass
+        delay = self.backoff.next()
+        self._retry_at = now + delay
+        # First failure and then every 20th: an unreachable device must not flood the log
+        if self.failures == 1 or self.failures % 20 == 0:
+            log.warning("line %d %s %s:%d failed (%d in a row): %s; retry in %.2f s", self.line_id, self.device,
+                        self.host, self.port, self.failures, self.last_error, delay)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "line_id": self.line_id,
+            "device": self.device,
+            "address": f"{self.host}:{self.port}",
+            "connected": self.connected,
+            "last_rtt_ms": self.last_rtt_ms,
+            "rtt_ms": self.rtt.summary_ms(),
+            "reconnects": self.reconnects,
+            "errors": self.errors,
+            "consecutive_failures": self.failures,
+            "down_sec": round(now - self._down_since, 2) if self._down_since is not None else None,
+            "retry_in_sec": round(max(0.0, self._retry_at - now), 2) if self.failures else None,
+            "last_error": self.last_error,
+        }
+
+
+class SyncLink(DeviceLink):
+    """DeviceLink over a blocking ModbusTcpClient (thread collector, PLC poller thread)."""
+
+    def call(self, fn, *args):
+        """fn(client, *args) on the session; None if backing off or the call failed."""
+        now = time.monotonic()
+        if now < self._retry_at:
+            return None
+        try:
+            if self.client is None:
+                self.client = ModbusTcpClient(self.host, port=self.port, timeout=self.timeout, retries=0)
+            if not self.client.connected:
+                if not self.client.connect():
+                    raise ConnectionError(f"cannot connect to {self.host}:{self.port}")
+                self._up(self.client.socket)
+            t0 = time.perf_counter()
+            result = fn(self.client, *args)
+        except ModbusExceptionResponse as e:
+            self._rejected(e)
+            return None
+        except Exception as e:
+            self._failed(e, now)
+            return None
+        self._succeeded(time.perf_counter() - t0)
+        return result
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+        self.connected = False
+
+
+class AsyncLink(DeviceLink):
+    """DeviceLink over an AsyncModbusTcpClient (asyncio engine); pymodbus' own reconnect is off."""
+
+    async def call(self, fn, *args):
+        """await fn(client, *args) on the session; None if backing off or the call failed."""
+        now = time.monotonic()
+        if now < self._retry_at:
+            return None
+        try:
+            if self.client is None:
+                self.client = AsyncModbusTcpClient(self.host, port=self.port, timeout=self.timeout,
+                                                   retries=0, reconnect_delay=0, trace_connect=self._traced)
+            if not self.client.connected:
+                if not await self.client.connect():
+                    raise ConnectionError(f"cannot connect to {self.host}:{self.port}")
+                transport = self.client.ctx.transport
+                self._up(transport.get_extra_info("socket") if transport is not None else None)
+            t0 = time.perf_counter()
+            result = await fn(self.client, *args)
+        except ModbusExceptionResponse as e:
+            self._rejected(e)
+            return None
+        except Exception as e:
+            self._failed(e, now)
+            return None
+        self._succeeded(time.perf_counter() - t0)
+        return result
+
+    def _traced(self, connected: bool):
+        # The peer closed the session: fail the read in flight now instead of
+        # letting it wait for the full timeout
+        if connected or self.client is None:
+            return
+        future = getattr(self.client.ctx, "response_future", None)
+        if future is not None and not future.done():
+            future.set_exception(ConnectionError("connection closed by the device"))
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+        self.connected = False
+
+
+def device_stats() -> list[dict]:
+    with _links_lock:
+        links = sorted(LINKS.items())
+    return [link.stats() for _, link in links]
+
+
+@registry.collector
+def _link_state():
+    with _links_lock:
+        links = list(LINKS.values())
+    for link in links:
+        MODBUS_CONNECTED.set(int(link.connected), line=link.line_id, device=link.device)
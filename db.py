@@ -1,12 +1,72 @@
 # db.py
 import os
 import json
+import time
 import sqlite3
+import threading
+from collections import deque
 from contextlib import contextmanager
 from datetime import datetime
 
+from scheduler import LatencyWindow
+from metrics import DB_FLUSH_SECONDS, SAMPLES_WRITTEN, log
+
 DB_PATH = os.getenv("DB_PATH", "/data/encoder.db")
 
+# ---- Batched writer tuning ----
+DB_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", "50"))        # flush after N samples
+DB_FLUSH_SEC = float(os.getenv("DB_FLUSH_SEC", "2.0"))       # ... or when oldest buffered sample is this old
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")       # WAL + NORMAL: no fsync per commit
+
+# ---- Read pool (webapp) ----
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))          # read-only connections kept open
+DB_READ_POOL_TIMEOUT = float(os.getenv("DB_READ_POOL_TIMEOUT", "5"))   # max wait for a free connection
+DB_READ_CACHE_KIB = int(os.getenv("DB_READ_CACHE_KIB", "8192"))        # page cache per connection
+DB_READ_MMAP_MB = int(os.getenv("DB_READ_MMAP_MB", "64"))              # memory-mapped reads (0 = off)
+DB_READ_CHECK_SEC = float(os.getenv("DB_READ_CHECK_SEC", "30"))        # ping idle connections before reuse
+
+# ---- Writer thread queue ----
+DB_QUEUE_SIZE = int(os.getenv("DB_QUEUE_SIZE", "6000"))              # ~10 min at 10 Hz
+DB_QUEUE_POLICY = os.getenv("DB_QUEUE_POLICY", "drop_oldest")        # block | drop_oldest | spill
+DB_SPILL_PATH = os.getenv("DB_SPILL_PATH", DB_PATH + ".spill")       # NDJSON overflow file (spill policy)
+DB_REJECT_PATH = os.getenv("DB_REJECT_PATH", DB_PATH + ".rejected")  # NDJSON of batches that fail a constraint
+QUEUE_POLICIES = ("block", "drop_oldest", "spill")
+
+# ---- Schema ----
+# v1: encoder_samples (ISO text ts, two JSON stroke arrays on every row)
+# v2: samples (epoch-ms ts, stroke arrays stored once in stroke_sets and referenced by id)
+SCHEMA_VERSION = 2
+MIGRATE_BATCH = int(os.getenv("DB_MIGRATE_BATCH", "2000"))        # v1 rows copied per transaction
+MIGRATE_PAUSE_SEC = float(os.getenv("DB_MIGRATE_PAUSE_SEC", "0.05"))  # yield to the collector between batches
+
+INSERT_SAMPLE_SQL = """
+INSERT INTO samples (
+    ts_ms, data_valid, bale_s, bale_i, bale_ready, ram_forward,
+    encoder_raw, rounds, distance, ram_distance,
+    stroke_id, q_bale_number, q_bale_length, q_stroke_id, rec, id, line_id
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+# Replayed rows keep their ids, so rows an interrupted replay already committed are skipped
+INSERT_SAMPLE_IGNORE_SQL = INSERT_SAMPLE_SQL.replace("INSERT INTO", "INSERT OR IGNORE INTO", 1)
+
+# Same columns/names the v1 table had, for the API
+SAMPLE_SELECT = """
+SELECT s.id, s.ts_ms, s.data_valid, s.bale_s, s.bale_i, s.bale_ready, s.ram_forward,
+       s.encoder_raw, s.rounds, s.distance, s.ram_distance,
+       s.q_bale_number, s.q_bale_length,
+       ss.stroke_json AS stroke_json, qs.stroke_json AS q_stroke_json, s.rec, s.line_id
+FROM samples s
+LEFT JOIN stroke_sets ss ON ss.id = s.stroke_id
+LEFT JOIN stroke_sets qs ON qs.id = s.q_stroke_id
+"""
+
+INSERT_BALE_SQL = """
+INSERT INTO bales (
+    bale_number, start_ts, end_ts, length, rounds,
+    stroke_json, stroke_count, sample_count, line_id
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
 @contextmanager
 def connect():
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
@@ -17,12 +77,101 @@ def connect():
     finally:
         con.close()
 
+def _add_column(con, table: str, column: str, decl: str):
+    # CREATE TABLE IF NOT EXISTS leaves older tables as they were
+    if column not in {row[1] for row in con.execute(f"PRAGMA table_info({table})")}:
+        con.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def _has_table(con, name: str) -> bool:
+    return con.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone() is not None
+
+ROLLUP_TABLES = (("samples_1s", "ts_s"), ("samples_1m", "ts_m"))
+_ROLLUP_COLUMNS = "n, distance_min, distance_max, distance_last, last_ms, bale_last, ram_active"
+
+def _set_rollups_aside(con):
+    # Rollups from before line_id summed every line into one bucket. They are
+    # renamed to *_v1 (migrate_rollups copies them back as line 1) except the
+    # buckets raw samples still cover: those are rolled up again, per line.
+    old = [table for table, _ in ROLLUP_TABLES
+           if _has_table(con, table) and "line_id" not in {row[1] for row in con.execute(f"PRAGMA table_info({table})")}]
+    if not old:
+        return
+    first = con.execute("SELECT MIN(ts_ms) FROM samples").fetchone()[0]
+    before = first // 60000 * 60 if first is not None else int(time.time()) // 60 * 60
+    with con:
+        con.execute("BEGIN")
+        for table in old:
+            con.execute(f"ALTER TABLE {table} RENAME TO {table}_v1")
+        con.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('rollup_v1_before', ?)", (before,))
+        con.execute("INSERT OR REPLACE INTO meta (key, value) SELECT 'rollup_upto', COALESCE(MIN(id), 1) - 1 FROM samples")
+
+# Per-second, per-line buckets of the samples matching {where}, merged into existing buckets
+_ROLLUP_1S_SQL = """
+INSERT INTO samples_1s (ts_s, line_id, n, distance_min, distance_max, distance_last, last_ms, bale_last, ram_active)
+SELECT g.sec, g.line_id, g.n, g.dmin, g.dmax, l.distance, l.ts_ms, l.bale_s, g.ram
+FROM (
+    SELECT ts_ms / 1000 AS sec, line_id, COUNT(*) AS n, MIN(distance) AS dmin, MAX(distance) AS dmax,
+           SUM(ram_forward) AS ram, MAX(id) AS last_id
+    FROM samples
+    WHERE {where}
+    GROUP BY sec, line_id
+) g
+JOIN samples l ON l.id = g.last_id
+WHERE true
+ON CONFLICT (ts_s, line_id) DO UPDATE SET
+    n = n + excluded.n,
+    distance_min = MIN(distance_min, excluded.distance_min),
+    distance_max = MAX(distance_max, excluded.distance_max),
+    distance_last = CASE WHEN excluded.last_ms >= last_ms THEN excluded.distance_last ELSE distance_last END,
+    bale_last = CASE WHEN excluded.last_ms >= last_ms THEN excluded.bale_last ELSE bale_last END,
+    last_ms = MAX(last_ms, excluded.last_ms),
+    ram_active = ram_active + excluded.ram_active
+"""
+
+# Minutes touched by a 1s batch are recomputed from their 1s buckets
+_ROLLUP_1M_SQL = """
+INSERT OR REPLACE INTO samples_1m (ts_m, line_id, n, distance_min, distance_max, distance_last, last_ms, bale_last, ram_active)
+SELECT g.minute, g.line_id, g.n, g.dmin, g.dmax, l.distance_last, l.last_ms, l.bale_last, g.ram
+FROM (
+    SELECT ts_s / 60 AS minute, line_id, SUM(n) AS n, MIN(distance_min) AS dmin, MAX(distance_max) AS dmax,
+           SUM(ram_active) AS ram, MAX(ts_s) AS last_s
+    FROM samples_1s
+    WHERE ts_s >= ? AND ts_s < ?
+    GROUP BY minute, line_id
+) g
+JOIN samples_1s l ON l.ts_s = g.last_s AND l.line_id = g.line_id
+"""
+
+def rollup_samples(con, where: str, params: tuple):
+    """Add the samples matching where to samples_1s / samples_1m (in the caller's transaction)."""
+    span = con.execute(f"SELECT MIN(ts_ms) / 1000, MAX(ts_ms) / 1000 FROM samples WHERE {where}", params).fetchone()
+    con.execute(_ROLLUP_1S_SQL.format(where=where), params)
+    if span[0] is not None:
+        con.execute(_ROLLUP_1M_SQL, (span[0] // 60 * 60, (span[1] // 60 + 1) * 60))
+
+def _rollup_late(con, ids: list[int]) -> int:
+    # Maintenance rolls up by id watermark (rollup_upto). Rows inserted at or
+    # below it (replayed spill rows keep the ids they got when polled) are
+    # rolled up here, in the transaction that inserts them: every id up to
+    # the watermark is then in the rollups, and retention may delete it.
+    upto = con.execute("SELECT value FROM meta WHERE key = 'rollup_upto'").fetchone()
+    late = [i for i in ids if i <= int(upto[0])] if upto is not None else []
+    if late:
+        rollup_samples(con, "id IN (SELECT value FROM json_each(?))", (json.dumps(late),))
+    return len(late)
+
 def init_db():
     with connect() as con:
+        # New database: let maintenance hand freed pages back with incremental_vacuum
+        if con.execute("PRAGMA page_count").fetchone()[0] == 0:
+            con.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+
         con.execute("""
-        CREATE TABLE IF NOT EXISTS encoder_samples (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ts TEXT NOT NULL,                 -- ISO timestamp
+        CREATE TABLE IF NOT EXISTS samples (
+            id INTEGER PRIMARY KEY,           -- rowid alias, no separate key storage
+            ts_ms INTEGER NOT NULL,           -- epoch milliseconds
             data_valid INTEGER NOT NULL,      -- 0/1
             bale_s INTEGER,
             bale_i INTEGER,
@@ -33,17 +182,108 @@ def init_db():
             distance REAL,
             ram_distance REAL,
 
-            stroke_json TEXT,                -- JSON array length 10
+            stroke_id INTEGER,                -- stroke_sets.id
             q_bale_number INTEGER,
             q_bale_length REAL,
-            q_stroke_json TEXT               -- JSON array length 10
+            q_stroke_id INTEGER,              -- stroke_sets.id
+            rec INTEGER,                      -- collector.REC_* bits (NULL: every poll recorded)
+            line_id INTEGER NOT NULL DEFAULT 1  -- lines.LineConfig.id (baler)
+        );
+        """)
+        _add_column(con, "samples", "rec", "INTEGER")
+        _add_column(con, "samples", "line_id", "INTEGER NOT NULL DEFAULT 1")
+        con.execute("CREATE INDEX IF NOT EXISTS idx_samples_ts_ms ON samples(ts_ms);")
+        con.execute("CREATE INDEX IF NOT EXISTS idx_samples_bale_si ON samples(bale_s, bale_i);")
+        # bale_s = ? OR bale_i = ? can then be answered from two indexes (no table scan)
+        con.execute("CREATE INDEX IF NOT EXISTS idx_samples_bale_i ON samples(bale_i);")
+
+        # Stroke lists only change on stroke/bale events: store each distinct list once
+        con.execute("""
+        CREATE TABLE IF NOT EXISTS stroke_sets (
+            id INTEGER PRIMARY KEY,
+            stroke_json TEXT NOT NULL UNIQUE  -- JSON array length 10
+        );
+        """)
+
+        # Small key/value store for migration and maintenance progress
+        con.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);")
+
+        # One row per finished bale (filled by the collector, or by backfill_bales)
+        con.execute("""
+        CREATE TABLE IF NOT EXISTS bales (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            bale_number INTEGER NOT NULL,
+            start_ts TEXT,                    -- first sample of the bale (ISO)
+            end_ts TEXT,                      -- last sample of the bale (ISO)
+            length REAL,                      -- final encoder length
+            rounds REAL,
+            stroke_json TEXT,                 -- JSON array length 10
+            stroke_count INTEGER NOT NULL,
+            sample_count INTEGER NOT NULL,
+            line_id INTEGER NOT NULL DEFAULT 1
         );
         """)
-        con.execute("CREATE INDEX IF NOT EXISTS idx_samples_ts ON encoder_samples(ts);")
-        con.execute("CREATE INDEX IF NOT EXISTS idx_samples_bale ON encoder_samples(bale_s, bale_i);")
+        _add_column(con, "bales", "line_id", "INTEGER NOT NULL DEFAULT 1")
+        con.execute("CREATE INDEX IF NOT EXISTS idx_bales_number ON bales(bale_number);")
+
+        # Per-bale metrics cache (analytics.py); bales never change once written
+        con.execute("""
+        CREATE TABLE IF NOT EXISTS bale_stats (
+            bale_id INTEGER PRIMARY KEY,      -- bales.id
+            samples INTEGER NOT NULL,
+            duration_s REAL,
+            ram_time_s REAL,                  -- time with the ram going forward
+            ram_distance REAL,
+            ram_speed_mean REAL,              -- distance / s while going forward
+            ram_speed_max REAL,
+            stroke_count INTEGER NOT NULL,
+            stroke_mean REAL,
+            stroke_std REAL
+        );
+        """)
+
+        # Rollups of samples for horizons beyond raw retention (filled by maintenance)
+        _set_rollups_aside(con)
+        for table, key in ROLLUP_TABLES:
+            con.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                {key} INTEGER NOT NULL,           -- epoch seconds / minutes
+                line_id INTEGER NOT NULL,         -- lines.LineConfig.id (baler)
+                n INTEGER NOT NULL,               -- stored samples in the bucket
+                distance_min REAL,
+                distance_max REAL,
+                distance_last REAL,
+                last_ms INTEGER,                  -- ts_ms of the last sample
+                bale_last INTEGER,
+                ram_active INTEGER NOT NULL,      -- samples with ram_forward = 1
+                PRIMARY KEY ({key}, line_id)
+            ) WITHOUT ROWID;
+            """)
         con.commit()
 
-def insert_sample(
+        if _has_table(con, "encoder_samples"):
+            _seed_from_v1(con)
+        con.execute(f"PRAGMA user_version = {SCHEMA_VERSION};")
+
+def _ts_ms(ts: datetime) -> int:
+    return int(ts.timestamp() * 1000)
+
+def parse_time(value: str | None) -> int | None:
+    """Epoch milliseconds from either an integer (epoch ms) or an ISO timestamp."""
+    if value is None or value == "":
+        return None
+    if value.lstrip("-").isdigit():
+        return int(value)
+    try:
+        return _ts_ms(datetime.fromisoformat(value))
+    except ValueError:
+        raise ValueError(f"bad timestamp: {value!r}")
+
+def ts_iso(ts_ms: int) -> str:
+    """Local ISO timestamp (seconds) as the v1 schema stored it."""
+    return datetime.fromtimestamp(ts_ms / 1000).isoformat(timespec="seconds")
+
+def _sample_row(
     ts: datetime,
     data_valid: bool,
     bale_s: int | None,
@@ -58,23 +298,972 @@ def insert_sample(
     q_bale_number: int | None,
     q_bale_length: float | None,
     q_stroke_list: list[float],
-):
+    rec: int | None = None,
+    id: int | None = None,
+    line_id: int = 1,
+) -> tuple:
+    # Stroke lists stay JSON text here; SampleWriter swaps them for stroke_sets ids
+    return (
+        _ts_ms(ts),
+        1 if data_valid else 0,
+        bale_s, bale_i,
+        1 if bale_ready else 0,
+        1 if ram_forward else 0,
+        encoder_raw, rounds, distance, ram_distance,
+        json.dumps(stroke_list),
+        q_bale_number, q_bale_length,
+        json.dumps(q_stroke_list),
+        rec,
+        id if id is not None else next_sample_id(),
+        line_id,
+    )
+
+def _bale_row(
+    bale_number: int,
+    start_ts: datetime | None,
+    end_ts: datetime | None,
+    length: float | None,
+    rounds: float | None,
+    stroke_list: list[float],
+    sample_count: int,
+    line_id: int = 1,
+) -> tuple:
+    return (
+        bale_number,
+        start_ts.isoformat(timespec="seconds") if start_ts else None,
+        end_ts.isoformat(timespec="seconds") if end_ts else None,
+        length, rounds,
+        json.dumps(stroke_list),
+        sum(1 for x in stroke_list if x),
+        sample_count,
+        line_id,
+    )
+
+# ---- Sample ids ----
+# Ids are handed out when a sample is produced (not by SQLite on insert), so
+# the in-memory ring / live stream and the database agree on them.
+_id_lock = threading.Lock()
+_next_id = None
+
+def _spilled_max_id(path: str) -> int:
+    top = 0
+    for name in (path, path + ".replay"):
+        if not os.path.exists(name):
+            continue
+        with open(name, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    if len(row) >= 16 and row[15] is not None:
+                        top = max(top, row[15])
+    return top
+
+def next_sample_id() -> int:
+    """Next free samples.id (above the table and any spilled rows not yet replayed)."""
+    global _next_id
+    with _id_lock:
+        if _next_id is None:
+            with connect() as con:
+                top = con.execute("SELECT MAX(id) FROM samples").fetchone()[0] or 0
+            _next_id = max(top, _spilled_max_id(DB_SPILL_PATH)) + 1
+        _next_id += 1
+        return _next_id - 1
+
+def insert_sample(**sample):
+    """One-shot insert (own connection + commit). Prefer SampleWriter in loops."""
+    writer = SampleWriter()
+    writer.add(**sample)
+    writer.close()
+
+
+# ---- Stroke sets ----
+_strokes_cache = {}
+
+def parse_strokes(stroke_json: str | None) -> list[float]:
+    # Few distinct lists, many rows: decode each JSON text once
+    if not stroke_json:
+        return []
+    cached = _strokes_cache.get(stroke_json)
+    if cached is None:
+        if len(_strokes_cache) > 4096:
+            _strokes_cache.clear()
+        cached = _strokes_cache[stroke_json] = tuple(json.loads(stroke_json))
+    return list(cached)
+
+def sample_dict(row) -> dict:
+    """API representation of a SAMPLE_SELECT row (unchanged from the v1 table)."""
+    d = dict(row)
+    d["ts"] = ts_iso(d.pop("ts_ms"))
+    d["stroke"] = parse_strokes(d.pop("stroke_json", None))
+    d["q_stroke"] = parse_strokes(d.pop("q_stroke_json", None))
+    return {k: d[k] for k in SAMPLE_KEYS}
+
+SAMPLE_KEYS = (
+    "id", "ts", "data_valid", "bale_s", "bale_i", "bale_ready", "ram_forward",
+    "encoder_raw", "rounds", "distance", "ram_distance",
+    "q_bale_number", "q_bale_length", "stroke", "q_stroke", "rec", "line_id",
+)
+
+# API key -> column, for projected selects (stroke_sets joined only when asked for)
+SAMPLE_COLUMNS = {
+    "id": "s.id", "ts": "s.ts_ms", "data_valid": "s.data_valid",
+    "bale_s": "s.bale_s", "bale_i": "s.bale_i", "bale_ready": "s.bale_ready", "ram_forward": "s.ram_forward",
+    "encoder_raw": "s.encoder_raw", "rounds": "s.rounds", "distance": "s.distance", "ram_distance": "s.ram_distance",
+    "q_bale_number": "s.q_bale_number", "q_bale_length": "s.q_bale_length",
+    "stroke": "ss.stroke_json", "q_stroke": "qs.stroke_json", "rec": "s.rec", "line_id": "s.line_id",
+}
+
+def sample_select(keys) -> str:
+    """SELECT ... FROM samples s for the given API keys (in that order), without WHERE."""
+    sql = "SELECT " + ", ".join(SAMPLE_COLUMNS[k] for k in keys) + " FROM samples s"
+    if "stroke" in keys:
+        sql += " LEFT JOIN stroke_sets ss ON ss.id = s.stroke_id"
+    if "q_stroke" in keys:
+        sql += " LEFT JOIN stroke_sets qs ON qs.id = s.q_stroke_id"
+    return sql
+
+def sample_keys(fields: str | None) -> tuple:
+    """API keys for a comma separated fields= value; id always comes first (it is the cursor)."""
+    if not fields:
+        return SAMPLE_KEYS
+    keys = [k.strip() for k in fields.split(",") if k.strip()]
+    unknown = [k for k in keys if k not in SAMPLE_COLUMNS]
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    return ("id", *(k for k in SAMPLE_KEYS if k in keys and k != "id"))
+
+def id_range(con, lo: int | None, hi: int | None) -> tuple[int | None, int | None] | None:
+    """
+    Translate a ts_ms range [lo, hi) into an inclusive id range with two
+    idx_samples_ts_ms seeks. Ids are assigned in sampling order, so rows in
+    the range can then be read by rowid in id order (no sort); callers still
+    check the exact ts bounds per row. None if no stored row is in the range.
+    """
+    first = last = None
+    if lo is not None:
+        row = con.execute("SELECT id FROM samples WHERE ts_ms >= ? ORDER BY ts_ms, id LIMIT 1", (lo,)).fetchone()
+        if row is None:
+            return None
+        first = row[0]
+    if hi is not None:
+        row = con.execute("SELECT id FROM samples WHERE ts_ms < ? ORDER BY ts_ms DESC, id DESC LIMIT 1", (hi,)).fetchone()
+        if row is None:
+            return None
+        last = row[0]
+    return first, last
+
+def sample_filters(con, lo: int | None = None, hi: int | None = None, bale: int | None = None,
+                   line: int | None = None):
+    """
+    WHERE terms and parameters for a ts_ms range, bale (bale_s or bale_i)
+    and/or line on samples s; None if the time range holds no rows.
+    """
+    where, params = [], []
+    if lo is not None or hi is not None:
+        span = id_range(con, lo, hi)
+        if span is None:
+            return None
+        for op, value in ((">=", span[0]), ("<=", span[1])):
+            if value is not None:
+                where.append(f"s.id {op} ?")
+                params.append(value)
+        # Exact bounds, checked per row (the unary + keeps the planner on the rowid range)
+        if lo is not None:
+            where.append("+s.ts_ms >= ?")
+            params.append(lo)
+        if hi is not None:
+            where.append("+s.ts_ms < ?")
+            params.append(hi)
+    if bale is not None:
+        where.append("(s.bale_s = ? OR s.bale_i = ?)")
+        params += [bale, bale]
+    if line is not None:
+        where.append("s.line_id = ?")
+        params.append(line)
+    return where, params
+
+def sample_project(row, keys) -> dict:
+    """API dict of a sample_select(keys) row (plain tuple or sqlite3.Row)."""
+    d = dict(zip(keys, row))
+    if "ts" in d:
+        d["ts"] = ts_iso(d["ts"])
+    for k in ("stroke", "q_stroke"):
+        if k in d:
+            d[k] = parse_strokes(d[k])
+    return d
+
+class _StrokeIds:
+    """stroke_json -> stroke_sets.id for one connection (inserts unseen lists)."""
+
+    def __init__(self):
+        self._ids = {}
+
+    def get(self, con, stroke_json: str | None) -> int | None:
+        if stroke_json is None:
+            return None
+        sid = self._ids.get(stroke_json)
+        if sid is None:
+            con.execute("INSERT OR IGNORE INTO stroke_sets (stroke_json) VALUES (?)", (stroke_json,))
+            sid = con.execute("SELECT id FROM stroke_sets WHERE stroke_json = ?", (stroke_json,)).fetchone()[0]
+            if len(self._ids) > 4096:
+                self._ids.clear()
+            self._ids[stroke_json] = sid
+        return sid
+
+    def resolve(self, con, rows: list[tuple]) -> list[tuple]:
+        return [
+            r[:10] + (self.get(con, r[10]),) + r[11:13] + (self.get(con, r[13]),) + r[14:]
+            for r in rows
+        ]
+
+    def clear(self):
+        # ids inserted by a rolled-back transaction are gone
+        self._ids.clear()
+
+
+# ---- Batched writer ----
+_active_writer = None
+
+class SampleWriter:
+    """
+    Long-lived writer: one persistent connection (WAL), samples buffered in
+    memory and flushed with executemany in a single transaction when the
+    buffer reaches batch_size or its oldest row is older than flush_sec.
+    """
+
+    def __init__(self, batch_size: int = DB_BATCH_SIZE, flush_sec: float = DB_FLUSH_SEC):
+        self.batch_size = max(1, batch_size)
+        self.flush_sec = flush_sec
+        self._con = None
+        self._buf = []
+        self._bales = []              # bale summary rows, written with the next flush
+        self._oldest = 0.0            # monotonic time of first buffered row
+        self._ignore_existing = False # buffer holds replayed rows: skip ids already stored
+        self._stroke_ids = _StrokeIds()
+
+        self.last_flush_ms = 0.0
+        self.last_flush_rows = 0
+        self.rows_written = 0
+        self.duplicates = 0           # rows skipped because their id was already stored
+        self.rejected = 0             # rows set aside: the batch failed a constraint even when skipping stored ids
+        self.rolled_up_late = 0       # rows inserted below the rollup watermark, rolled up on insert
+
+    def _open(self):
+        global _active_writer
+        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+        con = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+        con.execute("PRAGMA journal_mode=WAL;")
+        con.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS};")
+        self._con = con
+        if _active_writer is None:
+            _active_writer = self
+        return con
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._buf)
+
+    def add(self, **sample):
+        if not self._buf:
+            self._oldest = time.monotonic()
+        self._buf.append(_sample_row(**sample))
+        self._maybe_flush()
+
+    def add_rows(self, rows: list[tuple], replayed: bool = False):
+        """
+        Buffer rows already built by _sample_row. replayed rows (from a spill
+        file) may already be stored; the flush that writes them skips those ids.
+        """
+        if not rows:
+            return
+        if not self._buf:
+            self._oldest = time.monotonic()
+        self._buf.extend(rows)
+        self._ignore_existing = self._ignore_existing or replayed
+        self._maybe_flush()
+
+    def add_bale(self, **bale):
+        """Buffer a bales row; it is committed in the same transaction as the next flush."""
+        self._bales.append(_bale_row(**bale))
+
+    def due(self) -> bool:
+        return bool(self._buf) and (time.monotonic() - self._oldest) >= self.flush_sec
+
+    def _maybe_flush(self):
+        if len(self._buf) >= self.batch_size or (time.monotonic() - self._oldest) >= self.flush_sec:
+            self.flush()
+
+    def _insert(self, con) -> int:
+        """One transaction for the buffered rows; returns the number of samples inserted."""
+        try:
+            with con:  # BEGIN ... COMMIT / ROLLBACK
+                rows = self._stroke_ids.resolve(con, self._buf)
+                if self._ignore_existing:
+                    # Row by row: only the rows actually inserted are rolled up
+                    ids = [row[15] for row in rows if con.execute(INSERT_SAMPLE_IGNORE_SQL, row).rowcount]
+                else:
+                    con.executemany(INSERT_SAMPLE_SQL, rows)
+                    ids = [row[15] for row in rows]
+                late = _rollup_late(con, ids)
+                if self._bales:
+                    con.executemany(INSERT_BALE_SQL, self._bales)
+        except Exception:
+            self._stroke_ids.clear()
+            raise
+        self.rolled_up_late += late
+        return len(ids)
+
+    def flush(self) -> int:
+        """
+        Write all buffered samples in one transaction. Rows stay buffered on
+        errors that may pass (locked, disk); a constraint error is retried once
+        skipping stored ids, and a batch that still fails is set aside.
+        """
+        if not self._buf and not self._bales:
+            return 0
+        con = self._con or self._open()
+
+        t0 = time.perf_counter()
+        try:
+            n = self._insert(con)
+        except sqlite3.IntegrityError as e:
+            if self._ignore_existing:
+                return self._reject(e)
+            log.warning("sample flush: %s; retrying the batch without the stored ids", e)
+            self._ignore_existing = True
+            try:
+                n = self._insert(con)
+            except sqlite3.IntegrityError as e:
+                return self._reject(e)
+        self.duplicates += len(self._buf) - n
+        self._buf.clear()
+        self._bales.clear()
+        self._ignore_existing = False
+
+        elapsed = time.perf_counter() - t0
+        DB_FLUSH_SECONDS.observe(elapsed)
+        SAMPLES_WRITTEN.inc(n)
+        self.last_flush_ms = round(elapsed * 1000.0, 3)
+        self.last_flush_rows = n
+        self.rows_written += n
+        return n
+
+    def _reject(self, error: Exception) -> int:
+        # Retrying would fail the same way and hold up every row behind it: keep it for inspection
+        log.error("sample flush: %s; setting aside %d samples and %d bale rows in %s",
+                  error, len(self._buf), len(self._bales), DB_REJECT_PATH)
+        try:
+            with open(DB_REJECT_PATH, "a", encoding="utf-8") as f:
+                for row in self._buf:
+                    f.write(json.dumps({"sample": row}) + "\n")
+                for row in self._bales:
+                    f.write(json.dumps({"bale": row}) + "\n")
+        except OSError as e:
+            log.error("sample flush: cannot write %s: %s", DB_REJECT_PATH, e)
+        self.rejected += len(self._buf)
+        self._buf.clear()
+        self._bales.clear()
+        self._ignore_existing = False
+        return 0
+
+    def close(self):
+        global _active_writer
+        try:
+            self.flush()
+        finally:
+            if self._con is not None:
+                self._con.close()
+                self._con = None
+            if _active_writer is self:
+                _active_writer = None
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "last_flush_ms": self.last_flush_ms,
+            "last_flush_rows": self.last_flush_rows,
+            "rows_written": self.rows_written,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "rolled_up_late": self.rolled_up_late,
+        }
+
+def writer_stats() -> dict | None:
+    """Stats of the writer currently open in this process (None if there is none)."""
+    return _active_writer.stats() if _active_writer is not None else None
+
+
+# ---- Writer thread ----
+class BackgroundWriter:
+    """
+    Runs a SampleWriter on its own thread behind a bounded queue, so the
+    collector never waits on SQLite (locks, checkpoints, slow disk).
+
+    When the queue is full the overflow policy decides:
+      block       -> add() waits for room
+      drop_oldest -> the oldest queued sample is discarded
+      spill       -> the sample is appended to DB_SPILL_PATH and replayed later
+    """
+
+    def __init__(
+        self,
+        maxsize: int = DB_QUEUE_SIZE,
+        policy: str = DB_QUEUE_POLICY,
+        spill_path: str = DB_SPILL_PATH,
+        writer: SampleWriter | None = None,
+    ):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"DB_QUEUE_POLICY must be one of {QUEUE_POLICIES}, got {policy!r}")
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.spill_path = spill_path
+        self._writer = writer or SampleWriter()
+
+        self._q = deque()
+        self._bales = deque()         # bale summaries are small and never dropped
+        self._cv = threading.Condition()
+        self._stop = False
+        self._flush_requested = False
+        self._spill_file = None
+        self._spill_pending = False
+
+        self.enqueued = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.last_error = None
+
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    # ---- producer side (collector thread) ----
+    def add(self, **sample):
+        with self._cv:
+            if len(self._q) >= self.maxsize:
+                if self.policy == "block":
+                    while len(self._q) >= self.maxsize and not self._stop:
+                        self._cv.wait(0.5)
+                elif self.policy == "drop_oldest":
+                    self._q.popleft()
+                    self.dropped += 1
+                else:
+                    self._spill(sample)
+                    return
+            self._q.append(sample)
+            self.enqueued += 1
+            self._cv.notify_all()
+
+    def add_bale(self, **bale):
+        with self._cv:
+            self._bales.append(bale)
+            self._cv.notify_all()
+
+    def flush(self):
+        """Ask the writer thread to write everything queued so far (non-blocking)."""
+        with self._cv:
+            self._flush_requested = True
+            self._cv.notify_all()
+
+    def close(self, timeout: float = 10.0):
+        """Drain the queue, flush and stop the writer thread."""
+        with self._cv:
+            self._stop = True
+            self._cv.notify_all()
+        self._thread.join(timeout)
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._q) + self._writer.queue_depth
+
+    def stats(self) -> dict:
+        return {
+            **self._writer.stats(),
+            "queue_depth": self.queue_depth,
+            "policy": self.policy,
+            "enqueued": self.enqueued,
+            "written": self._writer.rows_written,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+            "last_error": self.last_error,
+        }
+
+    # ---- spill file (called with self._cv held) ----
+    def _spill(self, sample: dict):
+        try:
+            if self._spill_file is None:
+                self._spill_file = open(self.spill_path, "a", encoding="utf-8")
+            self._spill_file.write(json.dumps(_sample_row(**sample)) + "\n")
+            self._spill_file.flush()
+            self.spilled += 1
+            self._spill_pending = True
+        except Exception as e:
+            self.dropped += 1
+            self.last_error = f"spill: {e}"
+
+    def _replay_spill(self):
+        # A replay that failed part-way is finished before another file is moved over it
+        if os.path.exists(self.spill_path + ".replay"):
+            self._replay_file(self.spill_path + ".replay")
+        # Move the file aside under the lock so new spills start a fresh file
+        with self._cv:
+            self._spill_pending = False
+            if self._spill_file is not None:
+                self._spill_file.close()
+                self._spill_file = None
+            if not os.path.exists(self.spill_path):
+                return
+            os.replace(self.spill_path, self.spill_path + ".replay")
+        self._replay_file(self.spill_path + ".replay")
+
+    def _replay_file(self, path: str):
+        rows = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    if isinstance(row[0], str):  # spilled before the v2 schema (ISO ts)
+                        row[0] = _ts_ms(datetime.fromisoformat(row[0]))
+                    if len(row) == 14:           # spilled before the rec column
+                        row.append(None)
+                    if len(row) == 15:           # spilled before ids were assigned up front
+                        row.append(next_sample_id())
+                    if len(row) == 16:           # spilled before the line_id column
+                        row.append(1)
+                    rows.append(tuple(row))
+                if len(rows) >= self._writer.batch_size:
+                    self._writer.add_rows(rows, replayed=True)
+                    self._writer.flush()
+                    self.replayed += len(rows)
+                    rows = []
+        self._writer.add_rows(rows, replayed=True)
+        self._writer.flush()
+        self.replayed += len(rows)
+        os.remove(path)
+
+    # ---- consumer side (writer thread) ----
+    def _run(self):
+        global _active_writer
+        _active_writer = self
+
+        # A replay interrupted by a crash/restart is finished first
+        if os.path.exists(self.spill_path + ".replay"):
+            try:
+                self._replay_file(self.spill_path + ".replay")
+            except Exception as e:
+                self.last_error = f"replay: {e}"
+        self._spill_pending = os.path.exists(self.spill_path) or os.path.exists(self.spill_path + ".replay")
+
+        while True:
+            with self._cv:
+                # Only pull more work once the SampleWriter buffer has room again
+                while not (self._q or self._bales or self._stop or self._flush_requested or self._writer.due()):
+                    self._cv.wait(self._writer.flush_sec)
+                take = max(0, self._writer.batch_size - self._writer.queue_depth)
+                batch = [self._q.popleft() for _ in range(min(take, len(self._q)))]
+                # A bale row goes out once its samples have left the queue
+                bales = [self._bales.popleft() for _ in range(len(self._bales))] if not self._q else []
+                flush_now = self._flush_requested or self._stop
+                self._flush_requested = False
+                stopping = self._stop and not self._q and not self._bales
+                self._cv.notify_all()  # wake producers blocked on a full queue
+
+            try:
+                # add_rows buffers before flushing, so a failed flush loses nothing
+                self._writer.add_rows([_sample_row(**sample) for sample in batch])
+                for bale in bales:
+                    self._writer.add_bale(**bale)
+                if flush_now or self._writer.due():
+                    self._writer.flush()
+                if self._spill_pending and not self._q:
+                    self._replay_spill()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                if stopping:
+                    break
+                time.sleep(1.0)  # rows stay buffered; back off and retry
+                continue
+
+            if stopping:
+                break
+
+        try:
+            self._writer.close()
+        except Exception as e:
+            self.last_error = str(e)
+        with self._cv:
+            if self._spill_file is not None:
+                self._spill_file.close()
+                self._spill_file = None
+        if _active_writer is self:
+            _active_writer = None
+
+
+# ---- Bale summaries ----
+def backfill_bales() -> int:
+    """
+    Rebuild the bales table from samples (one-time, for data recorded
+    before the collector wrote bale rows). A bale is known to be finished once
+    a sample carries it as q_bale_number; its span and sample count come from
+    the samples with bale_s = that number.
+    """
     with connect() as con:
-        con.execute("""
-        INSERT INTO encoder_samples (
-            ts, data_valid, bale_s, bale_i, bale_ready, ram_forward,
-            encoder_raw, rounds, distance, ram_distance,
-            stroke_json, q_bale_number, q_bale_length, q_stroke_json
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            ts.isoformat(timespec="seconds"),
-            1 if data_valid else 0,
-            bale_s, bale_i,
-            1 if bale_ready else 0,
-            1 if ram_forward else 0,
-            encoder_raw, rounds, distance, ram_distance,
-            json.dumps(stroke_list),
-            q_bale_number, q_bale_length,
-            json.dumps(q_stroke_list),
-        ))
-        con.commit()
+        finished = con.execute("""
+            SELECT s.line_id, s.q_bale_number, s.q_bale_length, ss.stroke_json, MIN(s.id)
+            FROM samples s
+            LEFT JOIN stroke_sets ss ON ss.id = s.q_stroke_id
+            WHERE s.q_bale_number IS NOT NULL
+            GROUP BY s.line_id, s.q_bale_number
+            ORDER BY MIN(s.id)
+        """).fetchall()
+
+        rows = []
+        for line_id, number, length, stroke_json, _ in finished:
+            start_ms, end_ms, count = con.execute(
+                "SELECT MIN(ts_ms), MAX(ts_ms), COUNT(*) FROM samples WHERE bale_s = ? AND line_id = ?",
+                (number, line_id),
+            ).fetchone()
+            last = con.execute(
+                "SELECT rounds FROM samples WHERE bale_s = ? AND line_id = ? ORDER BY id DESC LIMIT 1",
+                (number, line_id),
+            ).fetchone()
+            strokes = json.loads(stroke_json) if stroke_json else []
+            rows.append((
+                number,
+                ts_iso(start_ms) if start_ms is not None else None,
+                ts_iso(end_ms) if end_ms is not None else None,
+                length,
+                last[0] if last else None,
+                json.dumps(strokes), sum(1 for x in strokes if x), count,
+                line_id,
+            ))
+
+        with con:
+            con.execute("DELETE FROM bales")
+            con.executemany(INSERT_BALE_SQL, rows)
+        return len(rows)
+
+
+# ---- v1 -> v2 migration ----
+def _v1_to_v2(con, strokes: _StrokeIds, row) -> tuple:
+    return (
+        _ts_ms(datetime.fromisoformat(row["ts"])),
+        row["data_valid"], row["bale_s"], row["bale_i"], row["bale_ready"], row["ram_forward"],
+        row["encoder_raw"], row["rounds"], row["distance"], row["ram_distance"],
+        strokes.get(con, row["stroke_json"]),
+        row["q_bale_number"], row["q_bale_length"],
+        strokes.get(con, row["q_stroke_json"]),
+        None,
+        row["id"],
+        1,
+    )
+
+_INSERT_V1_ROW_SQL = INSERT_SAMPLE_SQL.replace("INSERT INTO samples (", "INSERT OR IGNORE INTO samples (")
+
+def _seed_from_v1(con):
+    # Copy the newest v1 row before anything else is written, so new samples get
+    # ids above every v1 id and the migration can keep the original ids.
+    if con.execute("SELECT 1 FROM samples LIMIT 1").fetchone() is not None:
+        return
+    row = con.execute("SELECT * FROM encoder_samples ORDER BY id DESC LIMIT 1").fetchone()
+    if row is None:
+        return
+    with con:
+        con.execute(_INSERT_V1_ROW_SQL, _v1_to_v2(con, _StrokeIds(), row))
+
+def migrate_v1(batch_size: int = MIGRATE_BATCH, pause: float = MIGRATE_PAUSE_SEC) -> int:
+    """
+    Online copy of encoder_samples (v1) into samples in small transactions so
+    the collector keeps writing. Ids are preserved and copied in ascending
+    order (keeps b-tree pages packed), progress is kept in meta (resumable),
+    and the v1 table is dropped at the end.
+    """
+    copied = 0
+    with connect() as con:
+        if not _has_table(con, "encoder_samples"):
+            return 0
+        _seed_from_v1(con)
+        strokes = _StrokeIds()
+
+        while True:
+            upto = con.execute("SELECT value FROM meta WHERE key = 'v1_migrated_upto'").fetchone()
+            upto = int(upto[0]) if upto else 0
+            rows = con.execute(
+                "SELECT * FROM encoder_samples WHERE id > ? ORDER BY id LIMIT ?",
+                (upto, batch_size),
+            ).fetchall()
+            if not rows:
+                break
+            try:
+                with con:
+                    con.executemany(_INSERT_V1_ROW_SQL, [_v1_to_v2(con, strokes, r) for r in rows])
+                    con.execute(
+                        "INSERT OR REPLACE INTO meta (key, value) VALUES ('v1_migrated_upto', ?)",
+                        (rows[-1]["id"],),
+                    )
+            except Exception:
+                strokes.clear()
+                raise
+            copied += len(rows)
+            time.sleep(pause)
+
+        with con:
+            con.execute("DROP TABLE encoder_samples")
+            con.execute("DELETE FROM meta WHERE key = 'v1_migrated_upto'")
+    return copied
+
+def migrate_rollups(con, batch_size: int = MIGRATE_BATCH, pause: float = MIGRATE_PAUSE_SEC, stop=None) -> int:
+    """
+    Online copy of the rollup buckets set aside by init_db (*_v1, from before
+    line_id) into the per-line tables, oldest first in small transactions;
+    each *_v1 table is dropped once empty. Returns the buckets copied.
+    """
+    copied = 0
+    before = con.execute("SELECT value FROM meta WHERE key = 'rollup_v1_before'").fetchone()
+    for table, key in ROLLUP_TABLES:
+        legacy = f"{table}_v1"
+        if before is None or not _has_table(con, legacy):
+            continue
+        limit = int(before[0]) // (60 if key == "ts_m" else 1)
+        while not (stop is not None and stop.is_set()):
+            last = con.execute(
+                f"SELECT MAX({key}) FROM (SELECT {key} FROM {legacy} ORDER BY {key} LIMIT ?)", (batch_size,)
+            ).fetchone()[0]
+            with con:
+                if last is None:
+                    con.execute(f"DROP TABLE {legacy}")
+                    break
+                # Newer buckets are rebuilt from the raw samples
+                cur = con.execute(
+                    f"INSERT OR IGNORE INTO {table} ({key}, line_id, {_ROLLUP_COLUMNS}) "
+                    f"SELECT {key}, 1, {_ROLLUP_COLUMNS} FROM {legacy} WHERE {key} <= ? AND {key} < ?",
+                    (last, limit),
+                )
+                con.execute(f"DELETE FROM {legacy} WHERE {key} <= ?", (last,))
+            copied += cur.rowcount
+            time.sleep(pause)
+    if before is not None and not any(_has_table(con, f"{table}_v1") for table, _ in ROLLUP_TABLES):
+        with con:
+            con.execute("DELETE FROM meta WHERE key = 'rollup_v1_before'")
+    return copied
+
+_migration_thread = None
+
+def start_v1_migration():
+    """Run migrate_v1 in the background if a v1 table is still present."""
+    global _migration_thread
+    with connect() as con:
+        if not _has_table(con, "encoder_samples"):
+            return
+    if _migration_thread and _migration_thread.is_alive():
+        return
+
+    def run():
+        try:
+            log.info("v1 migration done: %d rows", migrate_v1())
+        except Exception:
+            log.exception("v1 migration failed")
+
+    _migration_thread = threading.Thread(target=run, name="db-migrate-v1", daemon=True)
+    _migration_thread.start()
+
+
+# ---- Read connection pool ----
+class ReadPool:
+    """
+    Bounded pool of read-only connections for the web app. Connections are
+    opened with mode=ro and query_only (a reader can never take the write
+    lock the collector needs), keep their page cache and statement cache
+    between requests, and are pinged before reuse when they sat idle.
+    connection() waits up to `timeout` for a free one and then raises
+    TimeoutError.
+    """
+
+    def __init__(self, size: int = DB_READ_POOL_SIZE, timeout: float = DB_READ_POOL_TIMEOUT):
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._idle = []               # (connection, monotonic time returned)
+        self._open = 0
+        self._cv = threading.Condition()
+
+        self.checkouts = 0
+        self.timeouts = 0
+        self.discarded = 0
+        self.in_use = 0
+        self.max_in_use = 0
+        self.wait = LatencyWindow()
+
+    def _new(self):
+        con = sqlite3.connect(
+            f"file:{DB_PATH}?mode=ro", uri=True, timeout=30, check_same_thread=False, cached_statements=256
+        )
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA query_only = ON;")
+        con.execute(f"PRAGMA cache_size = -{DB_READ_CACHE_KIB};")
+        con.execute(f"PRAGMA mmap_size = {DB_READ_MMAP_MB * 1024 * 1024};")
+        return con
+
+    def _healthy(self, con, idle_since: float) -> bool:
+        if time.monotonic() - idle_since < DB_READ_CHECK_SEC:
+            return True
+        try:
+            con.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _acquire(self):
+        t0 = time.monotonic()
+        deadline = t0 + self.timeout
+        with self._cv:
+            while True:
+                if self._idle:
+                    con, idle_since = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    self._open += 1
+                    con, idle_since = None, None
+                    break
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    self.timeouts += 1
+                    raise TimeoutError(f"no free read connection after {self.timeout:.1f}s")
+                self._cv.wait(left)
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+            self.checkouts += 1
+        self.wait.add(time.monotonic() - t0)
+
+        # Open / health-check outside the lock
+        try:
+            if con is not None and not self._healthy(con, idle_since):
+                self._discard(con, reopen=True)
+                con = None
+            return con if con is not None else self._new()
+        except Exception:
+            with self._cv:
+                self._open -= 1
+                self.in_use -= 1
+                self._cv.notify()
+            raise
+
+    def _discard(self, con, reopen: bool = False):
+        try:
+            con.close()
+        except sqlite3.Error:
+            pass
+        with self._cv:
+            self.discarded += 1
+            if not reopen:
+                self._open -= 1
+                self._cv.notify()
+
+    def _release(self, con, broken: bool):
+        if not broken and con.in_transaction:
+            try:
+                con.rollback()
+            except sqlite3.Error:
+                broken = True
+        with self._cv:
+            self.in_use -= 1
+        if broken:
+            self._discard(con)
+            return
+        with self._cv:
+            self._idle.append((con, time.monotonic()))
+            self._cv.notify()
+
+    @contextmanager
+    def connection(self):
+        con = self._acquire()
+        broken = False
+        try:
+            yield con
+        except sqlite3.DatabaseError:
+            broken = True
+            raise
+        finally:
+            self._release(con, broken)
+
+    def close(self):
+        with self._cv:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for con, _ in idle:
+            con.close()
+
+    def stats(self) -> dict:
+        with self._cv:
+            return {
+                "size": self.size,
+                "open": self._open,
+                "in_use": self.in_use,
+                "idle": len(self._idle),
+                "max_in_use": self.max_in_use,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "discarded": self.discarded,
+                "wait_ms": self.wait.summary_ms(),
+            }
+
+
+# ---- Persistent pool object (importable, used by webapp) ----
+read_pool = ReadPool()
+
+
+# ---- Storage report ----
+def storage_stats() -> dict:
+    """Bytes on disk per table (incl. its indexes) and bytes per stored sample."""
+    with connect() as con:
+        owner = {name: tbl for name, tbl in con.execute("SELECT name, tbl_name FROM sqlite_master")}
+        sizes = {}
+        try:
+            for name, size in con.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name"):
+                table = owner.get(name, name)
+                sizes[table] = sizes.get(table, 0) + size
+        except sqlite3.OperationalError:
+            pass  # SQLite built without dbstat
+
+        page_size = con.execute("PRAGMA page_size").fetchone()[0]
+        page_count = con.execute("PRAGMA page_count").fetchone()[0]
+        out = {"file_bytes": page_size * page_count, "tables": {}}
+        for table in ("samples", "stroke_sets", "encoder_samples", "bales"):
+            if not _has_table(con, table):
+                continue
+            rows = con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            out["tables"][table] = {"rows": rows, "bytes": sizes.get(table)}
+
+        t = out["tables"]
+        if "samples" in t and t["samples"]["rows"] and t["samples"]["bytes"] is not None:
+            total = t["samples"]["bytes"] + (t.get("stroke_sets", {}).get("bytes") or 0)
+            out["bytes_per_sample"] = round(total / t["samples"]["rows"], 1)
+        if "encoder_samples" in t and t["encoder_samples"]["rows"] and t["encoder_samples"]["bytes"] is not None:
+            out["v1_bytes_per_sample"] = round(t["encoder_samples"]["bytes"] / t["encoder_samples"]["rows"], 1)
+        return out
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Encoder database maintenance")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("init", help="create tables and indexes")
+    sub.add_parser("backfill-bales", help="rebuild the bales table from samples")
+    sub.add_parser("migrate", help="copy the v1 encoder_samples table into the v2 schema")
+    sub.add_parser("stats", help="print storage use and bytes per sample")
+    sub.add_parser("enable-incremental-vacuum", help="switch an existing database to auto_vacuum=INCREMENTAL (runs VACUUM, stop the collector first)")
+    args = parser.parse_args()
+
+    init_db()
+    if args.cmd == "backfill-bales":
+        print(f"bales rebuilt: {backfill_bales()}")
+    elif args.cmd == "migrate":
+        print(f"v1 rows migrated: {migrate_v1()}")
+    elif args.cmd == "stats":
+        print(json.dumps(storage_stats(), indent=2))
+    elif args.cmd == "enable-incremental-vacuum":
+        with connect() as con:
+            con.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+            con.execute("VACUUM;")
+            print("auto_vacuum:", con.execute("PRAGMA auto_vacuum").fetchone()[0])
@@ -0,0 +1,257 @@
+import io
+import os
+import csv
+import sys
+import json
+import zlib
+from datetime import datetime
+
+import db
+
+# Optional: zstandard (zstd compression), pyarrow (arrow / parquet formats).
+# pyarrow costs ~50 MB of RSS, so it is only imported by the first columnar export.
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+pa = pq = None
+
+# ---- Export configuration ----
+EXPORT_BATCH = int(os.getenv("EXPORT_BATCH", "10000"))  # rows per query / output chunk / parquet row group
+
+FORMATS = ("csv", "ndjson", "arrow", "parquet")
+COMPRESSIONS = ("none", "gzip", "zstd")
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst", "none": ""}
+
+
+def check(fmt: str, compress: str = "none"):
+    """Raise ValueError / RuntimeError for an unknown format or a missing optional package."""
+    global pa, pq
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {FORMATS}, got {fmt!r}")
+    if compress not in COMPRESSIONS:
+        raise ValueError(f"compress must be one of {COMPRESSIONS}, got {compress!r}")
+    if fmt in ("arrow", "parquet") and pa is None:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError(f"{fmt} export needs pyarrow (pip install pyarrow)")
+        # malloc instead of jemalloc: freed batches go back to the OS (128 MB container)
+        pa.set_memory_pool(pa.system_memory_pool())
+    if compress == "zstd" and zstandard is None and fmt != "parquet":
+        raise RuntimeError("zstd compression needs zstandard (pip install zstandard)")
+
+
+def filename(fmt: str, compress: str = "none", lo: int | None = None, hi: int | None = None,
+             bale: int | None = None, line: int | None = None) -> str:
+    def part(ms):
+        return datetime.fromtimestamp(ms / 1000).strftime("%Y%m%dT%H%M%S") if ms is not None else "all"
+    name = f"samples_{part(lo)}_{part(hi)}" + (f"_line{line}" if line is not None else "")
+    name += f"_bale{bale}" if bale is not None else ""
+    return f"{name}.{fmt}" + ("" if fmt == "parquet" else SUFFIXES[compress])
+
+
+def media_type(fmt: str, compress: str = "none") -> str:
+    if compress == "none" or fmt == "parquet":
+        return MEDIA_TYPES[fmt]
+    return "application/gzip" if compress == "gzip" else "application/zstd"
+
+
+# ---- Reading ----
+def iter_batches(keys=db.SAMPLE_KEYS, lo=None, hi=None, bale=None, batch: int = EXPORT_BATCH, line=None):
+    """
+    Raw sample_select(keys) tuples in id order, `batch` rows at a time. Every
+    batch is its own short query continuing after the last id (keyset), so
+    a long export never keeps a read transaction open (the WAL can still be
+    checkpointed) and memory stays at one batch.
+    """
+    with db.connect() as con:
+        con.row_factory = None
+        filters = db.sample_filters(con, lo, hi, bale, line)
+        if filters is None:
+            return
+        where, params = filters
+        sql = db.sample_select(keys) + " WHERE " + " AND ".join([*where, "s.id > ?"]) + " ORDER BY s.id LIMIT ?"
+        last = 0
+        while True:
+            rows = con.execute(sql, (*params, last, batch)).fetchall()
+            if not rows:
+                return
+            yield rows
+            last = rows[-1][0]
+
+
+def _ts_text(ts_ms: int) -> str:
+    # Exports keep millisecond precision (the API shows seconds, as v1 did)
+    return datetime.fromtimestamp(ts_ms / 1000).isoformat(timespec="milliseconds")
+
+
+# ---- Encoders: batches of tuples -> bytes ----
+def _csv(batches, keys):
+    ts_col = keys.index("ts") if "ts" in keys else None
+    buf = io.StringIO()
+    out = csv.writer(buf, lineterminator="\n")
+    out.writerow(keys)
+    for rows in batches:
+        for row in rows:
+            if ts_col is not None:
+                row = (*row[:ts_col], _ts_text(row[ts_col]), *row[ts_col + 1:])
+            out.writerow(row)  # stroke columns stay the stored JSON text
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+
+def _ndjson(batches, keys):
+    encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+    for rows in batches:
+        lines = []
+        for row in rows:
+            d = db.sample_project(row, keys)
+            if "ts" in d:
+                d["ts"] = _ts_text(row[keys.index("ts")])
+            lines.append(encode(d))
+        yield ("\n".join(lines) + "\n").encode()
+
+
+_ARROW_TYPES = {
+    "id": "int64", "data_valid": "bool", "bale_s": "int64", "bale_i": "int64",
+    "bale_ready": "bool", "ram_forward": "bool", "encoder_raw": "int64",
+    "rounds": "float64", "distance": "float64", "ram_distance": "float64",
+    "q_bale_number": "int64", "q_bale_length": "float64", "rec": "int64", "line_id": "int64",
+}
+
+
+def _schema(keys):
+    fields = []
+    for k in keys:
+        if k == "ts":
+            fields.append(pa.field(k, pa.timestamp("ms", tz="UTC")))
+        elif k in ("stroke", "q_stroke"):
+            fields.append(pa.field(k, pa.list_(pa.float64())))
+        else:
+            fields.append(pa.field(k, pa.type_for_alias(_ARROW_TYPES[k])))
+    return pa.schema(fields)
+
+
+def _record_batch(rows, keys, schema):
+    columns = []
+    for i, k in enumerate(keys):
+        values = [row[i] for row in rows]
+        if k in ("stroke", "q_stroke"):
+            values = [db.parse_strokes(v) if v else None for v in values]
+        elif k in ("data_valid", "bale_ready", "ram_forward"):
+            values = [None if v is None else bool(v) for v in values]
+        columns.append(pa.array(values, type=schema.field(k).type))
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file object that hands pyarrow's output back to the generator."""
+
+    def __init__(self):
+        self.parts = []
+        self.pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.parts.append(bytes(b))
+        self.pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.pos
+
+    def take(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+
+def _arrow(batches, keys):
+    schema = _schema(keys)
+    sink = _Sink()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for rows in batches:
+            writer.write_batch(_record_batch(rows, keys, schema))
+            yield sink.take()
+    yield sink.take()
+
+
+def _parquet(batches, keys, compression):
+    schema = _schema(keys)
+    sink = _Sink()
+    # One row group per batch; the codec is parquet's own (no outer compression)
+    with pq.ParquetWriter(sink, schema, compression=compression) as writer:
+        for rows in batches:
+            writer.write_batch(_record_batch(rows, keys, schema))
+            yield sink.take()
+    yield sink.take()
+
+
+def _compressed(chunks, compress):
+    if compress == "none":
+        yield from chunks
+        return
+    if compress == "gzip":
+        z = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    else:
+        z = zstandard.ZstdCompressor(level=3).compressobj()
+    for chunk in chunks:
+        data = z.compress(chunk)
+        if data:
+            yield data
+    yield z.flush()
+
+
+def stream(fmt: str = "csv", keys=db.SAMPLE_KEYS, lo=None, hi=None, bale=None,
+           compress: str = "none", batch: int = EXPORT_BATCH, line=None):
+    """Export as an iterator of bytes chunks (constant memory: one batch at a time)."""
+    check(fmt, compress)
+    batches = iter_batches(keys, lo, hi, bale, batch, line)
+    if fmt == "parquet":
+        yield from _parquet(batches, keys, compress)
+        return
+    encoder = {"csv": _csv, "ndjson": _ndjson, "arrow": _arrow}[fmt]
+    yield from _compressed(encoder(batches, keys), compress)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export encoder samples")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--from", dest="from_", help="start (epoch ms or ISO)")
+    parser.add_argument("--to", help="end, exclusive (epoch ms or ISO)")
+    parser.add_argument("--bale", type=int, help="only samples of this bale (bale_s or bale_i)")
+    parser.add_argument("--line", type=int, help="only samples of this line (line_id)")
+    parser.add_argument("--fields", help="comma separated keys (default: all)")
+    parser.add_argument("--compress", choices=COMPRESSIONS, default="none")
+    parser.add_argument("--out", help="output file (default: generated name, '-' for stdout)")
+    args = parser.parse_args()
+
+    lo, hi = db.parse_time(args.from_), db.parse_time(args.to)
+    keys = db.sample_keys(args.fields)
+    out = args.out or filename(args.format, args.compress, lo, hi, args.bale, args.line)
+
+    f = sys.stdout.buffer if out == "-" else open(out, "wb")
+    try:
+        for chunk in stream(args.format, keys, lo, hi, args.bale, args.compress, line=args.line):
+            f.write(chunk)
+    finally:
+        if f is not sys.stdout.buffer:
+            f.close()
+    if out != "-":
+        print(f"wrote {out} ({os.path.getsize(out)} bytes)", file=sys.stderr)
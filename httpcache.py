@@ -0,0 +1,183 @@
+import os
+import gzip
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+# Optional: brotli (smaller than gzip for JSON; served to clients that accept "br")
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# ---- Cache configuration ----
+SAMPLES_CACHE_MB = float(os.getenv("SAMPLES_CACHE_MB", "16"))            # compressed bodies kept (0 = off)
+SAMPLES_CACHE_MAX_ROWS = int(os.getenv("SAMPLES_CACHE_MAX_ROWS", "5000"))  # larger limits are streamed, not cached
+SAMPLES_CACHE_GZIP_LEVEL = int(os.getenv("SAMPLES_CACHE_GZIP_LEVEL", "6"))
+
+
+def etag(key: tuple, version: str) -> str:
+    """Weak validator: the same query over the same data version (any content encoding)."""
+    digest = hashlib.blake2b(repr((key, version)).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def http_date(epoch: float) -> str:
+    return formatdate(epoch, usegmt=True)
+
+
+def not_modified(headers, tag: str, modified: float | None) -> bool:
+    """If-None-Match (weak comparison) wins; If-Modified-Since only counts without it."""
+    inm = headers.get("if-none-match")
+    if inm is not None:
+        if inm.strip() == "*":
+            return True
+        return any(t.strip().removeprefix("W/") == tag.removeprefix("W/") for t in inm.split(","))
+    ims = headers.get("if-modified-since")
+    if ims is None or modified is None:
+        return False
+    # Whole seconds only: a write later in the second of the date must not match,
+    # so only data last changed strictly before it is unchanged
+    try:
+        return modified < parsedate_to_datetime(ims).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def accepted(headers) -> str:
+    """Best encoding the client takes: br (if brotli is installed), gzip, identity."""
+    value = headers.get("accept-encoding", "")
+    offered = {}
+    for part in value.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip().lower()] = q
+    if brotli is not None and offered.get("br", 0) > 0:
+        return "br"
+    if offered.get("gzip", 0) > 0:
+        return "gzip"
+    return "identity"
+
+
+class CachedBody:
+    """One response body, kept compressed; other encodings are derived on demand."""
+    __slots__ = ("etag", "modified", "length", "bodies")
+
+    def __init__(self, tag: str, modified: float | None, body: bytes, level: int = SAMPLES_CACHE_GZIP_LEVEL):
+        self.etag = tag
+        self.modified = modified
+        self.length = len(body)
+        self.bodies = {"gzip": gzip.compress(body, compresslevel=level, mtime=0)}
+
+    @property
+    def size(self) -> int:
+        return sum(len(b) for b in self.bodies.values())
+
+    def encoded(self, encoding: str) -> bytes:
+        if encoding in self.bodies:
+            return self.bodies[encoding]
+        raw = gzip.decompress(self.bodies["gzip"])
+        return raw if encoding == "identity" else brotli.compress(raw, quality=5)
+
+
+class ResponseCache:
+    """
+    LRU of CachedBody by query key, bounded by the compressed bytes it holds.
+    Each key keeps only its newest version: an entry for an older data
+    version is dropped when the query is answered again.
+    """
+
+    def __init__(self, max_bytes: int = int(SAMPLES_CACHE_MB * 1024 * 1024), max_rows: int = SAMPLES_CACHE_MAX_ROWS):
+        self.max_bytes = max_bytes
+        self.max_rows = max_rows
+        self._entries = OrderedDict()   # key -> CachedBody
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.uncached = 0               # too large (or cache off): streamed
+        self.evictions = 0
+        self.compress_sec = 0.0
+
+    def caches(self, limit: int) -> bool:
+        return self.max_bytes > 0 and limit <= self.max_rows
+
+    def get(self, key: tuple, tag: str) -> CachedBody | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.etag != tag:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: tuple, tag: str, modified: float | None, body: bytes) -> CachedBody:
+        t0 = time.perf_counter()
+        entry = CachedBody(tag, modified, body)
+        elapsed = time.perf_counter() - t0
+        with self._lock:
+            self.compress_sec += elapsed
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            if entry.size <= self.max_bytes:
+                self._entries[key] = entry
+                self._bytes += entry.size
+                while self._bytes > self.max_bytes:
+                    _, dropped = self._entries.popitem(last=False)
+                    self._bytes -= dropped.size
+                    self.evictions += 1
+        return entry
+
+    def body(self, key: tuple, entry: CachedBody, encoding: str) -> bytes:
+        """entry's body in encoding; a br body is kept on the entry once made."""
+        data = entry.encoded(encoding)
+        if encoding == "br":
+            with self._lock:
+                if "br" not in entry.bodies:
+                    entry.bodies["br"] = data
+                    if self._entries.get(key) is entry:
+                        self._bytes += len(data)
+        return data
+
+    def count(self, result: str):
+        with self._lock:
+            if result == "not_modified":
+                self.not_modified += 1
+            else:
+                self.uncached += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            served = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / served, 3) if served else None,
+                "not_modified": self.not_modified,
+                "uncached": self.uncached,
+                "evictions": self.evictions,
+                "compress_sec": round(self.compress_sec, 3),
+                "brotli": brotli is not None,
+            }
+
+
+# ---- Persistent cache object (webapp /api/samples) ----
+samples_cache = ResponseCache()
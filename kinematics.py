@@ -0,0 +1,113 @@
+import os
+import math
+
+import numpy as np
+
+# ---- Encoder / wheel constants ----
+ENCODER_COUNTS_PER_ROUND = float(os.getenv("ENCODER_COUNTS_PER_ROUND", "35999"))  # raw counts of one wheel turn
+ENCODER_WHEEL_DIAMETER = float(os.getenv("ENCODER_WHEEL_DIAMETER", "23"))        # distance = rounds * pi * diameter
+ENCODER_WRAP_THRESHOLD = 30000  # a jump larger than this between two reads is a counter turn-over
+
+WRAP_FORWARD = 1
+WRAP_BACKWARD = -1
+
+
+class EncoderTracker:
+    """
+    Bale distance from the raw encoder count, as the collector has always
+    computed it: the counter wraps at counts_per_round, a jump of more than
+    ENCODER_WRAP_THRESHOLD is a turn-over, and rounds / distance are relative
+    to the last reset() (bale change).
+
+    The backward turn-over is kept exactly as the original loop did it (the
+    counts to the top of the range are subtracted and then again through the
+    diff against counts_per_round), so re-derived distances match stored ones.
+
+    update() is the per-sample path (no allocations); update_batch() does the
+    same for an array of raw counts with NumPy. With integer counts and an
+    integral counts_per_round both produce identical counters.
+    """
+    __slots__ = ("counts_per_round", "diameter", "previous", "counter", "forward_wraps", "backward_wraps")
+
+    def __init__(self, counts_per_round: float = ENCODER_COUNTS_PER_ROUND, diameter: float = ENCODER_WHEEL_DIAMETER):
+        self.counts_per_round = counts_per_round
+        self.diameter = diameter
+        self.previous = None      # last raw count (sEncoderPrevious)
+        self.counter = 0.0        # counts since the last reset (sRoundCounter)
+        self.forward_wraps = 0
+        self.backward_wraps = 0
+
+    @property
+    def rounds(self) -> float:
+        return self.counter / self.counts_per_round
+
+    @property
+    def distance(self) -> float:
+        """Bale distance, rounded to 2 decimals as stored."""
+        return round(self.counter / self.counts_per_round * math.pi * self.diameter, 2)
+
+    def reset(self):
+        """New bale: distance starts from 0 (the raw position is kept)."""
+        self.counter = 0.0
+
+    def update(self, raw: int) -> int:
+        """Feed one raw count; returns WRAP_FORWARD / WRAP_BACKWARD on a turn-over, else 0."""
+        prev = self.previous
+        if prev is None:
+            prev = raw
+        wrap = 0
+        if (prev - raw) > ENCODER_WRAP_THRESHOLD:
+            self.counter += (self.counts_per_round - prev)
+            prev = 0
+            wrap = WRAP_FORWARD
+            self.forward_wraps += 1
+        elif (raw - prev) > ENCODER_WRAP_THRESHOLD:
+            self.counter -= (self.counts_per_round - raw)
+            prev = self.counts_per_round
+            wrap = WRAP_BACKWARD
+            self.backward_wraps += 1
+        self.counter += raw - prev
+        self.previous = raw
+        return wrap
+
+    def update_batch(self, raws, resets=None):
+        """
+        Feed an array of raw counts at once. resets[i] True means reset()
+        before sample i (a bale change). Returns the counter after every
+        sample (float64 array); rounds / distances() turn it into units.
+        The tracker ends in the same state as after update() per sample.
+        """
+        raws = np.asarray(raws, dtype=np.float64)
+        n = len(raws)
+        if n == 0:
+            return np.empty(0)
+        prev = np.empty(n)
+        prev[0] = raws[0] if self.previous is None else self.previous
+        prev[1:] = raws[:-1]
+
+        drop = prev - raws
+        fwd = drop > ENCODER_WRAP_THRESHOLD
+        bwd = ~fwd & (-drop > ENCODER_WRAP_THRESHOLD)
+        inc = -drop
+        inc[fwd] = (self.counts_per_round - prev[fwd]) + raws[fwd]
+        inc[bwd] = 2.0 * (raws[bwd] - self.counts_per_round)
+
+        # Running sum restarted at every reset (start value: the current counter)
+        inc[0] += 0.0 if resets is not None and resets[0] else self.counter
+        total = np.cumsum(inc)
+        if resets is not None:
+            resets = np.asarray(resets, dtype=bool)
+            idx = np.where(resets, np.arange(n), 0)
+            np.maximum.accumulate(idx, out=idx)
+            base = np.where(idx > 0, total[idx - 1], 0.0)
+            total = total - base
+
+        self.previous = raws[-1].item()
+        self.counter = total[-1].item()
+        self.forward_wraps += int(fwd.sum())
+        self.backward_wraps += int(bwd.sum())
+        return total
+
+    def distances(self, counters):
+        """Distances (2 decimals) for counters from update_batch."""
+        return np.round(np.asarray(counters) / self.counts_per_round * math.pi * self.diameter, 2)
@@ -0,0 +1,116 @@
+import os
+import json
+
+import Modbus_TCPV3
+from collector import MASTER_IP, MODBUS_PORT, POLL_INTERVAL, ENCODER_TIMEOUT
+
+# JSON file listing the (encoder, PLC) pairs to collect from (see lines.example.json).
+# Unset: a single line 1 built from the ENCODER_* / PLC_* environment variables.
+LINES_CONFIG = os.getenv("LINES_CONFIG", "").strip()
+
+
+class LineConfig:
+    """One baler: its encoder and PLC. Samples and bales are stored with line_id = id."""
+    __slots__ = (
+        "id", "name",
+        "encoder_ip", "encoder_port", "encoder_timeout", "poll_interval",
+        "plc_ip", "plc_port", "plc_device_id", "plc_timeout", "plc_poll_sec", "plc_tags",
+    )
+
+    def __init__(
+        self,
+        id: int = 1,
+        name: str | None = None,
+        encoder_ip: str = MASTER_IP,
+        encoder_port: int = MODBUS_PORT,
+        encoder_timeout: float = ENCODER_TIMEOUT,
+        poll_interval: float = POLL_INTERVAL,
+        plc_ip: str = Modbus_TCPV3.MODBUS_IP,
+        plc_port: int = Modbus_TCPV3.MODBUS_PORT,
+        plc_device_id: int = Modbus_TCPV3.DEVICE_ID,
+        plc_timeout: float = Modbus_TCPV3.TIMEOUT_SEC,
+        plc_poll_sec: float = Modbus_TCPV3.POLL_SEC,
+        plc_tags: dict[str, int] | None = None,
+    ):
+        self.id = id
+        self.name = name or f"line {id}"
+        self.encoder_ip = encoder_ip
+        self.encoder_port = encoder_port
+        self.encoder_timeout = encoder_timeout
+        self.poll_interval = poll_interval
+        self.plc_ip = plc_ip
+        self.plc_port = plc_port
+        self.plc_device_id = plc_device_id
+        self.plc_timeout = plc_timeout
+        self.plc_poll_sec = plc_poll_sec
+        self.plc_tags = dict(plc_tags or Modbus_TCPV3.PLC_TAGS)
+
+    def plc_poller(self, state: Modbus_TCPV3.MachineState | None = None) -> Modbus_TCPV3.PlcPoller:
+        return Modbus_TCPV3.PlcPoller(
+            self.plc_ip, self.plc_port, self.plc_device_id, self.plc_timeout, self.plc_poll_sec,
+            self.plc_tags, state=state, line_id=self.id, name=f"plc-{self.id}",
+        )
+
+    def public(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "encoder": f"{self.encoder_ip}:{self.encoder_port}",
+            "plc": f"{self.plc_ip}:{self.plc_port}/{self.plc_device_id}",
+            "poll_interval": self.poll_interval,
+        }
+
+    def __repr__(self):
+        return f"LineConfig(#{self.id} {self.name!r}, encoder {self.encoder_ip}:{self.encoder_port}, plc {self.plc_ip}:{self.plc_port})"
+
+
+def _line(entry: dict) -> LineConfig:
+    if not isinstance(entry.get("id"), int) or entry["id"] < 1:
+        raise ValueError(f"line id must be a positive integer: {entry!r}")
+    enc = entry.get("encoder", {})
+    plc = entry.get("plc", {})
+    if "ip" not in enc or "ip" not in plc:
+        raise ValueError(f"line {entry['id']}: encoder.ip and plc.ip are required")
+    tags = plc.get("tags")
+    if tags is not None and not {"BaleNumber", "EventWord"} <= set(tags):
+        raise ValueError(f"line {entry['id']}: plc.tags must map BaleNumber and EventWord")
+    return LineConfig(
+        id=entry["id"],
+        name=entry.get("name"),
+        encoder_ip=enc["ip"],
+        encoder_port=int(enc.get("port", 502)),
+        encoder_timeout=float(enc.get("timeout", ENCODER_TIMEOUT)),
+        poll_interval=float(enc.get("poll_interval", POLL_INTERVAL)),
+        plc_ip=plc["ip"],
+        plc_port=int(plc.get("port", 502)),
+        plc_device_id=int(plc.get("device_id", 1)),
+        plc_timeout=float(plc.get("timeout", Modbus_TCPV3.TIMEOUT_SEC)),
+        plc_poll_sec=float(plc.get("poll_sec", Modbus_TCPV3.POLL_SEC)),
+        plc_tags={k: int(v) for k, v in tags.items()} if tags is not None else None,
+    )
+
+
+def load_lines(path: str = LINES_CONFIG) -> list[LineConfig]:
+    """Lines from the config file (ValueError if it is malformed), or the single env-configured line."""
+    if not path:
+        return [LineConfig()]
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    entries = config.get("lines") if isinstance(config, dict) else None
+    if not entries:
+        raise ValueError(f"{path}: expected {{\"lines\": [...]}} with at least one line")
+    lines = [_line(e) for e in entries]
+    ids = [line.id for line in lines]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"{path}: duplicate line ids {ids}")
+    return lines
+
+
+_configured = None
+
+def configured() -> list[LineConfig]:
+    """load_lines() once per process."""
+    global _configured
+    if _configured is None:
+        _configured = load_lines()
+    return _configured
@@ -0,0 +1,155 @@
+import os
+import json
+import asyncio
+import threading
+from collections import deque
+
+import db
+
+# ---- Live push configuration ----
+LIVE_BUFFER = int(os.getenv("LIVE_BUFFER", "5000"))                # events kept for replay / reconnects
+LIVE_KEEPALIVE_SEC = float(os.getenv("LIVE_KEEPALIVE_SEC", "15"))  # SSE comment when idle (proxies)
+LIVE_MAX_CLIENTS = int(os.getenv("LIVE_MAX_CLIENTS", "20"))
+
+
+def sample_payload(sample: dict) -> dict:
+    """API shape of a collector sample (same keys and id as /api/samples)."""
+    d = {k: sample.get(k) for k in db.SAMPLE_KEYS}
+    d["ts"] = sample["ts"].isoformat(timespec="seconds")
+    d["stroke"] = list(sample["stroke_list"])
+    d["q_stroke"] = list(sample["q_stroke_list"])
+    return d
+
+
+def bale_payload(bale: dict) -> dict:
+    """API shape of a bale summary (same keys as /api/bales, id not yet assigned)."""
+    strokes = list(bale["stroke_list"])
+    return {
+        "id": None,
+        "line_id": bale.get("line_id", 1),
+        "bale_number": bale["bale_number"],
+        "start_ts": bale["start_ts"].isoformat(timespec="seconds") if bale["start_ts"] else None,
+        "end_ts": bale["end_ts"].isoformat(timespec="seconds") if bale["end_ts"] else None,
+        "length": bale["length"],
+        "rounds": bale["rounds"],
+        "stroke_count": sum(1 for x in strokes if x),
+        "sample_count": bale["sample_count"],
+        "strokes": strokes,
+    }
+
+
+class LiveHub:
+    """
+    In-process fan-out of new samples and bale events to push clients.
+
+    publish() is called from the collector (any thread). Each event is
+    serialized once, numbered and kept in a bounded deque, so clients that
+    reconnect with Last-Event-ID (or ask for a backlog) are served from
+    memory instead of SQLite. Waiting clients are woken on their own event
+    loop via call_soon_threadsafe.
+    """
+
+    def __init__(self, size: int = LIVE_BUFFER):
+        self._events = deque(maxlen=max(1, size))   # (seq, kind, data_json)
+        self._lock = threading.Lock()
+        self._waiters = set()                        # (loop, asyncio.Event)
+        self.seq = 0
+
+        self.published = 0
+        self.clients = 0
+
+    # ---- producer side ----
+    def publish(self, kind: str, data: dict):
+        text = json.dumps(data, separators=(",", ":"))
+        with self._lock:
+            self.seq += 1
+            self._events.append((self.seq, kind, text))
+            self.published += 1
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # loop already closed
+
+    def restart(self):
+        """
+        The producer started over (sample ids may repeat): drop the buffer and
+        skip a sequence number, so every client gets a reset with the next event.
+        """
+        with self._lock:
+            self._events.clear()
+            self.seq += 1
+
+    # ---- consumer side ----
+    def since(self, seq: int) -> tuple[list[tuple], bool]:
+        """Events after seq, and whether older ones were already evicted (gap)."""
+        with self._lock:
+            if not self._events or seq >= self.seq:
+                return [], False
+            first = self._events[0][0]
+            gap = seq < first - 1
+            start = max(0, seq - first + 1)
+            return [self._events[i] for i in range(start, len(self._events))], gap
+
+    def backlog_seq(self, samples: int) -> int:
+        """Sequence number to start from so that the last n samples are replayed."""
+        with self._lock:
+            if samples <= 0:
+                return self.seq
+            found = 0
+            for seq, kind, _ in reversed(self._events):
+                if kind == "sample":
+                    found += 1
+                    if found >= samples:
+                        return seq - 1
+            return self._events[0][0] - 1 if self._events else self.seq
+
+    async def stream(self, after: int, reset: bool = False, is_disconnected=None):
+        """
+        Server-Sent Events for everything after seq `after`. A client that
+        fell further behind than the buffer (or asked with reset=True) gets a
+        "reset" event first and should clear what it shows.
+        """
+        loop = asyncio.get_running_loop()
+        waiter = (loop, asyncio.Event())
+        with self._lock:
+            self._waiters.add(waiter)
+            self.clients += 1
+        try:
+            yield f"retry: 2000\nevent: hello\ndata: {json.dumps({'seq': self.seq})}\n\n"
+            if reset:
+                yield f"event: reset\ndata: {json.dumps({'seq': self.seq})}\n\n"
+            while True:
+                waiter[1].clear()
+                events, gap = self.since(after)
+                if gap:
+                    yield f"event: reset\ndata: {json.dumps({'seq': self.seq})}\n\n"
+                if events:
+                    yield "".join(f"id: {seq}\nevent: {kind}\ndata: {text}\n\n" for seq, kind, text in events)
+                    after = events[-1][0]
+                    continue
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), LIVE_KEEPALIVE_SEC)
+                except asyncio.TimeoutError:
+                    if is_disconnected is not None and await is_disconnected():
+                        return
+                    yield ": keepalive\n\n"
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+                self.clients -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "seq": self.seq,
+                "buffered": len(self._events),
+                "buffer_size": self._events.maxlen,
+                "published": self.published,
+                "clients": self.clients,
+            }
+
+
+# ---- Persistent hub object (collector publishes, webapp streams) ----
+hub = LiveHub()
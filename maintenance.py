@@ -0,0 +1,154 @@
+import os
+import time
+import threading
+
+import db
+from metrics import log
+
+# ---- Retention / rollup configuration ----
+RETENTION_DAYS = float(os.getenv("RETENTION_DAYS", "30"))          # raw samples (0 = keep forever)
+RETENTION_1S_DAYS = float(os.getenv("RETENTION_1S_DAYS", "180"))   # per-second rollup (0 = forever)
+RETENTION_1M_DAYS = float(os.getenv("RETENTION_1M_DAYS", "0"))     # per-minute rollup (0 = forever)
+MAINT_INTERVAL_SEC = float(os.getenv("MAINT_INTERVAL_SEC", "60"))
+
+ROLLUP_BATCH = int(os.getenv("MAINT_ROLLUP_BATCH", "5000"))     # samples rolled up per transaction
+DELETE_BATCH = int(os.getenv("MAINT_DELETE_BATCH", "2000"))     # rows deleted per transaction
+BATCH_PAUSE_SEC = float(os.getenv("MAINT_BATCH_PAUSE_SEC", "0.1"))
+VACUUM_PAGES = int(os.getenv("MAINT_VACUUM_PAGES", "500"))      # pages released per run
+
+ROLLUP_SETTLE_MS = 2000  # leave the current (still filling) second alone
+
+
+class Maintenance:
+    """
+    Background housekeeping for the samples table:
+      1. roll raw samples up into samples_1s / samples_1m per line (incremental, by id watermark)
+      2. delete raw / 1s / 1m rows past their retention, in small batches
+      3. give freed pages back with incremental_vacuum (auto_vacuum=INCREMENTAL databases)
+    Bales are never deleted. Every step is a short transaction with a pause in
+    between, so the collector's writer never waits long for the lock.
+    """
+
+    def __init__(self, interval_sec: float = MAINT_INTERVAL_SEC):
+        self.interval_sec = interval_sec
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.runs = 0
+        self.rolled_up = 0
+        self.rekeyed = 0              # pre-line_id buckets copied into the per-line rollups
+        self.deleted = {"samples": 0, "samples_1s": 0, "samples_1m": 0}
+        self.vacuumed_pages = 0
+        self.last_run_ms = 0.0
+        self.last_error = None
+
+    # ---- steps ----
+    def rekey(self, con):
+        self.rekeyed += db.migrate_rollups(con, ROLLUP_BATCH, BATCH_PAUSE_SEC, self._stop)
+
+    def rollup(self, con):
+        upto = con.execute("SELECT value FROM meta WHERE key = 'rollup_upto'").fetchone()
+        upto = int(upto[0]) if upto else 0
+        cutoff_ms = int(time.time() * 1000) - ROLLUP_SETTLE_MS
+        head = con.execute("SELECT MAX(id) FROM samples WHERE ts_ms < ?", (cutoff_ms,)).fetchone()[0]
+
+        while head is not None and upto < head and not self._stop.is_set():
+            hi = min(head, upto + ROLLUP_BATCH)
+            with con:
+                # Write lock first: the writer rolls up rows it inserts below the watermark
+                # it reads, so a batch and its watermark must not interleave with a flush
+                con.execute("BEGIN IMMEDIATE")
+                db.rollup_samples(con, "id > ? AND id <= ?", (upto, hi))
+                con.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('rollup_upto', ?)", (hi,))
+            self.rolled_up += hi - upto
+            upto = hi
+            time.sleep(BATCH_PAUSE_SEC)
+
+    def _delete_older(self, con, table: str, key: str, cutoff, extra: str = "", params: tuple = ()):
+        while not self._stop.is_set():
+            with con:
+                cur = con.execute(
+                    f"DELETE FROM {table} WHERE {key} IN "
+                    f"(SELECT {key} FROM {table} WHERE {key} < ? {extra} ORDER BY {key} LIMIT ?)",
+                    (cutoff, *params, DELETE_BATCH),
+                )
+            self.deleted[table] += cur.rowcount
+            if cur.rowcount < DELETE_BATCH:
+                return
+            time.sleep(BATCH_PAUSE_SEC)
+
+    def retention(self, con):
+        now = time.time()
+        if RETENTION_DAYS > 0:
+            cutoff_ms = int((now - RETENTION_DAYS * 86400) * 1000)
+            # Highest expired id; only rows already rolled up (ids up to the watermark) are removed
+            last = con.execute("SELECT MAX(id) FROM samples WHERE ts_ms < ?", (cutoff_ms,)).fetchone()[0]
+            upto = con.execute("SELECT value FROM meta WHERE key = 'rollup_upto'").fetchone()
+            if last is not None and upto is not None:
+                self._delete_older(con, "samples", "id", min(last, int(upto[0])) + 1)
+        if RETENTION_1S_DAYS > 0:
+            self._delete_older(con, "samples_1s", "ts_s", int(now - RETENTION_1S_DAYS * 86400))
+        if RETENTION_1M_DAYS > 0:
+            self._delete_older(con, "samples_1m", "ts_m", int((now - RETENTION_1M_DAYS * 86400) // 60))
+
+    def vacuum(self, con):
+        if con.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:  # 2 = INCREMENTAL
+            return
+        free = con.execute("PRAGMA freelist_count").fetchone()[0]
+        if free:
+            # executescript steps the pragma to completion (execute() frees one page)
+            con.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES});")
+            self.vacuumed_pages += free - con.execute("PRAGMA freelist_count").fetchone()[0]
+
+    def run_once(self):
+        t0 = time.perf_counter()
+        with db.connect() as con:
+            self.rekey(con)
+            self.rollup(con)
+            self.retention(con)
+            self.vacuum(con)
+        self.runs += 1
+        self.last_run_ms = round((time.perf_counter() - t0) * 1000.0, 1)
+
+    # ---- thread ----
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                log.exception("maintenance run failed")
+            self._stop.wait(self.interval_sec)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="db-maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return {
+            "running": self._thread is not None and self._thread.is_alive(),
+            "retention_days": {"samples": RETENTION_DAYS, "samples_1s": RETENTION_1S_DAYS, "samples_1m": RETENTION_1M_DAYS},
+            "runs": self.runs,
+            "rolled_up": self.rolled_up,
+            "rekeyed": self.rekeyed,
+            "deleted": self.deleted,
+            "vacuumed_pages": self.vacuumed_pages,
+            "last_run_ms": self.last_run_ms,
+            "last_error": self.last_error,
+        }
+
+
+# ---- Persistent maintenance object (importable, started by the collector) ----
+maintenance = Maintenance()
+
+if __name__ == "__main__":
+    db.init_db()
+    maintenance.run_once()
+    print(maintenance.stats())
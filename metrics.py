@@ -0,0 +1,254 @@
+import os
+import time
+import logging
+import threading
+from bisect import bisect_left
+
+import scheduler
+
+# ---- Logging configuration ----
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip().upper()
+LOG_SAMPLE_SEC = float(os.getenv("LOG_SAMPLE_SEC", "1"))   # at most one sample line per interval (0 = every sample)
+
+# Modbus round-trips and SQLite transactions: 1 ms .. 5 s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(v) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+# ---- Metric types ----
+class Counter:
+    """Monotonic counter, optionally split by labels: c.inc(), c.inc(2, device="plc")."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[n] for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value: float, **labels):
+        """Mirror a count kept elsewhere (e.g. FixedRateScheduler.overruns)."""
+        key = tuple(labels[n] for n in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels[n] for n in self.labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, v in items:
+            yield self.name, _labels_text(self.labels, key), v
+
+
+class Gauge(Counter):
+    """Current value, set by the owner (or read at scrape time via Registry.collector)."""
+
+    kind = "gauge"
+
+
+class Histogram:
+    """Cumulative-bucket histogram of durations in seconds (Prometheus layout)."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}                # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[n] for n in self.labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            s[i] += 1
+            s[-1] += value
+
+    def time(self, **labels):
+        """Context manager observing the time spent in its block."""
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, list(s)) for k, s in self._series.items())
+        for key, s in items:
+            total = 0
+            for bound, n in zip((*self.buckets, float("inf")), s):
+                total += n
+                yield self.name + "_bucket", _labels_text(self.labels, key, f'le="{_num(bound)}"'), total
+            yield self.name + "_sum", _labels_text(self.labels, key), s[-1]
+            yield self.name + "_count", _labels_text(self.labels, key), total
+
+
+class _Timer:
+    __slots__ = ("hist", "labels", "t0")
+
+    def __init__(self, hist: Histogram, labels: dict):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.t0, **self.labels)
+        return False
+
+
+class Registry:
+    """Metrics of this process, rendered in the Prometheus text format for /metrics."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collector(self, fn):
+        """fn() is called before every render, to copy stats kept elsewhere into gauges/counters."""
+        with self._lock:
+            self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = list(self._metrics)
+        for fn in collectors:
+            try:
+                fn()
+            except Exception as e:
+                log.warning("metrics collector %s failed: %s", getattr(fn, "__name__", fn), e)
+        lines = []
+        for m in metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for name, labels, value in m.samples():
+                lines.append(f"{name}{labels} {_num(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# ---- Process metrics (importable singletons; see webapp /metrics) ----
+registry = Registry()
+
+MODBUS_READ_SECONDS = registry.histogram(
+    "modbus_read_seconds", "Duration of one successful Modbus read cycle", ("line", "device"))
+MODBUS_READ_ERRORS = registry.counter(
+    "modbus_read_errors_total", "Failed Modbus reads (timeouts, exception responses, lost connections)", ("line", "device"))
+MODBUS_RECONNECTS = registry.counter(
+    "modbus_reconnects_total", "Modbus connections re-established after a failure", ("line", "device"))
+MODBUS_CONNECTED = registry.gauge(
+    "modbus_connected", "1 while the Modbus TCP session to the device is up", ("line", "device"))
+ENCODER_WRAPS = registry.counter(
+    "encoder_wraps_total", "Encoder counter turn-overs seen by the collector", ("line", "direction"))
+DB_FLUSH_SECONDS = registry.histogram(
+    "db_flush_seconds", "Duration of one sample/bale insert transaction")
+SAMPLES_WRITTEN = registry.counter(
+    "samples_written_total", "Sample rows committed to SQLite")
+BALES_COMPLETED = registry.counter(
+    "bales_completed_total", "Bales finished by the bale tracker", ("line",))
+CHECKPOINT_SECONDS = registry.histogram(
+    "checkpoint_write_seconds", "Duration of one collector state checkpoint write", ("line",))
+LOOP_OVERRUNS = registry.counter(
+    "loop_overruns_total", "Scheduler ticks missed because the previous tick ran too long", ("loop",))
+LOOP_TICKS = registry.counter(
+    "loop_ticks_total", "Scheduler ticks run", ("loop",))
+
+
+@registry.collector
+def _scheduler_stats():
+    # FixedRateScheduler keeps its own counters; copied at scrape time
+    with scheduler._registry_lock:
+        loops = list(scheduler.SCHEDULERS.values())
+    for s in loops:
+        LOOP_OVERRUNS.set(s.overruns, loop=s.name)
+        LOOP_TICKS.set(s.ticks, loop=s.name)
+
+
+# ---- Logging ----
+log = logging.getLogger("encoder")
+
+
+def setup_logging(level: str = LOG_LEVEL):
+    """Log lines to stderr at LOG_LEVEL (an existing root handler, e.g. uvicorn's, is kept)."""
+    logging.basicConfig(
+        level=getattr(logging, level, logging.INFO),
+        format="%(asctime)s %(levelname)s %(name)s %(message)s",
+    )
+    log.setLevel(getattr(logging, level, logging.INFO))
+
+
+class RateLimitedLog:
+    """
+    Logs at most one record per interval and reports how many were skipped in
+    between. Callers check ready() first, so the skipped ones cost no string
+    formatting at all.
+    """
+
+    def __init__(self, logger: logging.Logger, interval_sec: float = LOG_SAMPLE_SEC, level: int = logging.INFO):
+        self.logger = logger
+        self.interval_sec = interval_sec
+        self.level = level
+        self._next = 0.0
+        self.suppressed = 0
+
+    def ready(self) -> bool:
+        if not self.logger.isEnabledFor(self.level):
+            return False
+        now = time.monotonic()
+        if now < self._next:
+            self.suppressed += 1
+            return False
+        self._next = now + self.interval_sec
+        return True
+
+    def emit(self, msg: str, *args):
+        if self.suppressed:
+            msg += " suppressed=%d"
+            args = (*args, self.suppressed)
+            self.suppressed = 0
+        self.logger.log(self.level, msg, *args)
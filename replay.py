@@ -0,0 +1,276 @@
+import os
+import sys
+import csv
+import json
+import time
+import logging
+import sqlite3
+import itertools
+from datetime import datetime
+
+import numpy as np
+
+import db
+from Modbus_TCPV3 import MachineState
+from collector import Collector, RecordPolicy
+from kinematics import EncoderTracker, ENCODER_COUNTS_PER_ROUND, ENCODER_WHEEL_DIAMETER
+from metrics import log
+
+# One recorded / generated encoder read: epoch ms, data_valid, raw count, PLC bale number, ram forward
+FRAME_DTYPE = np.dtype([
+    ("ts_ms", np.int64), ("data_valid", np.int8), ("encoder_raw", np.int64),
+    ("bale_i", np.int64), ("ram_forward", np.int8),
+])
+
+
+# ---- Sources ----
+def recorded(path: str = db.DB_PATH, line: int = 1, lo: int | None = None, hi: int | None = None) -> np.ndarray:
+    """
+    Frames stored in a database, oldest first: samples (v2, one line) or
+    encoder_samples (v1). A NULL bale number repeats the previous one.
+    """
+    con = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        tables = {r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if "samples" in tables and con.execute("SELECT 1 FROM samples LIMIT 1").fetchone():
+            sql = ("SELECT ts_ms, data_valid, IFNULL(encoder_raw, 0), IFNULL(bale_i, -1), ram_forward "
+                   "FROM samples WHERE line_id = ?")
+            params = [line]
+            span = db.id_range(con, lo, hi) if lo is not None or hi is not None else (None, None)
+            if span is None:
+                return np.empty(0, dtype=FRAME_DTYPE)
+            for op, value in ((">=", span[0]), ("<=", span[1])):
+                if value is not None:
+                    sql += f" AND id {op} ?"
+                    params.append(value)
+            rows = con.execute(sql + " ORDER BY id", params)
+        else:
+            rows = (
+                (db.parse_time(ts), valid, raw or 0, -1 if bale is None else bale, ram)
+                for ts, valid, raw, bale, ram in con.execute(
+                    "SELECT ts, data_valid, encoder_raw, bale_i, ram_forward FROM encoder_samples ORDER BY id"
+                )
+            )
+        frames = np.fromiter(rows, dtype=FRAME_DTYPE)
+    finally:
+        con.close()
+
+    if lo is not None:
+        frames = frames[frames["ts_ms"] >= lo]
+    if hi is not None:
+        frames = frames[frames["ts_ms"] < hi]
+    # Carry the last known bale number over NULLs
+    bale = frames["bale_i"]
+    known = np.where(bale >= 0, np.arange(len(bale)), 0)
+    np.maximum.accumulate(known, out=known)
+    frames["bale_i"] = np.where(bale >= 0, bale, bale[known])
+    frames["bale_i"][frames["bale_i"] < 0] = 0
+    return frames
+
+
+def synthetic(
+    n: int,
+    period_ms: int = 100,
+    strokes_per_bale: int = 3,
+    stroke_samples: int = 30,
+    return_samples: int = 30,
+    counts_per_sample: int = 480,
+    start_bale: int = 1,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    A generated run: the ram pushes the wheel forward for stroke_samples reads
+    (with some jitter), rests for return_samples, and the PLC bale number goes
+    up every strokes_per_bale strokes. The raw count wraps at 36000.
+    """
+    rng = np.random.default_rng(seed)
+    cycle = stroke_samples + return_samples
+    i = np.arange(n)
+    ram = (i % cycle) < stroke_samples
+    step = np.where(ram, counts_per_sample + rng.integers(-40, 41, n), 0)
+    raw = np.minimum(np.cumsum(step) % 36000, int(ENCODER_COUNTS_PER_ROUND))
+
+    frames = np.empty(n, dtype=FRAME_DTYPE)
+    frames["ts_ms"] = int(time.time() * 1000) - n * period_ms + i * period_ms
+    frames["data_valid"] = 1
+    frames["encoder_raw"] = raw
+    frames["bale_i"] = start_bale + i // (cycle * strokes_per_bale)
+    frames["ram_forward"] = ram
+    return frames
+
+
+# ---- Pipeline ----
+class ReplaySink:
+    """Stands in for the BackgroundWriter: counts samples, keeps bale summaries."""
+
+    def __init__(self, keep_samples: bool = False):
+        self.samples = 0
+        self.bales = []
+        self.distances = [] if keep_samples else None
+
+    def add(self, **sample):
+        self.samples += 1
+        if self.distances is not None:
+            self.distances.append(sample["distance"])
+
+    def add_bale(self, **bale):
+        self.bales.append(bale)
+
+    def flush(self):
+        pass
+
+
+def replay(frames: np.ndarray, encoder: EncoderTracker | None = None, record_mode: str = "all",
+           keep_samples: bool = False) -> tuple[ReplaySink, dict]:
+    """
+    Feed frames through MachineState -> BaleTracker -> Collector on a virtual
+    clock (the frame timestamps), as fast as the CPU allows. Nothing is
+    written to the database or pushed to live clients.
+    """
+    sink = ReplaySink(keep_samples)
+    state = MachineState()
+    if len(frames):
+        first = frames[0]
+        state.update_from_modbus(int(first["bale_i"]), int(first["ram_forward"]), first["ts_ms"] / 1000.0)
+    collector = Collector(
+        state, sink, RecordPolicy(mode=record_mode), encoder=encoder,
+        next_id=itertools.count(1).__next__, live=False,
+    )
+
+    t0 = time.perf_counter()
+    words = [0, 0, 0]
+    for ts_ms, valid, raw, bale, ram in frames.tolist():
+        t = ts_ms / 1000.0
+        state.update_from_modbus(bale, ram, t)
+        collector.poll_events()
+        words[1] = valid
+        words[2] = raw
+        collector.process(words, datetime.fromtimestamp(t), t)
+    elapsed = time.perf_counter() - t0
+
+    span = (frames["ts_ms"][-1] - frames["ts_ms"][0]) / 1000.0 if len(frames) > 1 else 0.0
+    return sink, {
+        "frames": len(frames),
+        "stored": sink.samples,
+        "bales": len(sink.bales),
+        "sec": round(elapsed, 3),
+        "frames_per_sec": round(len(frames) / max(elapsed, 1e-9)),
+        "realtime_factor": round(span / max(elapsed, 1e-9), 1),
+    }
+
+
+def compare_bales(path: str, bales: list[dict], line: int = 1) -> dict:
+    """Re-derived bale lengths vs the bales table (matched by bale number and start time)."""
+    con = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        stored = {
+            (number, start): length
+            for number, start, length in con.execute(
+                "SELECT bale_number, start_ts, length FROM bales WHERE line_id = ?", (line,)
+            )
+        }
+    finally:
+        con.close()
+    matched = changed = 0
+    max_diff = 0.0
+    for b in bales:
+        key = (b["bale_number"], b["start_ts"].isoformat(timespec="seconds") if b["start_ts"] else None)
+        if key not in stored or stored[key] is None:
+            continue
+        matched += 1
+        diff = abs(b["length"] - stored[key])
+        if diff > 0.005:
+            changed += 1
+            max_diff = max(max_diff, diff)
+    return {"matched": matched, "changed": changed, "max_length_diff": round(max_diff, 2)}
+
+
+def write_bales(path: str, bales: list[dict]):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        out = csv.writer(f)
+        out.writerow(["bale_number", "start_ts", "end_ts", "length", "rounds", "samples", "strokes"])
+        for b in bales:
+            out.writerow([
+                b["bale_number"],
+                b["start_ts"].isoformat(timespec="milliseconds") if b["start_ts"] else "",
+                b["end_ts"].isoformat(timespec="milliseconds") if b["end_ts"] else "",
+                b["length"], b["rounds"], b["sample_count"], json.dumps(b["stroke_list"]),
+            ])
+
+
+# ---- Benchmark ----
+def batch_matches_scalar(scalar: EncoderTracker, scalar_counters, batch: EncoderTracker, batch_counters) -> bool:
+    """The counter after every sample and the wrap counts agree (not only where both ended)."""
+    return (
+        bool(np.array_equal(np.asarray(scalar_counters, dtype=np.float64), batch_counters))
+        and scalar.forward_wraps == batch.forward_wraps
+        and scalar.backward_wraps == batch.backward_wraps
+    )
+
+
+def benchmark(n: int = 1_000_000, pipeline_n: int = 200_000) -> dict:
+    """Samples/s of the tracker (per sample and batched) and of the full replay pipeline."""
+    frames = synthetic(n)
+    raws = frames["encoder_raw"]
+    resets = np.r_[False, np.diff(frames["bale_i"]) != 0]
+
+    scalar = EncoderTracker()
+    scalar_counters = []
+    t0 = time.perf_counter()
+    for raw, reset in zip(raws.tolist(), resets.tolist()):
+        if reset:
+            scalar.reset()
+        scalar.update(raw)
+        scalar_counters.append(scalar.counter)
+    t1 = time.perf_counter()
+    batch = EncoderTracker()
+    counters = batch.update_batch(raws, resets)
+    batch.distances(counters)
+    t2 = time.perf_counter()
+
+    _, pipe = replay(frames[:pipeline_n])
+    return {
+        "samples": n,
+        "tracker_samples_per_sec": round(n / max(t1 - t0, 1e-9)),
+        "tracker_batch_samples_per_sec": round(n / max(t2 - t1, 1e-9)),
+        "batch_matches_scalar": batch_matches_scalar(scalar, scalar_counters, batch, counters),
+        "pipeline": pipe,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay encoder reads through the bale/stroke pipeline")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    run = sub.add_parser("run", help="replay recorded (or --synthetic) reads and print a summary")
+    run.add_argument("--db", default=db.DB_PATH, help="database to read samples from (default: DB_PATH)")
+    run.add_argument("--line", type=int, default=1)
+    run.add_argument("--from", dest="from_", help="start (epoch ms or ISO)")
+    run.add_argument("--to", help="end, exclusive (epoch ms or ISO)")
+    run.add_argument("--synthetic", type=int, metavar="N", help="replay N generated reads instead")
+    run.add_argument("--counts-per-round", type=float, default=ENCODER_COUNTS_PER_ROUND)
+    run.add_argument("--diameter", type=float, default=ENCODER_WHEEL_DIAMETER, help="wheel diameter (distance units)")
+    run.add_argument("--record-mode", choices=("all", "deadband"), default="all")
+    run.add_argument("--compare", action="store_true", help="compare bale lengths with the stored bales table")
+    run.add_argument("--out", help="write the re-derived bales as CSV")
+    bench = sub.add_parser("bench", help="tracker and pipeline throughput on synthetic reads")
+    bench.add_argument("--samples", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    log.setLevel(logging.WARNING)  # no per-bale / per-second lines while replaying
+    if args.cmd == "bench":
+        print(json.dumps(benchmark(args.samples, min(args.samples, 200_000)), indent=2))
+        sys.exit(0)
+
+    if args.synthetic:
+        frames = synthetic(args.synthetic)
+    else:
+        frames = recorded(args.db, args.line, db.parse_time(args.from_), db.parse_time(args.to))
+    sink, result = replay(frames, EncoderTracker(args.counts_per_round, args.diameter), args.record_mode)
+    if args.compare and not args.synthetic:
+        result["compare"] = compare_bales(args.db, sink.bales, args.line)
+    if args.out:
+        write_bales(args.out, sink.bales)
+        result["out"] = os.path.abspath(args.out)
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,183 @@
+import os
+import math
+import threading
+from array import array
+
+import db
+
+# ---- Ring configuration ----
+# ~100 bytes per slot: 36000 slots (1 hour at 10 Hz) is about 3.6 MB
+RING_CAPACITY = int(os.getenv("RING_CAPACITY", "36000"))
+
+_NULL = -(2 ** 63)  # None in the integer columns (floats use NaN)
+
+
+class SampleRing:
+    """
+    Preallocated ring of the most recent stored samples, one typed array per
+    column (fixed memory, no per-sample objects besides the shared stroke
+    tuples). The collector appends every sample it hands to the writer, with
+    the id it will have in SQLite, so the web app can answer "latest N" and
+    recent bale queries from memory, including rows the writer has not
+    flushed yet, and only go to the database for ids older than the ring.
+    """
+
+    _INTS = ("id", "ts_ms", "bale_s", "bale_i", "encoder_raw", "q_bale_number", "rec", "line_id")
+    _FLOATS = ("rounds", "distance", "ram_distance", "q_bale_length")
+    _FLAGS = ("data_valid", "bale_ready", "ram_forward")
+
+    def __init__(self, capacity: int = RING_CAPACITY):
+        self.capacity = max(1, capacity)
+        self._ints = {k: array("q", [_NULL]) * self.capacity for k in self._INTS}
+        self._floats = {k: array("d", [math.nan]) * self.capacity for k in self._FLOATS}
+        self._flags = {k: array("b", [0]) * self.capacity for k in self._FLAGS}
+        self._stroke = [None] * self.capacity
+        self._q_stroke = [None] * self.capacity
+        self._strokes = {}            # interned stroke tuples (lists repeat for many samples)
+        self._lock = threading.Lock()
+        self._head = 0                # next slot to write
+        self.count = 0
+
+    # ---- producer side (collector) ----
+    def clear(self):
+        """Forget every sample (the producer restarted and will reuse ids of unflushed rows)."""
+        with self._lock:
+            self.count = 0
+
+    def _intern(self, strokes) -> tuple:
+        t = tuple(strokes)
+        cached = self._strokes.get(t)
+        if cached is None:
+            if len(self._strokes) > 4096:
+                self._strokes.clear()
+            cached = self._strokes[t] = t
+        return cached
+
+    def append(self, sample: dict):
+        """sample: the keyword arguments the collector gives the writer (with id)."""
+        stroke = self._intern(sample["stroke_list"])
+        q_stroke = self._intern(sample["q_stroke_list"])
+        ts_ms = int(sample["ts"].timestamp() * 1000)
+        with self._lock:
+            i = self._head
+            for k in self._INTS:
+                v = ts_ms if k == "ts_ms" else sample.get(k)
+                self._ints[k][i] = _NULL if v is None else int(v)
+            for k in self._FLOATS:
+                v = sample.get(k)
+                self._floats[k][i] = math.nan if v is None else v
+            for k in self._FLAGS:
+                self._flags[k][i] = 1 if sample.get(k) else 0
+            self._stroke[i] = stroke
+            self._q_stroke[i] = q_stroke
+            self._head = (i + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    # ---- consumer side (web app) ----
+    def _row(self, i: int) -> dict:
+        d = {}
+        for k in self._INTS:
+            v = self._ints[k][i]
+            d[k] = None if v == _NULL else v
+        for k in self._FLOATS:
+            v = self._floats[k][i]
+            d[k] = None if math.isnan(v) else v
+        for k in self._FLAGS:
+            d[k] = self._flags[k][i]
+        d["ts"] = db.ts_iso(d.pop("ts_ms"))
+        d["stroke"] = list(self._stroke[i])
+        d["q_stroke"] = list(self._q_stroke[i])
+        return {k: d[k] for k in db.SAMPLE_KEYS}
+
+    def _slots(self, ascending: bool = False):
+        # Newest first (or oldest first)
+        if ascending:
+            for n in range(self.count, 0, -1):
+                yield (self._head - n) % self.capacity
+        else:
+            for n in range(1, self.count + 1):
+                yield (self._head - n) % self.capacity
+
+    def select(
+        self,
+        limit: int,
+        bale: int | None = None,
+        before: int | None = None,
+        after: int | None = None,
+        lo_ms: int | None = None,
+        hi_ms: int | None = None,
+        ascending: bool = False,
+        line: int | None = None,
+    ) -> tuple[list[dict], int | None]:
+        """
+        Up to `limit` samples matching the /api/samples filters (bale as bale_s
+        or bale_i, id cursors, ts_ms range [lo_ms, hi_ms), line), newest first
+        unless ascending. Also returns the ring's oldest id at that moment: the
+        caller covers ids below it from SQLite.
+        """
+        out = []
+        with self._lock:
+            ids, ts = self._ints["id"], self._ints["ts_ms"]
+            bale_s, bale_i = self._ints["bale_s"], self._ints["bale_i"]
+            lines = self._ints["line_id"]
+            for i in self._slots(ascending):
+                if len(out) >= limit:
+                    break
+                if before is not None and ids[i] >= before:
+                    if ascending:
+                        break
+                    continue
+                if after is not None and ids[i] <= after:
+                    if ascending:
+                        continue
+                    break
+                if lo_ms is not None and ts[i] < lo_ms:
+                    continue
+                if hi_ms is not None and ts[i] >= hi_ms:
+                    continue
+                if line is not None and lines[i] != line:
+                    continue
+                if bale is None or bale_s[i] == bale or bale_i[i] == bale:
+                    out.append(self._row(i))
+            return out, self._oldest_id()
+
+    def latest(self, line: int | None = None) -> dict | None:
+        with self._lock:
+            for i in self._slots():
+                if line is None or self._ints["line_id"][i] == line:
+                    return self._row(i)
+            return None
+
+    def newest(self) -> tuple[int, int] | None:
+        """(id, ts_ms) of the last appended sample: changes with every sample this process produces."""
+        with self._lock:
+            if not self.count:
+                return None
+            i = (self._head - 1) % self.capacity
+            return self._ints["id"][i], self._ints["ts_ms"][i]
+
+    def _oldest_id(self) -> int | None:
+        if not self.count:
+            return None
+        return self._ints["id"][(self._head - self.count) % self.capacity]
+
+    def oldest_id(self) -> int | None:
+        """Everything from this id upwards (as far as this process produced it) is in the ring."""
+        with self._lock:
+            return self._oldest_id()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "capacity": self.capacity,
+                "count": self.count,
+                "bytes": sum(
+                    a.itemsize * len(a)
+                    for a in (*self._ints.values(), *self._floats.values(), *self._flags.values())
+                ) + 2 * 8 * self.capacity,  # + the two stroke reference lists
+                "oldest_id": self._oldest_id(),
+            }
+
+
+# ---- Persistent ring object (collector appends, webapp reads) ----
+ring = SampleRing()
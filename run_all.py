@@ -1,19 +1,25 @@
 import os
+import sys
 import time
 import threading
-import uvicorn
+
+# single:     collector, PLC pollers, watchdog and web app in this process
+# supervised: acquisition and web app as two child processes (see supervisor.py)
+RUN_MODE = os.getenv("RUN_MODE", "single").strip().lower()
+ACQ_MODE = os.getenv("ACQ_MODE", "threads").strip().lower()  # as acquisition.ACQ_MODE (not imported: supervised stays small)
 
 HEARTBEAT_FILE = os.getenv("HEARTBEAT_FILE", "/tmp/collector_heartbeat.txt")
 WATCHDOG_STALE_SEC = float(os.getenv("WATCHDOG_STALE_SEC", "20"))
 
 def start_collector():
-    # Import starts your collector loop
-    import TestEncoderJanssenV3  # noqa: F401
+    # Runs every configured line until stop() (or until one of its threads dies)
+    import TestEncoderJanssenV3
+    TestEncoderJanssenV3.main()
 
-def watchdog_loop(collector_thread: threading.Thread):
+def watchdog_loop(collector_thread: threading.Thread | None):
     while True:
         # if thread dies -> restart container
-        if not collector_thread.is_alive():
+        if collector_thread is not None and not collector_thread.is_alive():
             print("Collector thread died -> forcing restart")
             os._exit(1)
 
@@ -32,10 +38,26 @@ def watchdog_loop(collector_thread: threading.Thread):
         time.sleep(2)
 
 if __name__ == "__main__":
-    t = threading.Thread(target=start_collector, daemon=False)
-    t.start()
+    if RUN_MODE == "supervised":
+        import supervisor
+        sys.exit(supervisor.main())
+
+    import uvicorn
+
+    t = None
+    if ACQ_MODE != "async":
+        # ACQ_MODE=async: the webapp runs acquisition on its own event loop instead
+        t = threading.Thread(target=start_collector, daemon=False)
+        t.start()
 
     w = threading.Thread(target=watchdog_loop, args=(t,), daemon=True)
     w.start()
 
     uvicorn.run("webapp:app", host="0.0.0.0", port=8000, log_level="info")
+
+    # uvicorn returned (SIGTERM/Ctrl+C) -> let the collector flush and exit
+    collector = sys.modules.get("TestEncoderJanssenV3")
+    if collector is not None and hasattr(collector, "stop"):
+        collector.stop()
+    if t is not None:
+        t.join(timeout=10)
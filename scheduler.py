@@ -0,0 +1,133 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+
+# Number of recent ticks kept for percentiles (3000 = 5 min at 10 Hz)
+TIMING_WINDOW = int(os.getenv("TIMING_WINDOW", "3000"))
+
+# name -> scheduler, for /api/timing
+SCHEDULERS = {}
+_registry_lock = threading.Lock()
+
+
+class LatencyWindow:
+    """Recent durations (seconds) with percentile summary; max is kept over the whole run."""
+
+    def __init__(self, size: int = TIMING_WINDOW):
+        self._values = deque(maxlen=size)
+        self.max = 0.0
+
+    def add(self, value: float):
+        self._values.append(value)
+        if value > self.max:
+            self.max = value
+
+    def summary_ms(self) -> dict:
+        values = sorted(self._values)
+        if not values:
+            return {"p50": None, "p95": None, "p99": None, "max": None, "n": 0}
+
+        def pct(p):
+            return round(values[min(len(values) - 1, int(p * len(values)))] * 1000.0, 3)
+
+        return {
+            "p50": pct(0.50),
+            "p95": pct(0.95),
+            "p99": pct(0.99),
+            "max": round(self.max * 1000.0, 3),
+            "n": len(values),
+        }
+
+
+class FixedRateScheduler:
+    """
+    Ticks on absolute monotonic deadlines (t0, t0+period, t0+2*period, ...), so
+    the sample rate does not drift with the time spent doing work. A late tick
+    runs at once (its lateness is recorded); a tick that is missed entirely is
+    skipped and counted as an overrun instead of being made up with a burst.
+
+    Call wait() (or await wait_async()) at the top of every loop iteration.
+    """
+
+    def __init__(self, name: str, period: float):
+        self.name = name
+        self.period = period
+        self._deadline = None
+        self._tick_start = None
+
+        self.ticks = 0
+        self.overruns = 0
+        self.lateness = LatencyWindow()   # how late each tick started vs its deadline
+        self.work = LatencyWindow()       # time from tick start to the next wait()
+        self._tick_times = deque(maxlen=TIMING_WINDOW)
+
+        with _registry_lock:
+            SCHEDULERS[name] = self
+
+    def _sleep_for(self) -> float:
+        now = time.monotonic()
+        if self._tick_start is not None:
+            self.work.add(now - self._tick_start)
+
+        if self._deadline is None:
+            self._deadline = now
+            return 0.0
+
+        self._deadline += self.period
+        if now > self._deadline:
+            # Skip only the deadlines a whole period behind; the latest one runs now (late)
+            missed = int((now - self._deadline) // self.period)
+            self.overruns += missed
+            self._deadline += missed * self.period
+            return 0.0
+        return self._deadline - now
+
+    def _started(self):
+        now = time.monotonic()
+        self._tick_start = now
+        self.lateness.add(max(0.0, now - self._deadline))
+        self._tick_times.append(now)
+        self.ticks += 1
+
+    def wait(self):
+        delay = self._sleep_for()
+        if delay > 0:
+            time.sleep(delay)
+        self._started()
+
+    async def wait_async(self):
+        delay = self._sleep_for()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._started()
+
+    def reset(self):
+        """Restart the deadline grid (e.g. after a reconnect pause) without counting overruns."""
+        self._deadline = None
+        self._tick_start = None
+
+    def achieved_hz(self) -> float | None:
+        if len(self._tick_times) < 2:
+            return None
+        span = self._tick_times[-1] - self._tick_times[0]
+        return round((len(self._tick_times) - 1) / span, 3) if span > 0 else None
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "period_sec": self.period,
+            "target_hz": round(1.0 / self.period, 3) if self.period > 0 else None,
+            "achieved_hz": self.achieved_hz(),
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "lateness_ms": self.lateness.summary_ms(),
+            "work_ms": self.work.summary_ms(),
+        }
+
+
+def timing_stats() -> list[dict]:
+    with _registry_lock:
+        schedulers = list(SCHEDULERS.values())
+    return [s.stats() for s in schedulers]
@@ -0,0 +1,60 @@
+import os
+import json
+import struct
+from multiprocessing import shared_memory
+
+# Byte layout of the live state block (sharedstate.py), in struct terms so the
+# supervisor can create the block without importing numpy or the acquisition
+# stack. sharedstate's numpy dtypes (align=True) must match these sizes; it
+# checks them on import. Bump VERSION when either changes.
+MAGIC = b"EBLS"
+VERSION = 1
+
+HEADER = struct.Struct("<4sIIIQ")                 # magic, version, lines, slots, stats_size
+SAMPLE = struct.Struct(
+    "<8q4d"                                       # id .. q_bale_number, rounds .. q_bale_length
+    "3B5x"                                        # data_valid, bale_ready, ram_forward (+ padding)
+    "10d10d"                                      # stroke, q_stroke (STROKE_SLOTS each)
+)
+LINE = struct.Struct(
+    "<QqqqQ"                                      # seq, line_id, updated_ms, writer_pid, writer_first
+    "qqd2B6x"                                     # PLC state (+ padding)
+    "qqqdd10d"                                    # bale in progress
+    "Qqqqddq10d"                                  # last finished bale
+    "Q"                                           # samples; the ring of SAMPLEs follows
+)
+LINE_ID_OFFSET = 8                                # after seq
+STATS_HEADER = struct.Struct("<QQ")               # seq, length; the JSON bytes follow
+
+# ---- Live state block configuration ----
+SHARED_SAMPLE_SLOTS = int(os.getenv("SHARED_SAMPLE_SLOTS", "64"))    # stored samples kept per line for the relay
+SHARED_STATS_KB = int(os.getenv("SHARED_STATS_KB", "256"))           # JSON stats snapshot (metrics, devices, ...)
+
+# Same file as lines.LINES_CONFIG (read here without importing lines)
+LINES_CONFIG = os.getenv("LINES_CONFIG", "").strip()
+
+
+def line_size(slots: int) -> int:
+    return LINE.size + slots * SAMPLE.size
+
+
+def size(n_lines: int, slots: int = SHARED_SAMPLE_SLOTS, stats_size: int = SHARED_STATS_KB * 1024) -> int:
+    return HEADER.size + n_lines * line_size(slots) + STATS_HEADER.size + stats_size
+
+
+def configured_line_ids(path: str = LINES_CONFIG) -> list[int]:
+    """Ids of the configured lines (the acquisition process validates the rest of the file)."""
+    if not path:
+        return [1]
+    with open(path, encoding="utf-8") as f:
+        return [int(entry["id"]) for entry in json.load(f)["lines"]]
+
+
+def create(line_ids: list[int], slots: int = SHARED_SAMPLE_SLOTS,
+           stats_size: int = SHARED_STATS_KB * 1024) -> shared_memory.SharedMemory:
+    """A new zeroed block with its header and line ids written; children attach to shm.name."""
+    shm = shared_memory.SharedMemory(create=True, size=size(len(line_ids), slots, stats_size))
+    HEADER.pack_into(shm.buf, 0, MAGIC, VERSION, len(line_ids), slots, stats_size)
+    for i, line_id in enumerate(line_ids):
+        struct.pack_into("<q", shm.buf, HEADER.size + i * line_size(slots) + LINE_ID_OFFSET, line_id)
+    return shm
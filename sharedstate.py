@@ -0,0 +1,404 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from datetime import datetime
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import sharedlayout
+from sharedlayout import MAGIC, VERSION, SHARED_SAMPLE_SLOTS, SHARED_STATS_KB
+from live import hub, sample_payload, bale_payload
+from ringbuffer import ring
+from bale_tracker import STROKE_SLOTS
+from metrics import log
+
+# ---- Live state block configuration ----
+SHARED_RELAY_SEC = float(os.getenv("SHARED_RELAY_SEC", "0.02"))      # web process: poll for new samples / bales
+SHARED_READ_RETRIES = 1000                                           # seqlock retries before giving up
+
+_NULL = -(2 ** 63)  # None in the integer fields (floats use NaN)
+
+# One stored sample, the same fields the collector hands to the writer
+SAMPLE_DTYPE = np.dtype([
+    ("id", "<i8"), ("ts_ms", "<i8"), ("line_id", "<i8"), ("rec", "<i8"),
+    ("bale_s", "<i8"), ("bale_i", "<i8"), ("encoder_raw", "<i8"), ("q_bale_number", "<i8"),
+    ("rounds", "<f8"), ("distance", "<f8"), ("ram_distance", "<f8"), ("q_bale_length", "<f8"),
+    ("data_valid", "u1"), ("bale_ready", "u1"), ("ram_forward", "u1"),
+    ("stroke", "<f8", (STROKE_SLOTS,)), ("q_stroke", "<f8", (STROKE_SLOTS,)),
+], align=True)
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "S4"), ("version", "<u4"), ("lines", "<u4"), ("slots", "<u4"), ("stats_size", "<u8"),
+], align=True)
+
+
+def _line_dtype(slots: int) -> np.dtype:
+    # seq first: the seqlock counter of the record (odd while it is written)
+    return np.dtype([
+        ("seq", "<u8"), ("line_id", "<i8"), ("updated_ms", "<i8"),
+        # publishing process, and the samples count when it took over the record
+        ("writer_pid", "<i8"), ("writer_first", "<u8"),
+        # PLC (MachineState)
+        ("plc_bale_number", "<i8"), ("event_word", "<i8"), ("plc_cycle_ms", "<f8"),
+        ("ram_forward", "u1"), ("ram_return", "u1"),
+        # bale in progress (BaleTracker)
+        ("bale_number", "<i8"), ("bale_start_ms", "<i8"), ("bale_samples", "<i8"),
+        ("distance", "<f8"), ("ram_distance", "<f8"), ("strokes", "<f8", (STROKE_SLOTS,)),
+        # last finished bale; bales counts them
+        ("bales", "<u8"), ("last_bale_number", "<i8"), ("last_start_ms", "<i8"), ("last_end_ms", "<i8"),
+        ("last_length", "<f8"), ("last_rounds", "<f8"), ("last_samples", "<i8"), ("last_strokes", "<f8", (STROKE_SLOTS,)),
+        # stored samples; the newest is ring[(samples - 1) % slots]
+        ("samples", "<u8"), ("ring", SAMPLE_DTYPE, (slots,)),
+    ], align=True)
+
+
+def _stats_dtype(size: int) -> np.dtype:
+    return np.dtype([("seq", "<u8"), ("length", "<u8"), ("data", "u1", (size,))], align=True)
+
+
+def _ms(ts: datetime | None) -> int:
+    return int(ts.timestamp() * 1000) if ts is not None else 0
+
+
+def _ts(ms: int) -> datetime | None:
+    return datetime.fromtimestamp(ms / 1000.0) if ms else None
+
+
+def _int(v: int) -> int | None:
+    return None if v == _NULL else int(v)
+
+
+def _float(v: float) -> float | None:
+    return None if v != v else float(v)
+
+
+def _strokes(values, n: int = STROKE_SLOTS) -> list[float]:
+    out = [float(x) for x in values[:n]]
+    return out + [0.0] * (n - len(out))
+
+
+# The supervisor lays the block out with sharedlayout (no numpy there): same sizes
+if (HEADER_DTYPE.itemsize, SAMPLE_DTYPE.itemsize, _line_dtype(0).itemsize, _stats_dtype(0).itemsize) != (
+        sharedlayout.HEADER.size, sharedlayout.SAMPLE.size, sharedlayout.LINE.size, sharedlayout.STATS_HEADER.size):
+    raise RuntimeError("sharedstate dtypes and sharedlayout structs describe different layouts")
+
+
+def size(n_lines: int, slots: int = SHARED_SAMPLE_SLOTS, stats_kb: int = SHARED_STATS_KB) -> int:
+    return sharedlayout.size(n_lines, slots, stats_kb * 1024)
+
+
+class LiveState:
+    """
+    Fixed-layout block with the collector's live state: per line the PLC
+    machine state, the bale in progress, the last finished bale and the
+    last SHARED_SAMPLE_SLOTS stored samples, plus one JSON stats snapshot.
+
+    Each line record is guarded by a seqlock: its only writer (the line's
+    collector thread) makes seq odd, writes, and makes it even again; a
+    reader copies the record and retries if seq was odd or moved meanwhile.
+    Readers never block the collector and need no lock shared between
+    processes. The block is a multiprocessing SharedMemory in supervised
+    mode (run_all RUN_MODE=supervised) and plain process memory otherwise.
+    """
+
+    def __init__(self, buf, line_ids: list[int] | None = None, slots: int = SHARED_SAMPLE_SLOTS,
+                 stats_kb: int = SHARED_STATS_KB):
+        header = np.ndarray((), HEADER_DTYPE, buffer=buf)
+        if line_ids is not None:
+            header["magic"] = MAGIC
+            header["version"] = VERSION
+            header["lines"] = len(line_ids)
+            header["slots"] = slots
+            header["stats_size"] = stats_kb * 1024
+        elif header["magic"] != MAGIC or header["version"] != VERSION:
+            raise ValueError(f"not a version {VERSION} live state block")
+        self.slots = int(header["slots"])
+        n = int(header["lines"])
+        line_dtype = _line_dtype(self.slots)
+        offset = HEADER_DTYPE.itemsize
+        self._lines = np.ndarray((n,), line_dtype, buffer=buf, offset=offset)
+        self._seq = np.ndarray((n,), "<u8", buffer=buf, offset=offset, strides=(line_dtype.itemsize,))
+        offset += n * line_dtype.itemsize
+        self._stats = np.ndarray((), _stats_dtype(int(header["stats_size"])), buffer=buf, offset=offset)
+        self._stats_seq = np.ndarray((), "<u8", buffer=buf, offset=offset)
+        if line_ids is not None:
+            for i, line_id in enumerate(line_ids):
+                self._lines[i]["line_id"] = line_id
+        self._index = {int(line_id): i for i, line_id in enumerate(self._lines["line_id"])}
+        self._stats_cache = (None, {})
+        self._pid = os.getpid()
+        self.stats_errors = 0
+
+    @property
+    def line_ids(self) -> list[int]:
+        return list(self._index)
+
+    # ---- writer side (one thread per line record) ----
+    def _begin(self, i: int):
+        # A writer that died mid-write left seq odd: the first write of this process evens it
+        if self._lines[i]["writer_pid"] != self._pid and self._seq[i] & 1:
+            self._seq[i] += 1
+        self._seq[i] += 1
+
+    def publish(self, collector, rows: list[dict]):
+        """After a poll: machine state and bale in progress of collector's line, plus the rows it stored."""
+        i = self._index.get(collector.line_id)
+        if i is None:
+            return
+        rec = self._lines[i]
+        st, tr = collector.state, collector.tracker
+        self._begin(i)
+        try:
+            if rec["writer_pid"] != self._pid:
+                rec["writer_pid"] = self._pid
+                rec["writer_first"] = rec["samples"]
+            rec["updated_ms"] = int(time.time() * 1000)
+            rec["plc_bale_number"] = st.BaleNumber
+            rec["event_word"] = st.EventWord
+            rec["plc_cycle_ms"] = st.CycleMs
+            rec["ram_forward"] = st.RamGoesForward
+            rec["ram_return"] = st.RamGoesReturn
+            rec["bale_number"] = tr.bale_number
+            rec["bale_start_ms"] = _ms(tr.start_ts)
+            rec["bale_samples"] = tr.samples
+            rec["distance"] = tr.distance
+            rec["ram_distance"] = tr.ram_distance
+            rec["strokes"] = _strokes(tr.strokes)
+            for row in rows:
+                self._put_sample(rec, row)
+        finally:
+            self._seq[i] += 1
+
+    def _put_sample(self, rec, row: dict):
+        n = int(rec["samples"])
+        rec["ring"][n % self.slots] = (
+            row["id"], _ms(row["ts"]), row["line_id"], _NULL if row.get("rec") is None else row["rec"],
+            *(_NULL if row[k] is None else row[k] for k in ("bale_s", "bale_i", "encoder_raw", "q_bale_number")),
+            *(np.nan if row[k] is None else row[k] for k in ("rounds", "distance", "ram_distance", "q_bale_length")),
+            row["data_valid"], row["bale_ready"], row["ram_forward"],
+            _strokes(row["stroke_list"]), _strokes(row["q_stroke_list"]),
+        )
+        rec["samples"] = n + 1
+
+    def publish_bale(self, line_id: int, bale: dict):
+        """A finished bale summary (the collector's add_bale() arguments)."""
+        i = self._index.get(line_id)
+        if i is None:
+            return
+        rec = self._lines[i]
+        self._begin(i)
+        try:
+            rec["last_bale_number"] = bale["bale_number"]
+            rec["last_start_ms"] = _ms(bale["start_ts"])
+            rec["last_end_ms"] = _ms(bale["end_ts"])
+            rec["last_length"] = bale["length"]
+            rec["last_rounds"] = bale["rounds"]
+            rec["last_samples"] = bale["sample_count"]
+            rec["last_strokes"] = _strokes(bale["stroke_list"])
+            rec["bales"] += 1
+        finally:
+            self._seq[i] += 1
+
+    def claim_stats(self):
+        """Become the stats writer; evens the sequence a writer that died mid-write left odd."""
+        if self._stats_seq[()] & 1:
+            self._stats_seq[()] += 1
+
+    def publish_stats(self, stats: dict):
+        """JSON snapshot of the acquisition process' stats (one writer thread)."""
+        data = json.dumps(stats, separators=(",", ":"), default=str).encode()
+        block = self._stats
+        if len(data) > block["data"].size:
+            self.stats_errors += 1
+            if self.stats_errors == 1:
+                log.warning("stats snapshot is %d bytes, SHARED_STATS_KB holds %d: not published",
+                            len(data), block["data"].size)
+            return
+        self._stats_seq[()] += 1
+        try:
+            block["data"][:len(data)] = np.frombuffer(data, np.uint8)
+            block["length"] = len(data)
+        finally:
+            self._stats_seq[()] += 1
+
+    # ---- reader side (any thread / process) ----
+    def _read(self, seq, copy):
+        for _ in range(SHARED_READ_RETRIES):
+            before = int(seq[()])
+            if before & 1:
+                time.sleep(0)
+                continue
+            snap = copy()
+            if int(seq[()]) == before:
+                return before, snap
+        raise TimeoutError("live state record kept changing while being read")
+
+    def record(self, line_id: int) -> np.void | None:
+        """Consistent copy of one line's record (None: line not in the block)."""
+        i = self._index.get(line_id)
+        if i is None:
+            return None
+        return self._read(self._seq[i:i + 1].reshape(()), lambda: self._lines[i:i + 1].copy()[0])[1]
+
+    def stats(self) -> dict:
+        """Last published stats snapshot ({} until the first one); parsed once per version."""
+        seq, block = self._read(self._stats_seq, lambda: self._stats.copy())
+        cached_seq, cached = self._stats_cache
+        if seq != cached_seq:
+            length = int(block["length"])
+            cached = json.loads(block["data"][:length].tobytes()) if length else {}
+            self._stats_cache = (seq, cached)
+        return cached
+
+    @staticmethod
+    def sample_row(s) -> dict:
+        """A ring slot as the collector's row dict (what writer.add() / ring.append() take)."""
+        return {
+            "id": int(s["id"]), "ts": _ts(int(s["ts_ms"])), "line_id": int(s["line_id"]), "rec": _int(s["rec"]),
+            "data_valid": bool(s["data_valid"]), "bale_ready": bool(s["bale_ready"]),
+            "ram_forward": bool(s["ram_forward"]),
+            **{k: _int(s[k]) for k in ("bale_s", "bale_i", "encoder_raw", "q_bale_number")},
+            **{k: _float(s[k]) for k in ("rounds", "distance", "ram_distance", "q_bale_length")},
+            "stroke_list": s["stroke"].tolist(), "q_stroke_list": s["q_stroke"].tolist(),
+        }
+
+    def rows(self, rec, after_count: int) -> list[dict]:
+        """Rows of rec stored after the first after_count (at most the last `slots`)."""
+        n = int(rec["samples"])
+        start = max(after_count, n - self.slots, 0)
+        return [self.sample_row(rec["ring"][k % self.slots]) for k in range(start, n)]
+
+    @staticmethod
+    def last_bale(rec) -> dict | None:
+        if not rec["bales"]:
+            return None
+        return {
+            "line_id": int(rec["line_id"]), "bale_number": int(rec["last_bale_number"]),
+            "start_ts": _ts(int(rec["last_start_ms"])), "end_ts": _ts(int(rec["last_end_ms"])),
+            "length": float(rec["last_length"]), "rounds": float(rec["last_rounds"]),
+            "stroke_list": rec["last_strokes"].tolist(), "sample_count": int(rec["last_samples"]),
+        }
+
+    def line_state(self, line_id: int) -> dict | None:
+        """API shape of one line's live state (/api/state)."""
+        rec = self.record(line_id)
+        if rec is None:
+            return None
+        latest = self.rows(rec, int(rec["samples"]) - 1)
+        last = self.last_bale(rec)
+        return {
+            "line_id": line_id,
+            "updated": _ts(int(rec["updated_ms"])).isoformat(timespec="milliseconds") if rec["updated_ms"] else None,
+            "plc": {
+                "bale_number": int(rec["plc_bale_number"]),
+                "event_word": int(rec["event_word"]),
+                "ram_forward": bool(rec["ram_forward"]),
+                "ram_return": bool(rec["ram_return"]),
+                "cycle_ms": float(rec["plc_cycle_ms"]),
+            },
+            "bale": {
+                "bale_number": int(rec["bale_number"]),
+                "start_ts": _ts(int(rec["bale_start_ms"])).isoformat(timespec="seconds")
+                if rec["bale_start_ms"] else None,
+                "samples": int(rec["bale_samples"]),
+                "distance": float(rec["distance"]),
+                "ram_distance": float(rec["ram_distance"]),
+                "strokes": rec["strokes"].tolist(),
+            },
+            "last_bale": bale_payload(last) if last is not None else None,
+            "latest": sample_payload(latest[0]) if latest else None,
+        }
+
+
+class Relay:
+    """
+    Web process in supervised mode: copies new samples and bale events from
+    the block into this process' ring and live hub, so /api/samples and
+    /api/stream serve them as if the collector ran here.
+    """
+
+    def __init__(self, state: LiveState, interval_sec: float = SHARED_RELAY_SEC):
+        self.state = state
+        self.interval_sec = interval_sec
+        self._samples = {}          # line_id -> samples count seen
+        self._writers = {}          # line_id -> pid of the acquisition process
+        self._bales = {}            # line_id -> bales count seen
+        self.relayed = 0
+        self.missed = 0             # samples overwritten in the block before they were read
+
+    def poll(self) -> int:
+        rows = []
+        for line_id in self.state.line_ids:
+            rec = self.state.record(line_id)
+            n, bales = int(rec["samples"]), int(rec["bales"])
+            seen = self._samples.get(line_id)
+            writer = int(rec["writer_pid"])
+            if seen is not None and self._writers[line_id] not in (0, writer):
+                # Acquisition restarted: ids of rows it had not flushed are handed out again
+                log.info("relay: acquisition process changed (pid %d), clearing the ring", writer)
+                ring.clear()
+                hub.restart()
+                seen = max(seen, int(rec["writer_first"]))
+            self._writers[line_id] = writer
+            if seen is None:
+                # (Re)start: take what the block still holds, not the bale finished before
+                seen = max(0, n - self.state.slots)
+                self._bales[line_id] = bales
+            if n - seen > self.state.slots:
+                self.missed += n - seen - self.state.slots
+                log.warning("relay: %d samples of line %d were overwritten before they were read",
+                            n - seen - self.state.slots, line_id)
+            rows += self.state.rows(rec, seen)
+            self._samples[line_id] = n
+            if bales > self._bales[line_id]:
+                self._bales[line_id] = bales
+                hub.publish("bale", bale_payload(LiveState.last_bale(rec)))
+        rows.sort(key=lambda r: r["id"])
+        for row in rows:
+            ring.append(row)
+            hub.publish("sample", sample_payload(row))
+        self.relayed += len(rows)
+        return len(rows)
+
+    async def run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                log.exception("relay error: %s", e)
+            await asyncio.sleep(self.interval_sec)
+
+    def stats(self) -> dict:
+        return {"relayed": self.relayed, "missed": self.missed, "interval_sec": self.interval_sec}
+
+
+# ---- Process-wide block ----
+role = None          # None (single process) | "acquisition" | "web" (supervised children)
+_state = None
+_shm = None
+_state_lock = threading.Lock()
+
+
+def attach(name: str, as_role: str):
+    """Supervised child: use the supervisor's block instead of a private one."""
+    global role, _state, _shm
+    with _state_lock:
+        _shm = shared_memory.SharedMemory(name=name)
+        _state = LiveState(_shm.buf)
+        role = as_role
+        if as_role == "acquisition":
+            _state.claim_stats()
+
+
+def state() -> LiveState:
+    """The block of this process (a private one for lines.configured() unless attach()ed)."""
+    global _state
+    import lines  # lines -> collector -> this module
+    with _state_lock:
+        if _state is None:
+            ids = [line.id for line in lines.configured()]
+            _state = LiveState(bytearray(size(len(ids))), ids)
+        return _state
@@ -0,0 +1,556 @@
+import os
+import sys
+import json
+import time
+import random
+import signal
+import asyncio
+import sqlite3
+import tempfile
+import threading
+import subprocess
+import urllib.request
+
+import numpy as np
+from pymodbus.constants import ExcCodes
+from pymodbus.datastore import ModbusDeviceContext, ModbusServerContext, ModbusSequentialDataBlock
+from pymodbus.server import ModbusTcpServer
+
+import Modbus_TCPV3
+from collector import PDIN_BASE_ADDR, WORD_COUNT
+from kinematics import ENCODER_COUNTS_PER_ROUND
+from metrics import log
+
+# ---- Config ----
+SIM_HOST = os.getenv("SIM_HOST", "127.0.0.1")
+SIM_ENCODER_PORT = int(os.getenv("SIM_ENCODER_PORT", "5020"))   # line n listens on port + 2*(n-1)
+SIM_PLC_PORT = int(os.getenv("SIM_PLC_PORT", "5021"))
+SIM_PROFILE = os.getenv("SIM_PROFILE", "baler")
+
+# Fault injection (rates are per read request, 0..1)
+SIM_LATENCY_MS = float(os.getenv("SIM_LATENCY_MS", "0"))          # added to every response
+SIM_JITTER_MS = float(os.getenv("SIM_JITTER_MS", "0"))            # + uniform 0..jitter
+SIM_TIMEOUT_RATE = float(os.getenv("SIM_TIMEOUT_RATE", "0"))      # answer only after SIM_TIMEOUT_SEC
+SIM_TIMEOUT_SEC = float(os.getenv("SIM_TIMEOUT_SEC", "5"))        # longer than the clients' timeout
+SIM_ERROR_RATE = float(os.getenv("SIM_ERROR_RATE", "0"))          # Modbus exception response (device busy)
+SIM_DISCONNECT_RATE = float(os.getenv("SIM_DISCONNECT_RATE", "0"))  # drop the device's TCP connections
+SIM_INVALID_RATE = float(os.getenv("SIM_INVALID_RATE", "0"))      # encoder data-valid word 0
+SIM_SEED = os.getenv("SIM_SEED")
+
+# Encoder process data as the collector reads it (words[1], words[2])
+ENC_WORD_VALID = 1
+ENC_WORD_COUNT = 2
+ENCODER_MODULUS = int(ENCODER_COUNTS_PER_ROUND) + 1  # raw count runs 0 .. ENCODER_COUNTS_PER_ROUND
+
+# PLC %MW70 bits (see MachineState.update_from_modbus)
+EVENT_RAM_FORWARD = 1 << 0
+EVENT_RAM_RETURN = 1 << 1
+
+
+# ---- Motion profiles ----
+class Profile:
+    """Machine motion as a function of seconds since start: at(t) -> (wheel position in counts, %MW70, bale number)."""
+
+    name = ""
+
+    def at(self, t: float) -> tuple[float, int, int]:
+        raise NotImplementedError
+
+
+class BalerProfile(Profile):
+    """
+    The real cycle: the ram pushes the bale forward for stroke_sec (the wheel
+    turns counts_per_stroke), returns for return_sec, and after
+    strokes_per_bale strokes the bale is tied off (bale_gap_sec) and the PLC
+    bale number goes up.
+    """
+
+    name = "baler"
+
+    def __init__(self, stroke_sec: float = 4.0, return_sec: float = 3.0, counts_per_stroke: float = 18000,
+                 strokes_per_bale: int = 5, bale_gap_sec: float = 2.0, start_bale: int = 1):
+        self.stroke_sec = stroke_sec
+        self.return_sec = return_sec
+        self.counts_per_stroke = counts_per_stroke
+        self.strokes_per_bale = int(strokes_per_bale)
+        self.bale_gap_sec = bale_gap_sec
+        self.start_bale = int(start_bale)
+
+    def at(self, t):
+        cycle = self.stroke_sec + self.return_sec
+        n, tb = divmod(t, self.strokes_per_bale * cycle + self.bale_gap_sec)
+        k, ph = divmod(tb, cycle)
+        k = int(k)
+        pos = (n * self.strokes_per_bale + min(k, self.strokes_per_bale)) * self.counts_per_stroke
+        event = 0
+        if k < self.strokes_per_bale:
+            if ph < self.stroke_sec:
+                pos += self.counts_per_stroke * ph / self.stroke_sec
+                event = EVENT_RAM_FORWARD
+            else:
+                pos += self.counts_per_stroke
+                event = EVENT_RAM_RETURN
+        return pos, event, self.start_bale + int(n)
+
+
+class ConstantProfile(Profile):
+    """The wheel turns at rpm (ram forward the whole time); a new bale every bale_sec."""
+
+    name = "constant"
+
+    def __init__(self, rpm: float = 20.0, bale_sec: float = 60.0, start_bale: int = 1):
+        self.rpm = rpm
+        self.bale_sec = bale_sec
+        self.start_bale = int(start_bale)
+
+    def at(self, t):
+        return self.rpm / 60.0 * ENCODER_MODULUS * t, EVENT_RAM_FORWARD, self.start_bale + int(t // self.bale_sec)
+
+
+class ReverseProfile(ConstantProfile):
+    """The wheel runs backwards (backward turn-overs)."""
+
+    name = "reverse"
+
+    def __init__(self, rpm: float = -20.0, bale_sec: float = 60.0, start_bale: int = 1):
+        super().__init__(rpm, bale_sec, start_bale)
+
+
+class IdleProfile(Profile):
+    """Machine standing still: nothing changes (deadband recording, keepalives)."""
+
+    name = "idle"
+
+    def __init__(self, position: float = 0, start_bale: int = 1):
+        self.position = position
+        self.start_bale = int(start_bale)
+
+    def at(self, t):
+        return self.position, 0, self.start_bale
+
+
+PROFILES = {p.name: p for p in (BalerProfile, ConstantProfile, ReverseProfile, IdleProfile)}
+
+
+def make_profile(name: str = SIM_PROFILE, **params) -> Profile:
+    if name not in PROFILES:
+        raise ValueError(f"unknown profile {name!r} (choose from {', '.join(PROFILES)})")
+    return PROFILES[name](**params)
+
+
+# ---- Fault injection ----
+class Faults:
+    """What goes wrong, and how often. Shared by all devices of a simulator."""
+    __slots__ = ("latency_ms", "jitter_ms", "timeout_rate", "timeout_sec", "error_rate",
+                 "disconnect_rate", "invalid_rate", "rng")
+
+    def __init__(
+        self,
+        latency_ms: float = SIM_LATENCY_MS,
+        jitter_ms: float = SIM_JITTER_MS,
+        timeout_rate: float = SIM_TIMEOUT_RATE,
+        timeout_sec: float = SIM_TIMEOUT_SEC,
+        error_rate: float = SIM_ERROR_RATE,
+        disconnect_rate: float = SIM_DISCONNECT_RATE,
+        invalid_rate: float = SIM_INVALID_RATE,
+        seed: int | None = int(SIM_SEED) if SIM_SEED else None,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.timeout_rate = timeout_rate
+        self.timeout_sec = timeout_sec
+        self.error_rate = error_rate
+        self.disconnect_rate = disconnect_rate
+        self.invalid_rate = invalid_rate
+        self.rng = random.Random(seed)
+
+    def delay(self) -> float:
+        ms = self.latency_ms + (self.rng.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0)
+        return ms / 1000.0
+
+    def roll(self) -> str | None:
+        """At most one fault per request: "disconnect" | "timeout" | "error" | "invalid" | None."""
+        r = self.rng.random()
+        for name, rate in (("disconnect", self.disconnect_rate), ("timeout", self.timeout_rate),
+                           ("error", self.error_rate), ("invalid", self.invalid_rate)):
+            if r < rate:
+                return name
+            r -= rate
+        return None
+
+    def public(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__ if name != "rng"}
+
+
+class SimDevice(ModbusDeviceContext):
+    """Register store of one simulated device. Registers are refreshed from the profile at read time."""
+
+    def __init__(self, name: str, faults: Faults, refresh, **blocks):
+        super().__init__(**blocks)
+        self.name = name
+        self.faults = faults
+        self.refresh = refresh
+        self.server = None
+        self.stats = dict.fromkeys(("requests", "timeouts", "errors", "disconnects", "invalid"), 0)
+
+    async def async_getValues(self, func_code, address, count=1):
+        self.stats["requests"] += 1
+        f = self.faults
+        delay = f.delay()
+        if delay:
+            await asyncio.sleep(delay)
+        fault = f.roll()
+        if fault == "disconnect":
+            self.stats["disconnects"] += 1
+            if self.server is not None:
+                for conn in list(self.server.active_connections.values()):
+                    conn.close()
+            return ExcCodes.DEVICE_FAILURE
+        if fault == "timeout":
+            self.stats["timeouts"] += 1
+            await asyncio.sleep(f.timeout_sec)
+        elif fault == "error":
+            self.stats["errors"] += 1
+            return ExcCodes.DEVICE_BUSY
+
+        self.refresh()
+        values = self.getValues(func_code, address, count)
+        if fault == "invalid" and func_code == 4 and address <= ENC_WORD_VALID < address + count:
+            self.stats["invalid"] += 1
+            values = list(values)
+            values[ENC_WORD_VALID - address] = 0
+        return values
+
+
+# ---- Simulator ----
+class Simulator:
+    """One line: an encoder (input registers 0..15) and a PLC (%MW holding registers) driven by a profile."""
+
+    def __init__(self, profile: Profile, faults: Faults | None = None, host: str = SIM_HOST,
+                 encoder_port: int = SIM_ENCODER_PORT, plc_port: int = SIM_PLC_PORT):
+        self.profile = profile
+        self.faults = faults or Faults()
+        self.host = host
+        self.encoder_port = encoder_port
+        self.plc_port = plc_port
+        self.t0 = time.monotonic()
+
+        # getValues/setValues address the blocks at address + 1
+        self.encoder = SimDevice("encoder", self.faults, self._refresh,
+                                 ir=ModbusSequentialDataBlock(0, [0] * (PDIN_BASE_ADDR + WORD_COUNT + 1)))
+        top = max(Modbus_TCPV3.PLC_TAGS.values())
+        self.plc = SimDevice("plc", self.faults, self._refresh,
+                             hr=ModbusSequentialDataBlock(0, [0] * (top + Modbus_TCPV3.MAX_BLOCK_WORDS + 1)))
+        self._servers = []
+
+    def _refresh(self):
+        pos, event, bale = self.profile.at(time.monotonic() - self.t0)
+        self.encoder.setValues(4, PDIN_BASE_ADDR + ENC_WORD_VALID, [1, int(pos) % ENCODER_MODULUS])
+        self.plc.setValues(3, Modbus_TCPV3.MW_EVENT_WORD, [event])
+        self.plc.setValues(3, Modbus_TCPV3.MW_BALE_NUMBER, [bale & 0xFFFF])
+
+    async def start(self):
+        self.t0 = time.monotonic()
+        self._refresh()
+        for device, port in ((self.encoder, self.encoder_port), (self.plc, self.plc_port)):
+            server = ModbusTcpServer(ModbusServerContext(devices=device, single=True), address=(self.host, port))
+            device.server = server
+            await server.serve_forever(background=True)
+            self._servers.append(server)
+        log.info("simulator %s: encoder %s:%d, plc %s:%d", self.profile.name,
+                 self.host, self.encoder_port, self.host, self.plc_port)
+
+    async def stop(self):
+        for server in self._servers:
+            await server.shutdown()
+        self._servers.clear()
+
+    def stats(self) -> dict:
+        return {
+            "profile": self.profile.name,
+            "encoder": f"{self.host}:{self.encoder_port}",
+            "plc": f"{self.host}:{self.plc_port}",
+            "uptime_sec": round(time.monotonic() - self.t0, 1),
+            "encoder_reads": dict(self.encoder.stats),
+            "plc_reads": dict(self.plc.stats),
+        }
+
+
+def simulators(lines: int = 1, profile: str = SIM_PROFILE, params: dict | None = None, faults: Faults | None = None,
+               host: str = SIM_HOST, encoder_port: int = SIM_ENCODER_PORT, plc_port: int = SIM_PLC_PORT) -> list[Simulator]:
+    """One simulator per line; line n uses the base ports + 2*(n-1). Bale numbers differ per line."""
+    faults = faults or Faults()
+    sims = []
+    for i in range(lines):
+        p = dict(params or {})
+        p.setdefault("start_bale", 1 + 1000 * i)
+        sims.append(Simulator(make_profile(profile, **p), faults, host, encoder_port + 2 * i, plc_port + 2 * i))
+    return sims
+
+
+async def serve(sims: list[Simulator], stop: asyncio.Event | None = None):
+    """Run the simulators until stop is set (or forever)."""
+    for sim in sims:
+        await sim.start()
+    try:
+        await (stop or asyncio.Event()).wait()
+    finally:
+        for sim in sims:
+            await sim.stop()
+
+
+class SimulatorThread:
+    """The simulators on their own event loop, for use next to blocking code (the soak runner)."""
+
+    def __init__(self, sims: list[Simulator]):
+        self.sims = sims
+        self._loop = None
+        self._stop = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="simulator", daemon=True)
+
+    def _run(self):
+        async def main():
+            self._loop = asyncio.get_running_loop()
+            self._stop = asyncio.Event()
+            for sim in self.sims:
+                await sim.start()
+            self._ready.set()
+            try:
+                await self._stop.wait()
+            finally:
+                for sim in self.sims:
+                    await sim.stop()
+        asyncio.run(main())
+
+    def start(self):
+        self._thread.start()
+        if not self._ready.wait(10):
+            raise RuntimeError("simulator did not start")
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+        self._thread.join(timeout=10)
+
+
+# ---- Soak / benchmark runner ----
+def _db_bytes(path: str) -> int:
+    """Pages in use, including commits still in the WAL (file sizes jump with checkpoints)."""
+    if not os.path.exists(path):
+        return 0
+    con = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        pages = con.execute("PRAGMA page_count").fetchone()[0] - con.execute("PRAGMA freelist_count").fetchone()[0]
+        return pages * con.execute("PRAGMA page_size").fetchone()[0]
+    finally:
+        con.close()
+
+
+def _scrape(url: str) -> dict:
+    """Totals of a few /metrics series (summed over labels)."""
+    wanted = ("modbus_read_errors_total", "modbus_reconnects_total", "loop_overruns_total",
+              "modbus_read_seconds_sum", "modbus_read_seconds_count")
+    totals = dict.fromkeys(wanted, 0.0)
+    with urllib.request.urlopen(url, timeout=5) as resp:
+        for line in resp.read().decode().splitlines():
+            if line.startswith("#"):
+                continue
+            name = line.split("{", 1)[0].split(" ", 1)[0]
+            if name in totals:
+                totals[name] += float(line.rsplit(" ", 1)[1])
+    count = totals.pop("modbus_read_seconds_count")
+    total = totals.pop("modbus_read_seconds_sum")
+    totals["modbus_read_mean_ms"] = round(total / count * 1000, 2) if count else None
+    return totals
+
+
+def _line_report(con: sqlite3.Connection, line: int, lo_ms: int, hi_ms: int, period: float) -> dict:
+    ts = np.fromiter(
+        (r[0] for r in con.execute(
+            "SELECT ts_ms FROM samples WHERE line_id = ? AND ts_ms >= ? AND ts_ms < ? ORDER BY id", (line, lo_ms, hi_ms))),
+        dtype=np.int64,
+    )
+    if len(ts) < 2:
+        return {"line": line, "samples": len(ts), "hz": 0.0}
+    dt = np.diff(ts).astype(np.float64)
+    period_ms = period * 1000.0
+    return {
+        "line": line,
+        "samples": len(ts),
+        "hz": round((len(ts) - 1) / ((ts[-1] - ts[0]) / 1000.0), 2),
+        "interval_ms": {q: round(float(np.percentile(dt, p)), 1) for q, p in (("p50", 50), ("p95", 95), ("p99", 99))}
+                       | {"max": float(dt.max())},
+        "jitter_ms": round(float(dt.std()), 2),
+        "gaps": int((dt > 2 * period_ms).sum()),
+    }
+
+
+def soak(
+    duration: float = 60.0,
+    warmup: float = 5.0,
+    poll_interval: float = 0.1,
+    lines: int = 1,
+    mode: str = "async",
+    profile: str = SIM_PROFILE,
+    params: dict | None = None,
+    faults: Faults | None = None,
+    db_path: str | None = None,
+    http_port: int = 8190,
+    report_sec: float = 10.0,
+) -> dict:
+    """
+    Run the collector (a child process, ACQ_MODE=mode) against the simulator
+    for warmup + duration seconds and report achieved rate, sample interval
+    jitter and database growth over the measured window.
+    """
+    workdir = tempfile.mkdtemp(prefix="encoder-soak-")
+    db_path = db_path or os.path.join(workdir, "soak.db")
+    sims = simulators(lines, profile, params, faults)
+    env = dict(
+        os.environ,
+        DB_PATH=db_path,
+        ACQ_MODE=mode,
+        POLL_INTERVAL=str(poll_interval),
+        PLC_POLL_SEC=str(poll_interval),
+        RECORD_MODE="all",
+        HEARTBEAT_FILE=os.path.join(workdir, "heartbeat"),
+        LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"),
+        ENCODER_IP=sims[0].host,
+        ENCODER_PORT=str(sims[0].encoder_port),
+        PLC_IP=sims[0].host,
+        PLC_PORT=str(sims[0].plc_port),
+        LINES_CONFIG="",
+    )
+    if lines > 1:
+        env["LINES_CONFIG"] = os.path.join(workdir, "lines.json")
+        with open(env["LINES_CONFIG"], "w", encoding="utf-8") as f:
+            json.dump({"lines": [
+                {"id": i + 1, "name": f"sim {i + 1}",
+                 "encoder": {"ip": s.host, "port": s.encoder_port, "poll_interval": poll_interval},
+                 "plc": {"ip": s.host, "port": s.plc_port, "poll_sec": poll_interval}}
+                for i, s in enumerate(sims)
+            ]}, f)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    if mode == "async":
+        cmd = [sys.executable, "-m", "uvicorn", "webapp:app", "--app-dir", here,
+               "--host", "127.0.0.1", "--port", str(http_port), "--log-level", "warning"]
+    else:
+        cmd = [sys.executable, os.path.join(here, "TestEncoderJanssenV3.py")]
+
+    sim = SimulatorThread(sims)
+    sim.start()
+    proc = subprocess.Popen(cmd, env=env, cwd=here)
+    try:
+        time.sleep(warmup)
+        lo_ms, bytes_lo = int(time.time() * 1000), _db_bytes(db_path)
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            time.sleep(min(report_sec, max(end - time.monotonic(), 0)))
+            if proc.poll() is not None:
+                raise RuntimeError(f"collector exited with {proc.returncode}")
+            log.warning("soak: %.0f s left, db %.1f MB", max(end - time.monotonic(), 0), _db_bytes(db_path) / 1e6)
+        hi_ms, bytes_hi = int(time.time() * 1000), _db_bytes(db_path)
+        app = _scrape(f"http://127.0.0.1:{http_port}/metrics") if mode == "async" else None
+    finally:
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        sim.stop()
+
+    window = (hi_ms - lo_ms) / 1000.0
+    con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        per_line = [_line_report(con, i + 1, lo_ms, hi_ms, poll_interval) for i in range(lines)]
+        rows = con.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+    finally:
+        con.close()
+    stored = sum(r["samples"] for r in per_line)
+    growth = bytes_hi - bytes_lo
+    return {
+        "mode": mode,
+        "lines": lines,
+        "target_hz": round(1.0 / poll_interval, 2),
+        "window_sec": round(window, 1),
+        "per_line": per_line,
+        "db": {
+            "path": db_path,
+            "rows": rows,
+            "bytes": _db_bytes(db_path),
+            "growth_bytes": growth,
+            "bytes_per_sample": round(growth / stored, 1) if stored else None,
+            "mb_per_day": round(growth / window * 86400 / 1e6, 1) if window > 0 else None,
+        },
+        "app": app,
+        "simulator": [s.stats() for s in sims],
+        "faults": sims[0].faults.public(),
+    }
+
+
+def _params(items: list[str]) -> dict:
+    params = {}
+    for item in items or ():
+        key, sep, value = item.partition("=")
+        if not sep:
+            raise SystemExit(f"--param expects key=value, got {item!r}")
+        params[key] = json.loads(value)
+    return params
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Modbus encoder + PLC simulator and soak runner")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    def common(p):
+        p.add_argument("--profile", default=SIM_PROFILE, choices=tuple(PROFILES))
+        p.add_argument("--param", action="append", metavar="KEY=VALUE", help="profile parameter, e.g. stroke_sec=2")
+        p.add_argument("--lines", type=int, default=1)
+        p.add_argument("--latency-ms", type=float, default=SIM_LATENCY_MS)
+        p.add_argument("--jitter-ms", type=float, default=SIM_JITTER_MS)
+        p.add_argument("--timeout-rate", type=float, default=SIM_TIMEOUT_RATE)
+        p.add_argument("--error-rate", type=float, default=SIM_ERROR_RATE)
+        p.add_argument("--disconnect-rate", type=float, default=SIM_DISCONNECT_RATE)
+        p.add_argument("--invalid-rate", type=float, default=SIM_INVALID_RATE)
+        p.add_argument("--seed", type=int, default=int(SIM_SEED) if SIM_SEED else None)
+
+    serve_p = sub.add_parser("serve", help="serve simulated devices until Ctrl+C")
+    common(serve_p)
+    serve_p.add_argument("--host", default=SIM_HOST)
+    serve_p.add_argument("--encoder-port", type=int, default=SIM_ENCODER_PORT)
+    serve_p.add_argument("--plc-port", type=int, default=SIM_PLC_PORT)
+
+    soak_p = sub.add_parser("soak", help="run the collector against the simulator and report rate, jitter, DB growth")
+    common(soak_p)
+    soak_p.add_argument("--duration", type=float, default=60.0, help="measured seconds (after --warmup)")
+    soak_p.add_argument("--warmup", type=float, default=5.0)
+    soak_p.add_argument("--poll-interval", type=float, default=0.1, help="encoder and PLC poll interval (s)")
+    soak_p.add_argument("--mode", choices=("async", "threads"), default="async")
+    soak_p.add_argument("--db", help="database path (default: a new temporary file)")
+    soak_p.add_argument("--http-port", type=int, default=8190, help="webapp port in async mode (/metrics)")
+    args = parser.parse_args()
+
+    faults = Faults(args.latency_ms, args.jitter_ms, args.timeout_rate, SIM_TIMEOUT_SEC, args.error_rate,
+                    args.disconnect_rate, args.invalid_rate, args.seed)
+    params = _params(args.param)
+    try:
+        make_profile(args.profile, **params)
+    except (TypeError, ValueError) as e:
+        raise SystemExit(f"bad profile parameters: {e}")
+
+    if args.cmd == "serve":
+        log.setLevel("INFO")
+        sims = simulators(args.lines, args.profile, params, faults, args.host, args.encoder_port, args.plc_port)
+        try:
+            asyncio.run(serve(sims))
+        except KeyboardInterrupt:
+            pass
+        print(json.dumps([s.stats() for s in sims], indent=2))
+    else:
+        result = soak(args.duration, args.warmup, args.poll_interval, args.lines, args.mode,
+                      args.profile, params, faults, args.db, args.http_port)
+        print(json.dumps(result, indent=2))
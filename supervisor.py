@@ -0,0 +1,259 @@
+import os
+import sys
+import time
+import signal
+import asyncio
+import threading
+import urllib.error
+import urllib.request
+import multiprocessing
+from collections import deque
+
+import sharedlayout
+from metrics import log
+
+# ---- Supervisor configuration (run_all RUN_MODE=supervised) ----
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("WEB_PORT", "8000"))
+HEARTBEAT_FILE = os.getenv("HEARTBEAT_FILE", "/tmp/collector_heartbeat.txt")
+WATCHDOG_STALE_SEC = float(os.getenv("WATCHDOG_STALE_SEC", "20"))                   # acquisition heartbeat
+SUPERVISOR_CHECK_SEC = float(os.getenv("SUPERVISOR_CHECK_SEC", "2"))
+SUPERVISOR_RESTART_FIRST_SEC = float(os.getenv("SUPERVISOR_RESTART_FIRST_SEC", "1"))  # doubles per recent restart
+SUPERVISOR_RESTART_MAX_SEC = float(os.getenv("SUPERVISOR_RESTART_MAX_SEC", "30"))
+SUPERVISOR_MAX_RESTARTS = int(os.getenv("SUPERVISOR_MAX_RESTARTS", "10"))            # per child and window, then exit
+SUPERVISOR_RESTART_WINDOW_SEC = float(os.getenv("SUPERVISOR_RESTART_WINDOW_SEC", "600"))
+SUPERVISOR_STOP_SEC = float(os.getenv("SUPERVISOR_STOP_SEC", "10"))                  # SIGTERM grace before SIGKILL
+WEB_PROBE_TIMEOUT_SEC = float(os.getenv("WEB_PROBE_TIMEOUT_SEC", "3"))
+WEB_PROBE_FAILURES = int(os.getenv("WEB_PROBE_FAILURES", "3"))                      # unanswered /health in a row
+WEB_START_GRACE_SEC = float(os.getenv("WEB_START_GRACE_SEC", "15"))
+STATS_PUBLISH_SEC = float(os.getenv("STATS_PUBLISH_SEC", "1.0"))                    # acquisition stats -> web
+
+
+# ---- Acquisition child ----
+class StatsPublisher:
+    """
+    Copies this process' stats (metrics, devices, timing, PLC pollers,
+    writer, maintenance) into the live state block, for the web process.
+    """
+
+    def __init__(self, state: "sharedstate.LiveState", interval_sec: float = STATS_PUBLISH_SEC):
+        self.state = state
+        self.interval_sec = interval_sec
+        self._stop = threading.Event()
+
+    def snapshot(self) -> dict:
+        import db
+        import metrics
+        import scheduler
+        import connection
+        import acquisition
+        import Modbus_TCPV3
+        from maintenance import maintenance
+        return {
+            "pid": os.getpid(),
+            "metrics": metrics.registry.render(),
+            "devices": connection.device_stats(),
+            "timing": scheduler.timing_stats(),
+            "acquisition": {"mode": acquisition.ACQ_MODE, **acquisition.engine.stats()},
+            "plc": [p.stats() for _, p in sorted(Modbus_TCPV3.POLLERS.items())],
+            "writer": db.writer_stats(),
+            "maintenance": maintenance.stats(),
+        }
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_sec):
+            try:
+                self.state.publish_stats(self.snapshot())
+            except Exception as e:
+                log.warning("stats publish failed: %s", e)
+
+    def start(self):
+        threading.Thread(target=self._loop, name="stats-publisher", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+
+async def _run_engine() -> bool:
+    import acquisition
+    stopping = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopping.set)
+    acquisition.engine.start()
+    while not stopping.is_set() and acquisition.engine.is_running():
+        try:
+            await asyncio.wait_for(stopping.wait(), 1.0)
+        except asyncio.TimeoutError:
+            pass
+    await acquisition.engine.stop()
+    return stopping.is_set()
+
+
+def acquisition_main(shm_name: str):
+    """Child: the collector (thread loops or the asyncio engine) publishing into the block."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C reaches the supervisor, which stops us
+    import sharedstate
+    sharedstate.attach(shm_name, "acquisition")
+    import acquisition
+    publisher = StatsPublisher(sharedstate.state())
+    publisher.start()
+    try:
+        if acquisition.ACQ_MODE == "async":
+            stopped = asyncio.run(_run_engine())
+        else:
+            import TestEncoderJanssenV3
+            signal.signal(signal.SIGTERM, lambda *_: TestEncoderJanssenV3.stop())
+            stopped = TestEncoderJanssenV3.main()
+    finally:
+        publisher.stop()
+    sys.exit(0 if stopped else 1)
+
+
+# ---- Web child ----
+def web_main(shm_name: str, host: str = WEB_HOST, port: int = WEB_PORT):
+    """Child: the web app, reading live state from the block (no acquisition here)."""
+    import sharedstate
+    sharedstate.attach(shm_name, "web")
+    import uvicorn
+    uvicorn.run("webapp:app", host=host, port=port, log_level="info")
+
+
+# ---- Supervisor ----
+class Child:
+    """One supervised process: started, checked and restarted on its own."""
+
+    def __init__(self, name: str, target, args: tuple, ctx):
+        self.name = name
+        self.target = target
+        self.args = args
+        self.ctx = ctx
+        self.process = None
+        self.started = 0.0            # wall clock of the last start
+        self.restart_at = None        # monotonic; set while waiting to restart
+        self.restarts = 0
+        self.last_failure = None
+        self._recent = deque()        # monotonic times of restarts in the window
+
+    def start(self):
+        self.process = self.ctx.Process(target=self.target, args=self.args, name=self.name)
+        self.process.start()
+        self.started = time.time()
+        self.restart_at = None
+        log.info("supervisor: %s started (pid %d)", self.name, self.process.pid)
+
+    def check(self) -> str | None:
+        """Why the child must be restarted, or None while it is fine."""
+        if not self.process.is_alive():
+            return f"exited with code {self.process.exitcode}"
+        return None
+
+    def stop(self, timeout: float = SUPERVISOR_STOP_SEC):
+        p = self.process
+        if p is None:
+            return
+        if p.is_alive():
+            p.terminate()  # SIGTERM: flush and exit
+            p.join(timeout)
+            if p.is_alive():
+                log.warning("supervisor: %s did not stop within %.0f s, killing it", self.name, timeout)
+                p.kill()
+        p.join()
+        p.close()
+        self.process = None
+
+    def failed(self, reason: str, now: float) -> bool:
+        """Stop the child and schedule its restart; False once it restarts too often."""
+        self.last_failure = reason
+        while self._recent and now - self._recent[0] > SUPERVISOR_RESTART_WINDOW_SEC:
+            self._recent.popleft()
+        if len(self._recent) >= SUPERVISOR_MAX_RESTARTS:
+            log.error("supervisor: %s failed (%s) %d times within %.0f s, giving up", self.name, reason,
+                      len(self._recent) + 1, SUPERVISOR_RESTART_WINDOW_SEC)
+            self.stop()
+            return False
+        delay = min(SUPERVISOR_RESTART_MAX_SEC, SUPERVISOR_RESTART_FIRST_SEC * 2 ** len(self._recent))
+        log.error("supervisor: %s %s, restarting it in %.0f s", self.name, reason, delay)
+        self.stop()
+        self._recent.append(now)
+        self.restarts += 1
+        self.restart_at = time.monotonic() + delay
+        return True
+
+
+class AcquisitionChild(Child):
+    def check(self) -> str | None:
+        reason = super().check()
+        if reason is not None:
+            return reason
+        # Stale heartbeat: a loop is stuck (grace after a start: the file is still the old one)
+        try:
+            beat = max(os.path.getmtime(HEARTBEAT_FILE), self.started)
+        except FileNotFoundError:
+            beat = self.started
+        if time.time() - beat > WATCHDOG_STALE_SEC:
+            return f"heartbeat stale for {time.time() - beat:.0f} s"
+        return None
+
+
+class WebChild(Child):
+    def __init__(self, *args, port: int = WEB_PORT, **kw):
+        super().__init__(*args, **kw)
+        self.url = f"http://127.0.0.1:{port}/health"
+        self.unanswered = 0
+
+    def start(self):
+        super().start()
+        self.unanswered = 0
+
+    def check(self) -> str | None:
+        reason = super().check()
+        if reason is not None or time.time() - self.started < WEB_START_GRACE_SEC:
+            return reason
+        # Any answer counts (a stale collector makes /health say ok=false, not the web app)
+        try:
+            with urllib.request.urlopen(self.url, timeout=WEB_PROBE_TIMEOUT_SEC):
+                pass
+            self.unanswered = 0
+        except urllib.error.HTTPError:
+            self.unanswered = 0
+        except OSError:
+            self.unanswered += 1
+        if self.unanswered >= WEB_PROBE_FAILURES:
+            return f"did not answer {self.unanswered} health probes"
+        return None
+
+
+def main() -> int:
+    """Run acquisition and the web app as two processes sharing one live state block."""
+    # Only the children import numpy and the acquisition stack; this process stays small
+    shm = sharedlayout.create(sharedlayout.configured_line_ids())
+    ctx = multiprocessing.get_context("spawn")
+    children = [
+        AcquisitionChild("acquisition", acquisition_main, (shm.name,), ctx),
+        WebChild("web", web_main, (shm.name, WEB_HOST, WEB_PORT), ctx, port=WEB_PORT),
+    ]
+    stop = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stop.set())
+
+    code = 0
+    try:
+        for child in children:
+            child.start()
+        while not stop.wait(SUPERVISOR_CHECK_SEC):
+            now = time.monotonic()
+            for child in children:
+                if child.process is None:
+                    if now >= child.restart_at:
+                        child.start()
+                    continue
+                reason = child.check()
+                if reason is not None and not child.failed(reason, now):
+                    code = 1  # crash loop: let the container restart policy take over
+                    stop.set()
+    finally:
+        log.info("supervisor: stopping")
+        for child in reversed(children):
+            child.stop()
+        shm.close()
+        shm.unlink()
+    return code
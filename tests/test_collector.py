@@ -0,0 +1,55 @@
+import pytest
+
+from collector import RecordPolicy, REC_MOVED, REC_EVENT, REC_KEEPALIVE, REC_HOLD_END, EVENT_FIELDS
+
+
+def sample(raw, **fields):
+    s = {k: 0 for k in EVENT_FIELDS}
+    s["stroke_list"] = s["q_stroke_list"] = [0.0] * 10
+    s.update(fields, encoder_raw=raw)
+    return s
+
+
+def deadband(**kw):
+    return RecordPolicy(mode="deadband", deadband=20, keepalive_sec=10, one_round_raw=35999, **kw)
+
+
+def test_all_stores_every_poll():
+    policy = RecordPolicy(mode="all")
+    assert policy.filter(sample(1), 0.0) == [sample(1)]
+    assert policy.filter(sample(1), 0.1) == [sample(1)]
+    assert (policy.polled, policy.stored) == (2, 2)
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        RecordPolicy(mode="changes")
+
+
+def test_deadband_holds_and_ends_hold():
+    policy = deadband()
+    assert [r["rec"] for r in policy.filter(sample(100), 0.0)] == [REC_EVENT]
+    assert policy.filter(sample(110), 0.1) == []
+    assert policy.filter(sample(115), 0.2) == []
+    assert policy.held["encoder_raw"] == 115
+
+    out = policy.filter(sample(200), 0.3)
+    assert [(r["encoder_raw"], r["rec"]) for r in out] == [(115, REC_HOLD_END), (200, REC_MOVED)]
+    assert policy.held is None
+    assert (policy.polled, policy.stored) == (4, 3)
+
+
+def test_deadband_event_and_keepalive():
+    policy = deadband()
+    policy.filter(sample(100), 0.0)
+    assert [r["rec"] for r in policy.filter(sample(100, bale_i=2), 0.1)] == [REC_EVENT]
+    assert policy.filter(sample(100, bale_i=2), 5.0) == []
+    # A keepalive alone does not store the held sample before it
+    assert [r["rec"] for r in policy.filter(sample(100, bale_i=2), 10.1)] == [REC_KEEPALIVE]
+
+
+def test_deadband_is_wrap_aware():
+    policy = deadband()
+    policy.filter(sample(35990), 0.0)
+    assert policy.filter(sample(5), 0.1) == []               # 15 counts across the wrap
+    assert policy.filter(sample(35900), 0.2)[-1]["rec"] == REC_MOVED
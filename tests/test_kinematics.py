@@ -0,0 +1,62 @@
+import numpy as np
+
+import replay
+from kinematics import EncoderTracker
+
+
+def scalar_counters(raws, resets, tracker=None):
+    tracker = tracker or EncoderTracker()
+    out = []
+    for raw, reset in zip(raws, resets):
+        if reset:
+            tracker.reset()
+        tracker.update(raw)
+        out.append(tracker.counter)
+    return tracker, out
+
+
+def test_update_batch_matches_update_per_sample():
+    frames = replay.synthetic(20_000)
+    raws = frames["encoder_raw"]
+    resets = np.r_[False, np.diff(frames["bale_i"]) != 0]
+
+    scalar, counters = scalar_counters(raws.tolist(), resets.tolist())
+    batch = EncoderTracker()
+    batch_counters = batch.update_batch(raws, resets)
+
+    assert scalar.forward_wraps > 0
+    assert replay.batch_matches_scalar(scalar, counters, batch, batch_counters)
+    np.testing.assert_array_equal(batch.distances(batch_counters),
+                                  [round(c / batch.counts_per_round * np.pi * batch.diameter, 2) for c in counters])
+
+
+def test_update_batch_wraps_and_resets():
+    # Forward and backward turn-overs, a reset on the first sample and one on a wrap
+    raws = [35000, 35900, 100, 400, 35800, 35500, 200, 150, 35990, 20]
+    resets = [True, False, False, True, False, False, True, False, False, False]
+    scalar, counters = scalar_counters(raws, resets)
+    batch = EncoderTracker()
+    batch_counters = batch.update_batch(raws, resets)
+
+    assert scalar.backward_wraps > 0 and scalar.forward_wraps > 0
+    assert replay.batch_matches_scalar(scalar, counters, batch, batch_counters)
+    assert batch.previous == scalar.previous
+
+
+def test_update_batch_continues_from_tracker_state():
+    raws = list(range(0, 36000, 700)) * 3
+    scalar, counters = scalar_counters(raws, [False] * len(raws))
+
+    batch = EncoderTracker()
+    head = batch.update_batch(raws[:40])
+    tail = batch.update_batch(raws[40:], np.zeros(len(raws) - 40, dtype=bool))
+    assert replay.batch_matches_scalar(scalar, counters, batch, np.r_[head, tail])
+
+
+def test_batch_matches_scalar_sees_intermediate_differences():
+    raws = [0, 1000, 2000, 3000]
+    scalar, counters = scalar_counters(raws, [False] * 4)
+    batch = EncoderTracker()
+    batch_counters = batch.update_batch(raws)
+    batch_counters[1] += 1.0    # same final counter, one sample off
+    assert not replay.batch_matches_scalar(scalar, counters, batch, batch_counters)
@@ -0,0 +1,39 @@
+from Modbus_TCPV3 import plan_reads, MAX_BLOCK_WORDS
+from connection import Backoff
+
+
+def test_plan_reads_coalesces_within_gap():
+    blocks = plan_reads({"c": 105, "a": 100, "b": 101, "d": 200}, max_gap=4, max_words=MAX_BLOCK_WORDS)
+    assert [(b.start, b.count) for b in blocks] == [(100, 6), (200, 1)]
+    assert blocks[0].tags == [("a", 0), ("b", 1), ("c", 5)]
+
+    values = {}
+    for block, registers in zip(blocks, ([1, 2, 0, 0, 0, 3], [4])):
+        block.decode(registers, values)
+    assert values == {"a": 1, "b": 2, "c": 3, "d": 4}
+
+
+def test_plan_reads_splits_at_max_words():
+    blocks = plan_reads({"x": 0, "y": 7, "z": 8}, max_gap=32, max_words=8)
+    assert [(b.start, b.count) for b in blocks] == [(0, 8), (8, 1)]
+
+
+def test_plan_reads_shared_address():
+    blocks = plan_reads({"a": 10, "b": 10}, max_gap=0)
+    assert [(b.start, b.count) for b in blocks] == [(10, 1)]
+    assert sorted(blocks[0].tags) == [("a", 0), ("b", 0)]
+
+
+def test_backoff_doubles_to_cap():
+    backoff = Backoff(first=1.0, cap=8.0, jitter=0.0)
+    assert [backoff.next() for _ in range(6)] == [0.0, 1.0, 2.0, 4.0, 8.0, 8.0]
+    backoff.reset()
+    assert backoff.next() == 0.0
+
+
+def test_backoff_jitter_only_shortens():
+    backoff = Backoff(first=1.0, cap=8.0, jitter=0.5, seed=1)
+    backoff.next()
+    for expected in (1.0, 2.0, 4.0, 8.0, 8.0):
+        assert expected * 0.5 <= backoff.next() <= expected
+    assert Backoff(jitter=0.5, seed=1).next() == 0.0
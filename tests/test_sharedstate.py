@@ -0,0 +1,69 @@
+from datetime import datetime
+
+import pytest
+
+import sharedlayout
+import sharedstate
+from sharedstate import LiveState
+
+
+BALE = {
+    "bale_number": 7, "start_ts": datetime(2024, 5, 1, 8, 0), "end_ts": datetime(2024, 5, 1, 8, 5),
+    "length": 86.4, "rounds": 1.25, "sample_count": 3000, "stroke_list": [28.5, 29.0, 28.9],
+}
+
+
+def test_layout_matches_dtypes():
+    buf = bytearray(sharedstate.size(2))
+    LiveState(buf, [1, 2])
+
+    shm = sharedlayout.create([1, 2])
+    try:
+        created = bytes(shm.buf)
+    finally:
+        shm.close()
+        shm.unlink()
+    assert created == bytes(buf)
+    assert LiveState(bytearray(created)).line_ids == [1, 2]
+
+
+def test_publish_and_read_bale():
+    state = LiveState(bytearray(sharedstate.size(2)), [1, 2])
+    state.publish_bale(2, BALE)
+    assert state.last_bale(state.record(1)) is None
+
+    rec = state.record(2)
+    assert int(rec["seq"]) == 2
+    assert state.last_bale(rec) == {**BALE, "line_id": 2, "stroke_list": [28.5, 29.0, 28.9] + [0.0] * 7}
+    assert state.record(3) is None
+
+
+def test_reader_retries_while_written(monkeypatch):
+    monkeypatch.setattr(sharedstate, "SHARED_READ_RETRIES", 5)
+    state = LiveState(bytearray(sharedstate.size(1)), [1])
+    state._seq[0] += 1                      # a write in progress
+    with pytest.raises(TimeoutError):
+        state.record(1)
+
+
+def test_writer_recovers_dead_writers_sequence():
+    buf = bytearray(sharedstate.size(1))
+    dead = LiveState(buf, [1])
+    dead._lines[0]["writer_pid"] = -1
+    dead._seq[0] += 1                       # died mid-write
+
+    state = LiveState(buf)
+    state.publish_bale(1, BALE)
+    rec = state.record(1)
+    assert int(rec["seq"]) % 2 == 0
+    assert int(rec["last_bale_number"]) == 7
+
+
+def test_stats_roundtrip():
+    state = LiveState(bytearray(sharedstate.size(1, stats_kb=1)), [1], stats_kb=1)
+    assert state.stats() == {}
+    state.claim_stats()
+    state.publish_stats({"polls": 3})
+    assert state.stats() == {"polls": 3}
+    state.publish_stats({"blob": "x" * 2048})   # larger than the block: skipped
+    assert state.stats() == {"polls": 3} and state.stats_errors == 1
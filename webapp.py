@@ -2,32 +2,242 @@ import os
 import json
 import sqlite3
 import time
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
 
-from fastapi import FastAPI, Query
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+
+import db
+import Modbus_TCPV3
+import acquisition
+import connection
+import scheduler
+import live
+import export
+import analytics
+import metrics
+import lines
+import httpcache
+import sharedstate
+from httpcache import samples_cache
+from ringbuffer import ring
+from maintenance import maintenance
 
-DB_PATH = os.getenv("DB_PATH", "/data/encoder.db")
 HEARTBEAT_FILE = os.getenv("HEARTBEAT_FILE", "/tmp/collector_heartbeat.txt")
 HEALTH_STALE_SEC = float(os.getenv("HEALTH_STALE_SEC", "20"))
 
-app = FastAPI()
+# Supervised web process: copies samples / bales from the live state block into the ring and hub
+relay = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global relay
+    task = None
+    if sharedstate.role == "web":
+        # RUN_MODE=supervised: acquisition runs in its own process
+        relay = sharedstate.Relay(sharedstate.state())
+        task = asyncio.get_running_loop().create_task(relay.run(), name="relay")
+    elif acquisition.ACQ_MODE == "async":
+        # ACQ_MODE=async: encoder + PLC acquisition runs on this event loop
+        acquisition.engine.start()
+    yield
+    if task is not None:
+        task.cancel()
+    await acquisition.engine.stop()
+    db.read_pool.close()
+
+app = FastAPI(lifespan=lifespan)
 
-def _connect():
-    con = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
-    con.row_factory = sqlite3.Row
-    return con
+def _parse_time(value: str | None) -> int | None:
+    try:
+        return db.parse_time(value)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _acquisition(key: str, local):
+    # Stats of the acquisition side: this process, or (supervised web process)
+    # the snapshot the acquisition process publishes every STATS_PUBLISH_SEC
+    if sharedstate.role == "web":
+        return sharedstate.state().stats().get(key)
+    return local()
+
+@contextmanager
+def _reader():
+    # Pooled read-only connection; a saturated pool or missing database answers 503
+    try:
+        with db.read_pool.connection() as con:
+            yield con
+    except TimeoutError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except sqlite3.OperationalError as e:
+        raise HTTPException(status_code=503, detail=f"database not available: {e}")
 
 @app.get("/health")
 def health():
     try:
         mtime = os.path.getmtime(HEARTBEAT_FILE)
         age = time.time() - mtime
-        return {"ok": age <= HEALTH_STALE_SEC, "age_sec": round(age, 2)}
+        return {"ok": age <= HEALTH_STALE_SEC, "age_sec": round(age, 2), "writer": _acquisition("writer", db.writer_stats),
+                "read_pool": db.read_pool.stats(), "samples_cache": samples_cache.stats()}
     except FileNotFoundError:
         return {"ok": False, "reason": "no_heartbeat"}
     except Exception as e:
         return {"ok": False, "reason": str(e)}
 
+@app.get("/api/plc")
+def plc(line: int | None = Query(None, description="Line id (default: the first line)")):
+    if sharedstate.role == "web":
+        return _shared_plc(line)
+    pollers = Modbus_TCPV3.POLLERS
+    if line is None:
+        poller = pollers[min(pollers)] if pollers else Modbus_TCPV3.poller
+    elif line in pollers:
+        poller = pollers[line]
+    else:
+        raise HTTPException(status_code=404, detail=f"line {line} is not running")
+    d = poller.stats()
+    d["running"] = d["running"] or acquisition.engine.is_running()
+    return d
+
+def _shared_plc(line: int | None) -> dict:
+    # Poller stats from the acquisition process' snapshot, machine state from the live block
+    pollers = {p["line_id"]: p for p in _acquisition("plc", list) or []}
+    if not pollers:
+        raise HTTPException(status_code=503, detail="acquisition process has not published its state yet")
+    line_id = min(pollers) if line is None else line
+    if line_id not in pollers:
+        raise HTTPException(status_code=404, detail=f"line {line} is not running")
+    d = dict(pollers[line_id])
+    live_plc = sharedstate.state().line_state(line_id)["plc"]
+    d.update(
+        bale_number=live_plc["bale_number"],
+        event_word=live_plc["event_word"],
+        active_events=[name for name, on in (("RamGoesForward", live_plc["ram_forward"]),
+                                             ("RamGoesReturn", live_plc["ram_return"])) if on],
+        cycle_ms=live_plc["cycle_ms"],
+    )
+    return d
+
+@app.get("/api/lines")
+def lines_config():
+    # Configured lines (LINES_CONFIG) with their PLC's current bale number
+    out = []
+    for line in lines.configured():
+        poller = Modbus_TCPV3.POLLERS.get(line.id)
+        if poller is not None:
+            bale_number = poller.state.BaleNumber
+        elif sharedstate.role == "web":
+            bale_number = sharedstate.state().line_state(line.id)["plc"]["bale_number"]
+        else:
+            bale_number = None
+        out.append({**line.public(), "bale_number": bale_number})
+    return out
+
+@app.get("/api/devices")
+def devices():
+    # Modbus sessions of the acquisition side: connected, last / p50..max RTT, reconnects, backoff
+    return _acquisition("devices", connection.device_stats)
+
+@app.get("/api/timing")
+def timing():
+    # Fixed-rate poll loops of the acquisition side: achieved Hz, overruns, p50/p95/p99/max latency
+    return _acquisition("timing", scheduler.timing_stats)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    # Prometheus text format: Modbus latency/errors/reconnects, encoder wraps, DB flushes, bales, overruns
+    text = _acquisition("metrics", metrics.registry.render) or ""
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+@app.get("/api/storage")
+def storage():
+    # Table sizes and bytes per sample (counts every row, so not for tight polling)
+    return db.storage_stats()
+
+@app.get("/api/maintenance")
+def maintenance_stats():
+    return _acquisition("maintenance", maintenance.stats)
+
+@app.get("/api/history")
+def history(
+    res: str = Query("1m", pattern="^(1s|1m)$", description="Rollup resolution"),
+    from_: str | None = Query(None, alias="from", description="Start (epoch ms or ISO)"),
+    to: str | None = Query(None, description="End, exclusive (epoch ms or ISO)"),
+    limit: int = Query(1440, ge=1, le=100000),
+    line: int | None = Query(None, description="Only buckets of this line (line_id)"),
+):
+    # Rolled-up distance/ram activity per line; reaches back past raw sample retention
+    table, key, unit = ("samples_1s", "ts_s", 1000) if res == "1s" else ("samples_1m", "ts_m", 60000)
+    lo, hi = _parse_time(from_), _parse_time(to)
+    where, params = [], []
+    if line is not None:
+        where.append("line_id = ?")
+        params.append(line)
+    if lo is not None:
+        where.append(f"{key} >= ?")
+        params.append(lo // unit)
+    if hi is not None:
+        where.append(f"{key} < ?")
+        params.append(hi // unit)
+    sql = f"SELECT * FROM {table}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {key} DESC, line_id LIMIT ?"
+
+    with _reader() as con:
+        out = []
+        for row in con.execute(sql, (*params, limit)):
+            d = dict(row)
+            d["ts"] = db.ts_iso(d.pop(key) * unit)
+            out.append(d)
+        return JSONResponse(out)
+
+@app.get("/api/acquisition")
+def acquisition_stats():
+    return _acquisition("acquisition", lambda: {"mode": acquisition.ACQ_MODE, **acquisition.engine.stats()})
+
+@app.get("/api/stream")
+async def stream(
+    request: Request,
+    backlog: int = Query(0, ge=0, le=live.LIVE_BUFFER, description="Replay the last N samples first"),
+    last_event_id: str | None = Header(None),
+):
+    # Server-Sent Events: "sample" and "bale" events pushed from the in-process hub
+    hub = live.hub
+    if hub.clients >= live.LIVE_MAX_CLIENTS:
+        raise HTTPException(status_code=503, detail="too many live clients")
+
+    reset = False
+    if last_event_id is not None and last_event_id.isdigit() and int(last_event_id) <= hub.seq:
+        after = int(last_event_id)  # EventSource reconnect: resume where it stopped
+    else:
+        # First connect, or an id from before a restart (numbering started over)
+        reset = last_event_id is not None
+        after = hub.backlog_seq(backlog)
+
+    return StreamingResponse(
+        hub.stream(after, reset=reset, is_disconnected=request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/api/live")
+def live_stats():
+    return {**live.hub.stats(), "ring": ring.stats(), "relay": relay.stats() if relay is not None else None}
+
+@app.get("/api/state")
+def live_state(line: int | None = Query(None, description="Only this line (line_id)")):
+    # Machine state, bale in progress, last bale and last sample per line, from
+    # the live state block (shared with the acquisition process when supervised)
+    block = sharedstate.state()
+    if line is None:
+        return [block.line_state(line_id) for line_id in block.line_ids]
+    d = block.line_state(line)
+    if d is None:
+        raise HTTPException(status_code=404, detail=f"line {line} is not configured")
+    return d
+
 @app.get("/", response_class=HTMLResponse)
 def index():
     return """
@@ -51,15 +261,18 @@ def index():
   <h2>Latest Encoder Samples</h2>
   <div class="row">
     <label>Limit <input id="limit" type="number" value="200" min="1" max="5000"/></label>
+    <label>Line <select id="line" onchange="load()"><option value="">all</option></select></label>
     <label>Bale # <input id="bale" type="number" placeholder="optional"/></label>
     <button onclick="load()">Refresh</button>
     <span class="pill" id="health">health: ...</span>
+    <span class="pill" id="lastbale">last bale: -</span>
     <span id="status"></span>
   </div>
 
   <table>
     <thead>
       <tr>
+        <th>line</th>
         <th>timestamp</th>
         <th>data_valid</th>
         <th>BaleNumber_s</th>
@@ -90,21 +303,15 @@ async function loadHealth() {
   }
 }
 
-async function load() {
-  const limit = document.getElementById("limit").value || 200;
-  const bale = document.getElementById("bale").value;
-  let url = `/api/samples?limit=${limit}`;
-  if (bale !== "") url += `&bale=${bale}`;
-
-  document.getElementById("status").textContent = "loading...";
-  const res = await fetch(url);
-  const rows = await res.json();
+let source = null;
+let pending = [];
+let shown = 0;
+let lastId = 0;
 
-  const tb = document.getElementById("tbody");
-  tb.innerHTML = "";
-  for (const r of rows) {
-    const tr = document.createElement("tr");
-    tr.innerHTML = `
+function sampleRow(r) {
+  const tr = document.createElement("tr");
+  tr.innerHTML = `
+      <td>${r.line_id ?? ""}</td>
       <td>${r.ts}</td>
       <td>${r.data_valid ? "YES" : "NO"}</td>
       <td>${r.bale_s ?? ""}</td>
@@ -120,49 +327,340 @@ async function load() {
       <td>${r.q_bale_length ?? ""}</td>
       <td>${JSON.stringify(r.q_stroke)}</td>
     `;
-    tb.appendChild(tr);
+  return tr;
+}
+
+// New rows are batched per animation frame and prepended (newest first)
+function flushRows() {
+  const limit = Number(document.getElementById("limit").value || 200);
+  const tb = document.getElementById("tbody");
+  const frag = document.createDocumentFragment();
+  for (let i = pending.length - 1; i >= 0; i--) frag.appendChild(sampleRow(pending[i]));
+  tb.insertBefore(frag, tb.firstChild);
+  pending = [];
+  while (tb.rows.length > limit) tb.deleteRow(-1);
+  shown = tb.rows.length;
+  document.getElementById("status").textContent = `${shown} rows (live)`;
+}
+
+function queueRow(r) {
+  if (r.id <= lastId) return;  // already shown (history and live backlog overlap)
+  lastId = r.id;
+  if (pending.length === 0) requestAnimationFrame(flushRows);
+  pending.push(r);
+}
+
+async function loadLines() {
+  try {
+    const res = await fetch("/api/lines");
+    const sel = document.getElementById("line");
+    for (const l of await res.json()) sel.add(new Option(`${l.id}: ${l.name}`, l.id));
+  } catch {}
+}
+
+async function load() {
+  const limit = document.getElementById("limit").value || 200;
+  const bale = document.getElementById("bale").value;
+  const line = document.getElementById("line").value;
+  if (source) source.close();
+  pending = [];
+  lastId = 0;
+  document.getElementById("tbody").innerHTML = "";
+
+  // Unfiltered view comes entirely from the live buffer; a bale/line filter loads its history once
+  let url = `/api/stream?backlog=${limit}`;
+  if (bale !== "" || line !== "") {
+    document.getElementById("status").textContent = "loading...";
+    let q = `/api/samples?limit=${limit}`;
+    if (bale !== "") q += `&bale=${bale}`;
+    if (line !== "") q += `&line=${line}`;
+    // Revalidate with the server (If-None-Match): an unchanged view is a 304
+    // and the browser reuses the rows it already has
+    const res = await fetch(q, {cache: "no-cache"});
+    const rows = await res.json();
+    rows.reverse().forEach(queueRow);
   }
-  document.getElementById("status").textContent = `${rows.length} rows`;
+
+  source = new EventSource(url);
+  source.addEventListener("sample", (e) => {
+    const r = JSON.parse(e.data);
+    if (line !== "" && r.line_id != line) return;
+    if (bale === "" || r.bale_s == bale || r.bale_i == bale) queueRow(r);
+  });
+  source.addEventListener("bale", (e) => {
+    const b = JSON.parse(e.data);
+    if (line !== "" && b.line_id != line) return;
+    document.getElementById("lastbale").textContent = `last bale: line ${b.line_id} #${b.bale_number} length ${b.length}, ${b.stroke_count} strokes`;
+  });
+  // Missed more than the server buffers (or the server restarted): start over
+  source.addEventListener("reset", load);
+  source.onerror = () => {
+    document.getElementById("status").textContent = `${shown} rows (reconnecting...)`;
+  };
 }
 
+loadLines();
 load();
 loadHealth();
-setInterval(load, 2000);
 setInterval(loadHealth, 2000);
 </script>
 </body>
 </html>
 """
 
+STREAM_CHUNK = 500  # rows per fetchmany / response chunk
+
+_encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+def _sample_fields(fields: str | None) -> tuple:
+    try:
+        return db.sample_keys(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _db_samples(keys, limit, bale, before, after, lo, hi, ascending, line=None):
+    # Checks out a connection and runs the query before returning: a saturated
+    # pool or a database error then answers 503 instead of cutting a 200 short
+    chunks = _query_samples(keys, limit, bale, before, after, lo, hi, ascending, line)
+    next(chunks)
+    return chunks
+
+def _query_samples(keys, limit, bale, before, after, lo, hi, ascending, line=None):
+    with _reader() as con:
+        filters = db.sample_filters(con, lo, hi, bale, line)
+        if filters is None:
+            yield
+            return
+        where, params = filters
+        if before is not None:
+            where.append("s.id < ?")
+            params.append(before)
+        if after is not None:
+            where.append("s.id > ?")
+            params.append(after)
+
+        sql = db.sample_select(keys)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY s.id {'ASC' if ascending else 'DESC'} LIMIT ?"
+
+        cur = con.cursor()
+        cur.row_factory = None
+        try:
+            cur.execute(sql, (*params, limit))
+            rows = cur.fetchmany(STREAM_CHUNK)
+            yield  # _db_samples stops here
+            while rows:
+                yield [db.sample_project(row, keys) for row in rows]
+                rows = cur.fetchmany(STREAM_CHUNK)
+        finally:
+            cur.close()  # a client that disconnects mid-stream must not leave a read open
+
+def _stream_samples(keys, limit, bale, before, after, lo, hi, line=None):
+    # Rows still in the collector's in-memory ring (including rows not flushed
+    # yet) come from there; SQLite only covers ids older than the ring. The
+    # query runs here, before the response starts; only its rows are streamed.
+    ascending = after is not None
+    recent, ring_lo = ring.select(limit, bale, before, after, lo, hi, ascending, line)
+    if keys != db.SAMPLE_KEYS:
+        recent = [{k: r[k] for k in keys} for r in recent]
+    db_before = before if ring_lo is None else min(ring_lo, before if before is not None else ring_lo)
+
+    if ascending:
+        stored = _db_samples(keys, limit, bale, db_before, after, lo, hi, True, line)
+    elif len(recent) < limit:
+        stored = _db_samples(keys, limit - len(recent), bale, db_before, after, lo, hi, False, line)
+    else:
+        stored = iter(())
+    return _json_chunks(recent, stored, limit, ascending)
+
+def _json_chunks(recent, stored, limit, ascending):
+    first = True
+    def chunk(rows):
+        nonlocal first
+        text = ("[" if first else ",") + ",".join(_encode(r) for r in rows)
+        first = False
+        return text
+
+    if ascending:
+        n = 0
+        for rows in stored:
+            n += len(rows)
+            yield chunk(rows)
+        recent = recent[:limit - n]
+        for i in range(0, len(recent), STREAM_CHUNK):
+            yield chunk(recent[i:i + STREAM_CHUNK])
+    else:
+        for i in range(0, len(recent), STREAM_CHUNK):
+            yield chunk(recent[i:i + STREAM_CHUNK])
+        for rows in stored:
+            yield chunk(rows)
+    yield "[]" if first else "]"
+
+def _samples_version() -> tuple[str, float | None]:
+    # What /api/samples returns changes with the newest sample this process
+    # produced (ring, including unflushed rows) and with any commit to the
+    # database (writer, retention, another process): both known without a query.
+    newest = ring.newest()
+    parts = [str(newest[0]) if newest else "-"]
+    modified = newest[1] / 1000.0 if newest else None
+    for path in (db.DB_PATH, db.DB_PATH + "-wal"):
+        try:
+            st = os.stat(path)
+        except OSError:
+            parts.append("-")
+            continue
+        parts.append(f"{st.st_mtime_ns}.{st.st_size}")
+        modified = max(modified or 0.0, st.st_mtime)
+    return ":".join(parts), modified
+
 @app.get("/api/samples")
 def samples(
-    limit: int = Query(200, ge=1, le=5000),
+    request: Request,
+    limit: int = Query(200, ge=1, le=50000),
+    bale: int | None = Query(None, description="Filter by bale_s or bale_i equals this"),
+    before: int | None = Query(None, description="Cursor: ids < before, newest first (pass the last id of a page)"),
+    after: int | None = Query(None, description="Cursor: ids > after, oldest first (pass the last id of a page)"),
+    from_: str | None = Query(None, alias="from", description="Start (epoch ms or ISO)"),
+    to: str | None = Query(None, description="End, exclusive (epoch ms or ISO)"),
+    fields: str | None = Query(None, description="Comma separated keys to return (id is always included)"),
+    line: int | None = Query(None, description="Only samples of this line (line_id)"),
+):
+    if before is not None and after is not None:
+        raise HTTPException(status_code=400, detail="use either before or after")
+    keys = _sample_fields(fields)
+    lo, hi = _parse_time(from_), _parse_time(to)
+
+    # Conditional request: an unchanged view answers 304 before any query runs
+    key = (limit, bale, before, after, lo, hi, keys, line)
+    version, modified = _samples_version()
+    tag = httpcache.etag(key, version)
+    headers = {"ETag": tag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if modified is not None:
+        headers["Last-Modified"] = httpcache.http_date(modified)
+    if httpcache.not_modified(request.headers, tag, modified):
+        samples_cache.count("not_modified")
+        return Response(status_code=304, headers=headers)
+
+    if not samples_cache.caches(limit):
+        samples_cache.count("uncached")
+        return StreamingResponse(
+            _stream_samples(keys, limit, bale, before, after, lo, hi, line),
+            media_type="application/json",
+            headers=headers,
+        )
+    entry = samples_cache.get(key, tag)
+    if entry is None:
+        body = "".join(_stream_samples(keys, limit, bale, before, after, lo, hi, line)).encode()
+        entry = samples_cache.put(key, tag, modified, body)
+    encoding = httpcache.accepted(request.headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(samples_cache.body(key, entry, encoding), media_type="application/json", headers=headers)
+
+@app.get("/api/export")
+def export_samples(
+    format: str = Query("csv", pattern="^(csv|ndjson|arrow|parquet)$"),
+    from_: str | None = Query(None, alias="from", description="Start (epoch ms or ISO)"),
+    to: str | None = Query(None, description="End, exclusive (epoch ms or ISO)"),
     bale: int | None = Query(None, description="Filter by bale_s or bale_i equals this"),
+    fields: str | None = Query(None, description="Comma separated keys to export (id is always included)"),
+    compress: str = Query("none", pattern="^(none|gzip|zstd)$"),
+    line: int | None = Query(None, description="Only samples of this line (line_id)"),
 ):
-    con = _connect()
+    # Bulk download of any range, streamed in batches (constant memory)
+    keys = _sample_fields(fields)
+    lo, hi = _parse_time(from_), _parse_time(to)
     try:
-        if bale is None:
-            cur = con.execute("""
-                SELECT * FROM encoder_samples
-                ORDER BY id DESC
-                LIMIT ?
-            """, (limit,))
+        export.check(format, compress)
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    name = export.filename(format, compress, lo, hi, bale, line)
+    return StreamingResponse(
+        export.stream(format, keys, lo, hi, bale, compress, line=line),
+        media_type=export.media_type(format, compress),
+        headers={"Content-Disposition": f'attachment; filename="{name}"'},
+    )
+
+@app.get("/api/analytics/bales")
+def analytics_bales(
+    limit: int = Query(100, ge=1, le=5000),
+    before: int | None = Query(None, description="Only bales with id < before (paging)"),
+    line: int | None = Query(None, description="Only bales of this line (line_id)"),
+):
+    # Per-bale stroke / ram speed metrics (computed once per finished bale, then cached)
+    with _reader() as con:
+        return JSONResponse(analytics.bale_stats(con, limit, before, line=line))
+
+@app.get("/api/analytics/bales/{bale_number}")
+def analytics_bale(bale_number: int, line: int | None = Query(None, description="Line id (bale numbers are per line)")):
+    with _reader() as con:
+        rows = analytics.bale_stats(con, 1, bale_number=bale_number, line=line)
+        if not rows:
+            raise HTTPException(status_code=404, detail=f"bale {bale_number} not found")
+        return JSONResponse(rows[0])
+
+@app.get("/api/analytics/summary")
+def analytics_summary(
+    limit: int = Query(500, ge=1, le=100000, description="Last N bales"),
+    from_: str | None = Query(None, alias="from", description="Bales starting at/after (epoch ms or ISO)"),
+    to: str | None = Query(None, description="Bales starting before (epoch ms or ISO)"),
+    bins: int = Query(20, ge=1, le=200, description="Bale length histogram bins"),
+    line: int | None = Query(None, description="Only bales of this line (line_id)"),
+):
+    # Distributions across bales, length histogram and outlier bales
+    with _reader() as con:
+        return JSONResponse(analytics.summary(con, limit, _parse_time(from_), _parse_time(to), bins, line))
+
+@app.get("/api/samples/latest")
+def latest_sample(line: int | None = Query(None, description="Latest sample of this line (line_id)")):
+    row = ring.latest(line)
+    if row is not None:
+        return JSONResponse(row)
+    with _reader() as con:
+        if line is None:
+            row = con.execute(db.SAMPLE_SELECT + " ORDER BY s.id DESC LIMIT 1").fetchone()
         else:
-            cur = con.execute("""
-                SELECT * FROM encoder_samples
-                WHERE bale_s = ? OR bale_i = ?
-                ORDER BY id DESC
-                LIMIT ?
-            """, (bale, bale, limit))
+            row = con.execute(db.SAMPLE_SELECT + " WHERE s.line_id = ? ORDER BY s.id DESC LIMIT 1", (line,)).fetchone()
+        if row is None:
+            raise HTTPException(status_code=404, detail="no samples yet")
+        return JSONResponse(db.sample_dict(row))
 
-        out = []
-        for row in cur.fetchall():
-            d = dict(row)
-            d["stroke"] = json.loads(d["stroke_json"]) if d.get("stroke_json") else []
-            d["q_stroke"] = json.loads(d["q_stroke_json"]) if d.get("q_stroke_json") else []
-            d.pop("stroke_json", None)
-            d.pop("q_stroke_json", None)
-            out.append(d)
-        return JSONResponse(out)
-    finally:
-        con.close()
+def _bale_dict(row) -> dict:
+    d = dict(row)
+    d["strokes"] = json.loads(d["stroke_json"]) if d.get("stroke_json") else []
+    d.pop("stroke_json", None)
+    return d
+
+@app.get("/api/bales")
+def bales(
+    limit: int = Query(100, ge=1, le=5000),
+    before: int | None = Query(None, description="Only bales with id < before (paging)"),
+    line: int | None = Query(None, description="Only bales of this line (line_id)"),
+):
+    where, params = [], []
+    if before is not None:
+        where.append("id < ?")
+        params.append(before)
+    if line is not None:
+        where.append("line_id = ?")
+        params.append(line)
+    sql = "SELECT * FROM bales"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    with _reader() as con:
+        cur = con.execute(sql + " ORDER BY id DESC LIMIT ?", (*params, limit))
+        return JSONResponse([_bale_dict(row) for row in cur.fetchall()])
+
+@app.get("/api/bales/{bale_number}")
+def bale(bale_number: int, line: int | None = Query(None, description="Line id (bale numbers are per line)")):
+    with _reader() as con:
+        row = con.execute("""
+            SELECT * FROM bales
+            WHERE bale_number = ? AND (? IS NULL OR line_id = ?)
+            ORDER BY id DESC
+            LIMIT 1
+        """, (bale_number, line, line)).fetchone()
+        if row is None:
+            raise HTTPException(status_code=404, detail=f"bale {bale_number} not found")
+        return JSONResponse(_bale_dict(row))